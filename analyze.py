@@ -0,0 +1,56 @@
+import sys
+import argparse
+from utils.offline_analyzer import load_settings, collect_video_files, run_batch
+
+
+def parse_roi(value):
+    roi = tuple(int(v) for v in value.split(","))
+    if len(roi) != 4:
+        raise argparse.ArgumentTypeError("ROI задается как x,y,w,h")
+    return roi
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Офлайн-анализ записанных видео без графического интерфейса")
+    parser.add_argument("inputs", nargs="+", help="Видеофайлы или каталоги с видео")
+    parser.add_argument("-o", "--output", default="analysis", help="Каталог для результатов")
+    parser.add_argument("--settings", default="settings.json", help="Файл настроек детектора")
+    parser.add_argument("--pipeline", choices=["classic", "yolo", "both"], default="classic")
+    parser.add_argument("--format", choices=["jsonl", "parquet"], default="jsonl")
+    parser.add_argument("--workers", type=int, default=None, help="Кол-во процессов (по умолчанию - все ядра)")
+    parser.add_argument("--roi", type=parse_roi, action="append", help="Зона интереса x,y,w,h (можно несколько)")
+    parser.add_argument("--interval", type=float, default=None,
+                        help="Шаг анализа во времени видео, сек (по умолчанию time_sleep из настроек)")
+    parser.add_argument("--every-frame", action="store_true", help="Анализировать каждый кадр")
+    parser.add_argument("--chunk", type=float, default=300,
+                        help="Длина интервала параллельной обработки одного файла, сек видео (0 - без деления)")
+    parser.add_argument("--yolo-model", default="yolo11n.pt")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    files = collect_video_files(args.inputs)
+    if not files:
+        print("Видеофайлы не найдены")
+        return 1
+
+    pipelines = ("classic", "yolo") if args.pipeline == "both" else (args.pipeline,)
+    report = run_batch(
+        files, args.output, load_settings(args.settings),
+        workers=args.workers,
+        roi_list=args.roi,
+        pipelines=pipelines,
+        output_format=args.format,
+        yolo_model_path=args.yolo_model,
+        sample_interval=0 if args.every_frame else args.interval,
+        chunk_duration=args.chunk,
+    )
+    print(f"Обработано файлов: {len(report['files'])} за {report['total_time']} с. "
+          f"Итог: {args.output}/summary.json")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -2,6 +2,8 @@ import sys
 from PyQt5.QtWidgets import QApplication
 from views.main_window import MainWindow
 from controllers.main_controller import MainController
+from models.settings_manager import settings_manager
+from utils.tracing import tracer
 
 
 class Application:
@@ -11,6 +13,7 @@ class Application:
 
 
 if __name__ == '__main__':
+    tracer.configure(settings_manager.settings)
     app = QApplication(sys.argv)
     application = Application()
     application.view.setWindowTitle('MotionControl')
@@ -10,6 +10,9 @@ from aiogram.enums import ParseMode
 from aiogram.filters import CommandStart
 from aiogram.types import Message, ReplyKeyboardMarkup, KeyboardButton, FSInputFile
 from controllers.detector_manager import DetectorManager
+from models.settings_manager import settings_manager
+from utils.tracing import tracer
+from utils.clip_index import is_clip_file, load_clip_index, describe_clip_index, format_offset, index_paths
 
 
 load_dotenv()
@@ -20,14 +23,16 @@ detector_status = False  # Флаг состояния детектора: True
 user_settings = {}
 video_file_cache = []
 
-detector = DetectorManager(model_mode="classic", yolo_model_path="yolo11x.pt", source=0)
+# Создается в main(): процессы захвата шины кадров импортируют этот модуль заново
+detector = None
 
 main_keyboard = ReplyKeyboardMarkup(
     keyboard=[
         [KeyboardButton(text="🚀 Старт")],
         [KeyboardButton(text="🛑 Стоп")],
         [KeyboardButton(text="⚙️ Настройки")],
-        [KeyboardButton(text="📜 Журнал")]
+        [KeyboardButton(text="📜 Журнал")],
+        [KeyboardButton(text="📈 Активность зон")]
     ],
     resize_keyboard=True
 )
@@ -36,6 +41,7 @@ settings_keyboard = ReplyKeyboardMarkup(
     keyboard=[
         [KeyboardButton(text="📦 YOLO-модель")],
         [KeyboardButton(text="🧠 Классический алгоритм")],
+        [KeyboardButton(text="⏱ Подбор YOLO-модели")],
         [KeyboardButton(text="🧹 Очистить журнал")],
         [KeyboardButton(text="🔙 Назад")]
     ],
@@ -57,9 +63,9 @@ async def handle_start(message: Message):
         await message.answer("⚠️ Сначала выберите модель в настройках.")
         return
 
-    detector.set_model_mode('yolo' if selected_model == "YOLO" else 'classic')
+    await detector.set_model_mode_async('yolo' if selected_model == "YOLO" else 'classic')
     detector.set_notification_target(bot=message.bot, chat_id=message.chat.id)
-    detector.start()
+    await detector.start_async()
 
     detector_status = True
     await message.answer("Детектор запущен.")
@@ -70,7 +76,7 @@ async def handle_start(message: Message):
 async def handle_stop(message: Message):
     global detector_status
     detector_status = False
-    detector.stop()
+    await detector.stop_async()
     await message.answer("Детектор остановлен.")
 
 
@@ -87,7 +93,7 @@ async def handle_settings(message: Message):
 @dp.message(F.text == "📦 YOLO-модель")
 async def handle_yolo_choice(message: Message):
     user_settings[message.chat.id] = "YOLO"
-    detector.set_model_mode('yolo')
+    await detector.set_model_mode_async('yolo')
     await message.answer("Вы выбрали модель: YOLO ✅")
 
 
@@ -95,24 +101,37 @@ async def handle_yolo_choice(message: Message):
 @dp.message(F.text == "🧠 Классический алгоритм")
 async def handle_classic_choice(message: Message):
     user_settings[message.chat.id] = "classic"
-    detector.set_model_mode('classic')
+    await detector.set_model_mode_async('classic')
     await message.answer("Вы выбрали классический алгоритм ✅")
 
 
+@dp.message(F.text == "⏱ Подбор YOLO-модели")
+async def handle_model_benchmark(message: Message):
+    if not detector.benchmark_models():
+        await message.answer("⚠️ Подбор недоступен: не задан yolo_latency_budget или YOLO работает на сервере инференса.")
+        return
+    stats = detector.model_stats()
+    text = f"⏱ Замер моделей под бюджет {stats['budget_ms']} мс запланирован на следующем кадре YOLO."
+    if stats['model']:
+        text += f"\nТекущая модель: <b>{stats['model']}</b>, вход {stats['imgsz']}"
+    await message.answer(text)
+
+
 @dp.message(F.text == "🔙 Назад")
 async def handle_back(message: Message):
     await message.answer("Назад", reply_markup=main_keyboard)
 
 
-@dp.message(F.text == "🧹 Очистить журнал")
-async def handle_clear_history(message: Message):
+def clear_history_files():
+    """Удаление записей, их индексов и журнала (выполняется в пуле потоков); возвращает число клипов"""
     deleted = 0
 
     if os.path.exists("videos"):
         for fname in os.listdir("videos"):
             try:
                 os.remove(os.path.join("videos", fname))
-                deleted += 1
+                # Индекс и миниатюры клипа удаляются, но не считаются отдельными видеофайлами
+                deleted += is_clip_file(fname)
             except Exception:
                 pass
 
@@ -121,7 +140,12 @@ async def handle_clear_history(message: Message):
             os.remove("log.txt")
         except Exception:
             pass
+    return deleted
+
 
+@dp.message(F.text == "🧹 Очистить журнал")
+async def handle_clear_history(message: Message):
+    deleted = await asyncio.to_thread(clear_history_files)
     await message.answer(f"🧹 История очищена. Удалено видеофайлов: {deleted}")
 
 
@@ -132,29 +156,56 @@ def extract_timestamp(fname):
     except Exception:
         return datetime.min
 
+
+def list_clip_files():
+    """Записи по времени события (выполняется в пуле потоков)"""
+    if not os.path.exists("videos"):
+        return []
+    return sorted(filter(is_clip_file, os.listdir("videos")), key=extract_timestamp, reverse=False)
+
+
+def load_clip_summaries(files):
+    """Сводки индексов клипов (выполняется в пуле потоков)"""
+    return [describe_clip_index(load_clip_index(os.path.join("videos", fname))) for fname in files]
+
+
 @dp.message(F.text == "📜 Журнал")
 async def handle_log(message: Message):
     global video_file_cache
 
-    if not os.path.exists("videos"):
-        await message.answer("Журнал пока пуст.")
-        return
-
-    files = sorted(os.listdir("videos"), key=extract_timestamp, reverse=False)
+    files = await asyncio.to_thread(list_clip_files)
     if not files:
         await message.answer("Журнал пока пуст.")
         return
 
     video_file_cache = files[:10]
+    summaries = await asyncio.to_thread(load_clip_summaries, video_file_cache)
 
     text = "📼 <b>Список событий:</b>\n\n"
-    for i, fname in enumerate(video_file_cache):
+    for i, (fname, summary) in enumerate(zip(video_file_cache, summaries)):
         text += f"{i+1}. {fname}\n"
+        if summary:
+            text += f"    <i>{html.quote(summary)}</i>\n"
 
     text += "\nНапиши номер, чтобы получить видео (1–10)."
     await message.answer(text, parse_mode="HTML")
 
 
+@dp.message(F.text == "📈 Активность зон")
+async def handle_activity(message: Message):
+    summary = await asyncio.to_thread(detector.activity_summary, "minute", 60)
+    zones = [zone for zone in summary if zone['peak'] is not None]
+    if not zones:
+        await message.answer("История активности пуста: классический детектор еще не запускался.")
+        return
+
+    text = "📈 <b>Активность зон за час</b> (по минутам):\n\n"
+    for zone in zones:
+        text += (f"Зона {zone['zone'] + 1}: <code>{zone['sparkline']}</code>\n"
+                 f"пик {zone['peak']:.3f}, тревога {zone['alarm_share'] * 100:.0f}% минут\n")
+    await message.answer(text, parse_mode="HTML")
+
+
 @dp.message()
 async def send_video_by_index(msg: Message):
     global video_file_cache
@@ -164,14 +215,30 @@ async def send_video_by_index(msg: Message):
         if 1 <= idx <= len(video_file_cache):
             fname = video_file_cache[idx - 1]
             path = os.path.join("videos", fname)
-            if os.path.exists(path):
-                await msg.answer_video(FSInputFile(path), caption=f"🎥 {fname}")
+            if await asyncio.to_thread(os.path.exists, path):
+                # Полоса миниатюр и пик из индекса клипа - до загрузки самого видео
+                index = await asyncio.to_thread(load_clip_index, path)
+                caption = f"🎥 {fname}"
+                if index:
+                    caption += f"\n{describe_clip_index(index)}"
+                    thumbs = index_paths(path)[1]
+                    if index.get('thumbnails') and await asyncio.to_thread(os.path.exists, thumbs):
+                        times = " | ".join(format_offset(t) for t in index['thumbnails']['times'])
+                        await msg.answer_photo(FSInputFile(thumbs), caption=f"🖼 {times}")
+                await msg.answer_video(FSInputFile(path), caption=caption)
             else:
                 await msg.answer("⚠️ Файл не найден.")
 
 
 
 async def main() -> None:
+    global detector
+    tracer.configure(settings_manager.settings)
+    detector = DetectorManager(model_mode="classic", source=0)
+    if settings_manager.settings["http_api"]:
+        # Импорт по требованию: aiohttp нужен только для HTTP API
+        from utils.http_api import start_http_api
+        await start_http_api(detector, settings_manager.settings)
     bot = Bot(token=TOKEN, default=DefaultBotProperties(parse_mode=ParseMode.HTML))
     await bot.set_my_description(
         "Я — бот для детектирования движения. Запускай анализ, получай уведомления и видео событий."
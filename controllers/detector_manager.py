@@ -1,22 +1,33 @@
 import asyncio
-import tempfile
+import time
 import cv2
-import os
-from aiogram.types import FSInputFile
+from aiogram.types import BufferedInputFile
 from PyQt5.QtCore import QObject, pyqtSlot
 from utils.classic_detector_worker import MotionDetectorWorker
 from utils.yolo_detector_worker import YoloDetector
+from utils.tracing import tracer
+from utils.model_tiering import ModelTiering
+from models.settings_manager import settings_manager
 
 
 class DetectorManager(QObject):
-    def __init__(self, model_mode="yolo", yolo_model_path="yolo11x.pt", source=0):
+    def __init__(self, model_mode="yolo", yolo_model_path=None, source=0):
         super().__init__()
+        settings = settings_manager.settings
         self.model_mode = model_mode
-        self.yolo = YoloDetector(model_path=yolo_model_path, source=source)
+        yolo_model_path = yolo_model_path or settings["yolo_model"]
+        # При yolo_latency_budget модель и размер входа подбираются замером
+        self.tiering = ModelTiering(yolo_model_path, settings["yolo_latency_budget"],
+                                    settings["yolo_model_tiers"], settings["yolo_input_sizes"])
+        self.yolo = YoloDetector(model_path=yolo_model_path, source=source, tiering=self.tiering)
         self.motion = MotionDetectorWorker(is_bot=True)
 
         self.motion.detection_signal.connect(self._on_motion_detected)
+        self.motion.stream_health.connect(self._on_stream_health)
+        self.yolo.stream_health.connect(self._on_stream_health)
+        self.motion.governor_stats.connect(self._on_governor_stats)
         self._motion_callback = None
+        self._control_lock = None       # asyncio.Lock, создается в цикле событий бота
 
 
     def start(self):
@@ -36,6 +47,26 @@ class DetectorManager(QObject):
         self.stop()
         self.start()
 
+    async def _run_control(self, func, *args):
+        """Управление детекторами в пуле потоков: ожидание остановки потоков
+        (join) не блокирует цикл событий, команды разных чатов выполняются по очереди"""
+        if self._control_lock is None:
+            self._control_lock = asyncio.Lock()
+        async with self._control_lock:
+            return await asyncio.to_thread(func, *args)
+
+    async def start_async(self):
+        await self._run_control(self.start)
+
+    async def stop_async(self):
+        await self._run_control(self.stop)
+
+    async def restart_async(self):
+        await self._run_control(self.restart)
+
+    async def set_model_mode_async(self, mode):
+        await self._run_control(self.set_model_mode, mode)
+
     def set_model_mode(self, mode: str):
         """Переключение между 'classic' и 'yolo'"""
         if self.model_mode != mode:
@@ -43,6 +74,36 @@ class DetectorManager(QObject):
             self.model_mode = mode
             self.start()
 
+    def benchmark_models(self):
+        """Повторный подбор модели YOLO под бюджет задержки (на следующем кадре)"""
+        if not self.tiering.enabled or self.yolo.model is None:
+            print("[DetectorManager] Подбор модели выключен (yolo_latency_budget = 0 или сервер инференса)")
+            return False
+        self.tiering.request_benchmark()
+        return True
+
+    def model_stats(self):
+        """Текущая модель YOLO, размер входа и задержка"""
+        return self.tiering.stats()
+
+    def attach_live_hub(self, hub):
+        """Кадры и детекции обоих детекторов - в HTTP API (LiveHub)"""
+        self.motion.set_live_hub(hub)
+        self.yolo.set_live_hub(hub)
+
+    def status(self):
+        detector = self.motion if self.model_mode == "classic" else self.yolo
+        return {
+            'mode': self.model_mode,
+            'running': detector.running,
+            'zones': len(self.motion.zones),
+            'model': self.model_stats() if self.model_mode == "yolo" else None,
+        }
+
+    def activity_summary(self, level="minute", count=60):
+        """Сводка истории плотности зон классического детектора (ActivityHistory.summary)"""
+        return self.motion.history.summary(level, count, time.time())
+
     def set_detection_roi(self, list_rects):
         """Установка ROI только для классического детектора"""
         if self.model_mode == "classic":
@@ -54,17 +115,15 @@ class DetectorManager(QObject):
 
         def send_detection_message(label, frame):
             async def send_alert():
-                try:
-                    with tempfile.NamedTemporaryFile(suffix=".jpg", delete=False) as tmp_img:
-                        img_path = tmp_img.name
-                        cv2.imwrite(img_path, frame)
-
-                    await bot.send_photo(chat_id, FSInputFile(img_path),
+                with tracer.async_span("bot.send_alert", "notify", label=label):
+                    # Кодирование JPEG в пуле потоков, без временного файла
+                    ok, image = await asyncio.to_thread(cv2.imencode, ".jpg", frame)
+                    if not ok:
+                        print(f"[DetectorManager] Не удалось закодировать кадр уведомления: {label}")
+                        return
+                    await bot.send_photo(chat_id, BufferedInputFile(image.tobytes(), "detection.jpg"),
                                          caption=f"🚨 Обнаружено: <b>{label}</b>",
                                          parse_mode="HTML")
-                finally:
-                    if os.path.exists(img_path):
-                        os.remove(img_path)
 
             loop.call_soon_threadsafe(asyncio.create_task, send_alert())
 
@@ -72,6 +131,16 @@ class DetectorManager(QObject):
         self.motion.set_notification_callback(send_detection_message)
         self.yolo.set_notification_callback(send_detection_message)
 
-    @pyqtSlot(list)
+    @pyqtSlot(object)
     def _on_motion_detected(self, detections):
         print("[DetectorManager] Получено событие движения:", detections)
+
+    @pyqtSlot(dict)
+    def _on_stream_health(self, health):
+        print(f"[DetectorManager] Поток {health['source']}: {health['state']}, "
+              f"{health['fps']} кадр/с, переподключений: {health['reconnects']}")
+
+    @pyqtSlot(dict)
+    def _on_governor_stats(self, stats):
+        print(f"[DetectorManager] Анализ {stats['source']}: {stats['rate']} кадр/с, "
+              f"масштаб {stats['scale']}, {stats['cost_ms']} мс/кадр, CPU {stats['cpu']}")
@@ -12,8 +12,11 @@ class MainController:
     def connect_signals(self):
         self.views.signal_run.connect(self.algo_run)
         self.views.signal_send_rect.connect(self.detector.set_detection_roi)
-        self.detector.worker.frame_processed.connect(self.views.put_frame)
+        self.detector.worker.frame_processed.connect(self._show_frame)
         self.detector.worker.detection_signal.connect(self.views.put_detect_status)
+        self.detector.worker.stream_health.connect(self.views.put_stream_health)
+        self.detector.worker.governor_stats.connect(self.views.put_governor_stats)
+        self.detector.worker.objects_detected.connect(self.views.put_objects)
         settings_manager.settings_changed.connect(self._handle_settings_change)
 
 
@@ -24,5 +27,16 @@ class MainController:
             self.detector.stop()
             self.views.clear_holst()
 
+    def _show_frame(self):
+        """Последний кадр детектора; слот кадра освобождается после отрисовки"""
+        display = self.detector.worker.display
+        frames = display.take()
+        if frames is None:
+            return
+        try:
+            self.views.put_frame(*frames)
+        finally:
+            display.release()
+
     def _handle_settings_change(self, new_settings):
         self.detector.worker.apply_current_settings()
\ No newline at end of file
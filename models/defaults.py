@@ -0,0 +1,64 @@
+# Настройки по умолчанию (без PyQt: используются и фоновыми процессами, и утилитами)
+DEFAULT_SETTINGS = {
+    "ostov_size": 3,
+    "p_dop": 0.1,
+    "time_sleep": 0.2,
+    "use_filter": True,
+    "is_webcam": True,
+    "rtsp_or_path": "",
+    "rtsp_substream": "",
+    "rtsp_transport": "tcp",
+    "rtsp_buffer_size": 1048576,
+    "decode_threads": 0,
+    "low_delay": True,
+    "reconnect_max_delay": 30.0,
+    "recording_mode": "auto",
+    "recording_preroll": 5.0,
+    "frame_bus": False,
+    "frame_bus_slots": 16,
+    "cpu_budget": 0.0,
+    "target_fps": 0.0,
+    "min_fps": 1.0,
+    "max_fps": 30.0,
+    "motion_boost": 2.0,
+    "motion_hold": 3.0,
+    "adaptive_resolution": False,
+    "blob_detection": False,
+    "blob_min_area": 0.001,
+    "tile_mode": False,
+    "tile_size": 64,
+    "trace_path": "",
+    "trace_sample_interval": 0.0,
+    "yolo_model": "yolo11x.pt",
+    "yolo_latency_budget": 0.0,
+    "yolo_model_tiers": "nsmlx",
+    "yolo_input_sizes": [640, 480, 320],
+    "yolo_server": "",
+    "yolo_server_autostart": True,
+    "yolo_batch_size": 8,
+    "yolo_batch_window": 0.01,
+    "yolo_server_key": "",
+    "gui_yolo": False,
+    "http_api": False,
+    "http_host": "127.0.0.1",
+    "http_port": 8080,
+    "http_jpeg_quality": 80,
+    "http_token": "",
+    "mv_prefilter": False,
+    "mv_energy_threshold": 0.005,
+    "mv_min_magnitude": 1.0,
+    "clip_index": True,
+    "clip_seek_peak": False,
+    "dvr": False,
+    "dvr_dir": "dvr",
+    "dvr_budget_mb": 4096,
+    "dvr_segment_seconds": 10.0,
+    "dvr_segment_mb": 16,
+    "mask_archive": False,
+    "mask_archive_dir": "masks",
+    "mask_archive_file_mb": 256,
+    "yolo_tracking": False,
+    "yolo_detect_interval": 5,
+    "yolo_motion_trigger": True,
+    "zones": []
+}
@@ -1,6 +1,8 @@
+import copy
 import json
 import os
 from PyQt5.QtCore import QObject, pyqtSignal
+from models.defaults import DEFAULT_SETTINGS
 
 
 class SettingsManager(QObject):
@@ -25,18 +27,11 @@ class SettingsManager(QObject):
         self._initialized = True
 
     def load_defaults(self):
-        self._settings = {
-            "ostov_size": 3,
-            "p_dop": 0.1,
-            "time_sleep": 0.2,
-            "use_filter": True,
-            "is_webcam": True,
-            "rtsp_or_path": ""
-        }
+        self._settings = copy.deepcopy(DEFAULT_SETTINGS)
 
     @property
     def settings(self):
-        return self._settings.copy()
+        return copy.deepcopy(self._settings)
 
     def load_from_file(self):
         try:
@@ -0,0 +1,69 @@
+import sys
+import json
+import time
+import argparse
+from datetime import datetime
+from utils.offline_analyzer import load_settings
+from utils.mask_archive import MaskArchiveReader
+from utils.zones import FULL_FRAME_ZONE
+
+
+def parse_time(value):
+    """Время 'YYYY-mm-dd HH:MM:SS' или секунды epoch"""
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    try:
+        return datetime.strptime(value, "%Y-%m-%d %H:%M:%S").timestamp()
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"Ожидается 'YYYY-mm-dd HH:MM:SS' или секунды: {value}")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Повторный анализ зон по архиву масок изменений (без видео)")
+    parser.add_argument("archive", help="Файл архива масок (.bin или .idx)")
+    parser.add_argument("-o", "--output", default=None, help="JSONL с состоянием зон по маскам")
+    parser.add_argument("--settings", default="settings.json", help="Файл настроек (зоны и пороги)")
+    parser.add_argument("--from", dest="start", type=parse_time, default=None, help="Начало интервала")
+    parser.add_argument("--to", dest="end", type=parse_time, default=None, help="Конец интервала")
+    parser.add_argument("--p-dop", type=float, default=None, help="Порог p_dop вместо настроек")
+    parser.add_argument("--ostov", type=int, default=None, help="Размер остова вместо настроек")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    settings = load_settings(args.settings)
+    if args.p_dop is not None:
+        settings["p_dop"] = args.p_dop
+    if args.ostov is not None:
+        settings["ostov_size"] = args.ostov
+
+    reader = MaskArchiveReader(args.archive)
+    zones = settings["zones"] or [FULL_FRAME_ZONE]
+    started = time.time()
+    alarms = masks = 0
+    output = open(args.output, "w", encoding="utf-8") if args.output else None
+    try:
+        for now, records in reader.replay(zones, settings, args.start, args.end):
+            masks += 1
+            alarms += bool(records['detected'].any())
+            if output is not None:
+                output.write(json.dumps({
+                    'time': round(now, 3),
+                    'zones': [{'zone': int(r['zone']), 'detected': bool(r['detected']),
+                               'activity': round(float(r['activity']), 4)} for r in records],
+                }) + "\n")
+    finally:
+        if output is not None:
+            output.close()
+
+    print(f"Масок: {masks}, с тревогой: {alarms} (p_dop={settings['p_dop']}, ostov_size={settings['ostov_size']}) "
+          f"за {time.time() - started:.2f} с")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,72 @@
+"""Горячий цикл кадра в установившемся режиме не выделяет память под кадры"""
+import tracemalloc
+
+import numpy as np
+import pytest
+
+from models.defaults import DEFAULT_SETTINGS
+from utils.detections import DetectionBuffer
+from utils.motion_algorithm import MotionBuffers
+from utils.pipeline import ZoneStage, FrameContext
+from utils.recorder import FrameRing
+from utils.tiles import TileMotion
+from utils.zones import ZoneSet
+
+
+WIDTH, HEIGHT = 1280, 720
+WARMUP_FRAMES = 5
+MEASURED_FRAMES = 30
+NET_LIMIT = 16 * 1024               # Остаток после кадров (байт)
+PEAK_LIMIT = 256 * 1024             # Прирост пика - меньше любого буфера кадра (серый 720p - 900 КБ)
+
+ZONES = [
+    (0.1, 0.1, 0.4, 0.5),                                   # Прямоугольник
+    [(0.5, 0.2), (0.9, 0.3), (0.8, 0.9), (0.55, 0.7)],      # Многоугольник
+]
+
+
+def make_frames(count):
+    """Кадры с движущимся квадратом, чтобы маска и плотность зон менялись"""
+    frames = []
+    for i in range(count):
+        frame = np.full((HEIGHT, WIDTH, 3), 40, np.uint8)
+        x = 100 + (i % 20) * 50
+        frame[200:400, x:x + 200] = 220
+        frames.append(frame)
+    return frames
+
+
+@pytest.mark.parametrize("use_filter", [True, False])
+def test_steady_state_frames_do_not_allocate(use_filter):
+    settings = dict(DEFAULT_SETTINGS, use_filter=use_filter, p_dop=0.01, ostov_size=3)
+    buffers = MotionBuffers()
+    detections = DetectionBuffer()
+    zone_stage = ZoneStage(ZoneSet(ZONES), detections, TileMotion())
+    zone_stage.configure(settings)
+    ring = FrameRing(8)
+    ctx = FrameContext()
+    frames = make_frames(WARMUP_FRAMES + MEASURED_FRAMES)
+
+    def run(frame):
+        ring.append(frame)                      # Предзапись клипа
+        ctx.clear(frame, 0.0)
+        ctx.diff_thresh = buffers.motion_mask(frame, use_filter)
+        if ctx.diff_thresh is not None:
+            zone_stage.process(ctx)
+            detections.commit()
+
+    for frame in frames[:WARMUP_FRAMES]:
+        run(frame)
+
+    tracemalloc.start()
+    try:
+        baseline, _ = tracemalloc.get_traced_memory()
+        tracemalloc.reset_peak()
+        for frame in frames[WARMUP_FRAMES:]:
+            run(frame)
+        current, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    assert current - baseline < NET_LIMIT
+    assert peak - baseline < PEAK_LIMIT
@@ -0,0 +1,65 @@
+import sys
+import json
+import argparse
+from utils.offline_analyzer import load_settings
+from utils.param_sweep import load_labels, run_sweep
+from utils.governor import SCALE_STEPS
+
+
+def parse_list(cast):
+    def parse(value):
+        try:
+            return [cast(v) for v in value.split(",") if v]
+        except ValueError:
+            raise argparse.ArgumentTypeError(f"Ожидается список через запятую: {value}")
+    return parse
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Подбор p_dop, ostov_size и use_filter по размеченным клипам")
+    parser.add_argument("labels", help="JSON-разметка клипов с интервалами ожидаемой тревоги")
+    parser.add_argument("-o", "--output", default="sweep.json", help="Файл с результатами")
+    parser.add_argument("--settings", default="settings.json", help="Файл настроек (зоны по умолчанию)")
+    parser.add_argument("--p-dop", type=parse_list(float),
+                        default=[0.005, 0.01, 0.02, 0.05, 0.1, 0.2], help="Значения p_dop через запятую")
+    parser.add_argument("--ostov", type=parse_list(int), default=[1, 3, 5, 7],
+                        help="Размеры остова через запятую")
+    parser.add_argument("--filter", choices=["on", "off", "both"], default="both",
+                        help="Значения use_filter")
+    parser.add_argument("--interval", type=float, default=None,
+                        help="Шаг анализа во времени видео, сек (по умолчанию time_sleep из настроек)")
+    parser.add_argument("--every-frame", action="store_true", help="Разность соседних кадров")
+    parser.add_argument("--scale", type=float, choices=SCALE_STEPS, default=1.0,
+                        help="Масштаб кадра анализа (как у RateGovernor при adaptive_resolution)")
+    parser.add_argument("--workers", type=int, default=None, help="Кол-во процессов (по умолчанию - все ядра)")
+    parser.add_argument("--top", type=int, default=10, help="Сколько лучших комбинаций вывести")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    clips = load_labels(args.labels)
+    if not clips:
+        print("В разметке нет клипов")
+        return 1
+
+    filters = {"on": [True], "off": [False], "both": [False, True]}[args.filter]
+    report = run_sweep(clips, args.p_dop, args.ostov, filters, load_settings(args.settings),
+                       workers=args.workers, sample_interval=0 if args.every_frame else args.interval,
+                       scale=args.scale)
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=4, ensure_ascii=False)
+
+    print(f"{'use_filter':>10} {'p_dop':>7} {'ostov':>5} {'precision':>9} {'recall':>7} "
+          f"{'f1':>6} {'events':>6} {'fa/h':>7} {'ms/кадр':>8}")
+    for r in report['results'][:args.top]:
+        print(f"{str(r['use_filter']):>10} {r['p_dop']:>7} {r['ostov_size']:>5} {str(r['precision']):>9} "
+              f"{str(r['recall']):>7} {r['f1']:>6} {str(r['event_recall']):>6} "
+              f"{str(r['false_alarms_per_hour']):>7} {r['cost_ms_per_frame']:>8}")
+    print(f"Комбинаций: {len(report['results'])} за {report['total_time']} с. Итог: {args.output}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,167 @@
+import threading
+import numpy as np
+
+
+# Уровни истории: (имя, шаг в секундах, число интервалов) - 10 минут, сутки, 30 суток
+HISTORY_LEVELS = (("second", 1, 600), ("minute", 60, 1440), ("hour", 3600, 720))
+SPARK_CHARS = "▁▂▃▄▅▆▇█"
+
+
+class _Level:
+    """Кольцевой буфер одного разрешения: максимум плотности и факт тревоги по интервалам"""
+
+    __slots__ = ("name", "step", "slots", "activity", "detected", "bucket", "first")
+
+    def __init__(self, name, step, slots):
+        self.name = name
+        self.step = step
+        self.slots = slots
+        self.activity = np.zeros((slots, 0), np.float32)
+        self.detected = np.zeros((slots, 0), np.bool_)
+        self.bucket = None          # Номер текущего интервала (время // step)
+        self.first = None           # Первый интервал с данными
+
+    def allocate(self, zones):
+        self.activity = np.full((self.slots, zones), np.nan, np.float32)
+        self.detected = np.zeros((self.slots, zones), np.bool_)
+        self.bucket = None
+        self.first = None
+
+
+class ActivityHistory:
+    """История плотности и тревог по зонам с постоянным объемом памяти.
+
+    Каждый уровень (секунды, минуты, часы) - кольцевой массив NumPy
+    (интервалы x зоны), в интервал пишется максимум плотности и признак
+    тревоги. Уровни копятся независимо из одних и тех же отсчетов. Отсчеты
+    приходят только при изменениях, поэтому пропущенные интервалы
+    заполняются последним состоянием; после pause() - «нет данных» (NaN).
+    """
+
+    def __init__(self, levels=HISTORY_LEVELS):
+        self.levels = {name: _Level(name, step, slots) for name, step, slots in levels}
+        self.zones = 0
+        self._last_activity = np.zeros(0, np.float32)
+        self._last_detected = np.zeros(0, np.bool_)
+        self._lock = threading.Lock()
+
+    @property
+    def nbytes(self):
+        return sum(level.activity.nbytes + level.detected.nbytes for level in self.levels.values())
+
+    def reset(self, zones=0):
+        """Очистка истории (новый набор зон)"""
+        with self._lock:
+            self._reset(zones)
+
+    def add(self, now, activity, detected):
+        """Отсчет состояния всех зон: плотности и признаки тревоги (массивы по зонам)"""
+        with self._lock:
+            if len(activity) != self.zones:
+                self._reset(len(activity))
+            for level in self.levels.values():
+                bucket = int(now // level.step)
+                self._advance(level, bucket)
+                slot = bucket % level.slots
+                row = level.activity[slot]
+                # NaN (нет данных) в начале интервала заменяется отсчетом
+                np.fmax(row, activity, out=row)
+                level.detected[slot] |= detected
+            self._last_activity[:] = activity
+            self._last_detected[:] = detected
+
+    def pause(self, now):
+        """Детектор остановлен: дальнейшие интервалы без данных"""
+        with self._lock:
+            for level in self.levels.values():
+                self._advance(level, int(now // level.step))
+            self._last_activity.fill(np.nan)
+            self._last_detected.fill(False)
+
+    def version(self, level="second"):
+        """Номер текущего интервала уровня - меняется не чаще шага уровня"""
+        return self.levels[level].bucket
+
+    def series(self, level="second", count=None, now=None):
+        """(начала интервалов, плотности [count x зоны], тревоги) от старых к новым.
+
+        Интервалы до первого отсчета и без данных - NaN в плотности.
+        """
+        with self._lock:
+            data = self.levels[level]
+            count = min(count or data.slots, data.slots)
+            if data.bucket is None:
+                return (np.zeros(0), np.zeros((0, self.zones), np.float32),
+                        np.zeros((0, self.zones), np.bool_))
+            if now is not None:
+                self._advance(data, int(now // data.step))
+            buckets = np.arange(data.bucket - count + 1, data.bucket + 1)
+            slots = buckets % data.slots
+            activity = data.activity[slots]
+            detected = data.detected[slots]
+            missing = buckets < data.first
+            activity[missing] = np.nan
+            detected[missing] = False
+            return buckets * data.step, activity, detected
+
+    def summary(self, level="minute", count=60, now=None):
+        """Сводка по зонам за count интервалов: пик, средняя плотность, доля интервалов с тревогой"""
+        _, activity, detected = self.series(level, count, now)
+        known = ~np.isnan(activity)
+        result = []
+        for zone in range(activity.shape[1]):
+            values = activity[known[:, zone], zone]
+            result.append({
+                'zone': zone,
+                'peak': float(values.max()) if values.size else None,
+                'mean': float(values.mean()) if values.size else None,
+                'alarm_share': float(detected[:, zone].sum() / values.size) if values.size else None,
+                'sparkline': sparkline(activity[:, zone]),
+            })
+        return result
+
+    def _reset(self, zones):
+        self.zones = zones
+        for level in self.levels.values():
+            level.allocate(zones)
+        self._last_activity = np.full(zones, np.nan, np.float32)
+        self._last_detected = np.zeros(zones, np.bool_)
+
+    def _advance(self, level, bucket):
+        """Переход к интервалу bucket; пропущенные интервалы - последнее состояние"""
+        if level.bucket is None:
+            level.bucket = level.first = bucket
+            level.activity[bucket % level.slots] = np.nan
+            level.detected[bucket % level.slots] = False
+            return
+        if bucket <= level.bucket:
+            return
+        gap = bucket - level.bucket
+        if gap > level.slots:
+            level.activity[:] = self._last_activity
+            level.detected[:] = self._last_detected
+        else:
+            slots = np.arange(level.bucket + 1, bucket) % level.slots
+            level.activity[slots] = self._last_activity
+            level.detected[slots] = self._last_detected
+        # Новый интервал начинается с последнего состояния: оно длится и в нем
+        level.activity[bucket % level.slots] = self._last_activity
+        level.detected[bucket % level.slots] = self._last_detected
+        level.bucket = bucket
+
+
+def sparkline(values, width=30):
+    """Строка из символов ▁..█ по последним width значениям (NaN - пробел)"""
+    values = np.asarray(values, np.float32)
+    if values.size > width:
+        # Максимум по равным группам интервалов
+        edges = np.linspace(0, values.size, width + 1).astype(int)
+        values = np.array([np.nanmax(values[a:b]) if np.any(~np.isnan(values[a:b])) else np.nan
+                           for a, b in zip(edges[:-1], edges[1:])], np.float32)
+    known = ~np.isnan(values)
+    if not known.any():
+        return " " * len(values)
+    top = max(float(values[known].max()), 1e-6)
+    levels = np.zeros(len(values), np.int64)
+    levels[known] = np.minimum((values[known] / top * (len(SPARK_CHARS) - 1)).round(), len(SPARK_CHARS) - 1)
+    return "".join(SPARK_CHARS[level] if ok else " " for level, ok in zip(levels, known))
@@ -1,15 +1,26 @@
 import os
 import time
-import cv2
-import numpy as np
 import threading
-import collections
 from PyQt5.QtCore import QObject, pyqtSignal
 from models.settings_manager import settings_manager
+from utils.motion_algorithm import MotionBuffers
+from utils.zones import ZoneSet, FULL_FRAME_ZONE
+from utils.detections import DetectionBuffer
+from utils.tiles import TileMotion
+from utils.pipeline import MotionPipeline, PendingSettings, DeltaSink, AlarmSink, HistorySink, CallbackSink, motion_stages
+from utils.activity_history import ActivityHistory
+from utils.mask_archive import MaskArchiveSink
+from utils.video_source import VideoSource, FrameGrabber, resolve_sources, source_config
+from utils.recorder import create_recorder
+from utils.frame_bus import open_capture
+from utils.motion_vectors import MotionEnergy, open_motion_vector_source
+from utils.governor import RateGovernor
 
 
 class MotionDetectorWorker(QObject):
-    detection_signal = pyqtSignal(list)
+    detection_signal = pyqtSignal(object)      # DetectionDelta
+    stream_health = pyqtSignal(dict)
+    governor_stats = pyqtSignal(dict)
 
     RECORDING_TIME = 5              # Время записи (сек)
     STORAGE_TIME = 7                # Время хранения записей (дней)
@@ -20,62 +31,120 @@ class MotionDetectorWorker(QObject):
         self.running = False
         self.thread = None
         self.cap = None
-        self.roi_list = []
+        self.record_grabber = None
+        self.recorder = None
+        self.zones = ZoneSet([FULL_FRAME_ZONE] if is_bot else [])
+        self.detections = DetectionBuffer()
+        self.history = ActivityHistory()        # История плотности зон (секунды/минуты/часы)
+        self.tiles = TileMotion()
+        self.buffers = MotionBuffers()
+        self.motion_energy = MotionEnergy()     # Предфильтр по векторам движения кодека
+        self.prefilter = False
         self.is_bot = is_bot
 
         self.notification_callback = None
+        self.live_hub = None            # LiveHub HTTP API (кадры и изменения зон)
 
         self.video_dir = "videos"
         os.makedirs(self.video_dir, exist_ok=True)
 
-        self.last_motion_time = 0
-
+        self.governor = RateGovernor(settings_manager.settings, "motion", self.governor_stats.emit)
+        self._record_frame = None
+        self.mask_sink = MaskArchiveSink("MotionDetectorWorker")  # Архив масок (mask_archive)
+        # Этапы: масштаб -> маска изменений -> зоны -> архив масок, уведомление и запись,
+        # индекс клипа, история, детекции
+        self.pipeline = MotionPipeline("motion", motion_stages(
+            self.zones, self.detections, self.governor, self.buffers, self.tiles) + [
+            self.mask_sink,
+            AlarmSink(self._on_alarm, self.REPEAT_DETECTION_COOLDOWN),
+            CallbackSink("index", self._annotate_clip, "notify"),
+            HistorySink(self.detections, self.history),
+            DeltaSink(self.detections, self._publish_delta),
+        ], self.governor)
+
+        self.pending_settings = PendingSettings()
         self._connect_settings()
         self.apply_current_settings()
+        self._apply_pending_settings()
 
     def _connect_settings(self):
         settings_manager.settings_changed.connect(self._on_settings_changed)
 
     def apply_current_settings(self):
+        """Источник - сразу; этапы анализа - в потоке анализа между кадрами (_apply_pending_settings)"""
         settings = settings_manager.settings
+        self.is_webcam = settings["is_webcam"]
+        self.rtsp_or_path = settings["rtsp_or_path"]
+        self.source_config = source_config(settings)
+        self.pending_settings.put(settings)
+
+    def _apply_pending_settings(self):
+        settings = self.pending_settings.take()
+        if settings is None:
+            return
         self.ostov_size = settings["ostov_size"]
         self.p_dop = settings["p_dop"]
         self.time_sleep = settings["time_sleep"]
         self.use_filter = settings["use_filter"]
-        self.is_webcam = settings["is_webcam"]
-        self.rtsp_or_path = settings["rtsp_or_path"]
-        self.ostov_template = np.ones((self.ostov_size, self.ostov_size), dtype=np.uint8)
+        if not self.is_bot:
+            self.zones.set_zones(settings["zones"])
+        self.tile_mode = settings["tile_mode"]
+        self.governor.configure(settings)
+        self.pipeline.configure(settings)
+        self.motion_energy.configure(settings)
 
     def set_notification_callback(self, callback):
         self.notification_callback = callback
 
+    def set_live_hub(self, hub):
+        self.live_hub = hub
+
     def set_roi(self, roi_list):
-        self.roi_list = [tuple(map(int, roi)) for roi in roi_list if len(roi) == 4]
+        self.zones.set_zones(roi_list)
 
     def start(self):
         if not self.running:
             self.running = True
-            self.thread = threading.Thread(target=self._run, daemon=True)
+            self.thread = threading.Thread(target=self._run, name="MotionDetectorWorker", daemon=True)
             self.thread.start()
 
     def stop(self):
         self.running = False
-        if self.cap and self.cap.isOpened():
-            self.cap.release()
+        if self.cap:
+            self.cap.stop()
+        if self.record_grabber:
+            self.record_grabber.source.stop()
         if self.thread:
             self.thread.join()
 
     def _on_settings_changed(self, new_settings):
+        config = self.source_config
         self.apply_current_settings()
-        if self.running and ("is_webcam" in new_settings or "rtsp_or_path" in new_settings):
+        if self.running and config != self.source_config:
             self.stop()
             self.start()
 
     def _init_video_capture(self):
-        if self.is_webcam:
-            self.cap = cv2.VideoCapture(0)
-        else:
-            self.cap = cv2.VideoCapture(self.rtsp_or_path) if self.rtsp_or_path else cv2.VideoCapture(0)
+        source, record_source = resolve_sources(self.source_config)
+        self.cap = None
+        if self.source_config["mv_prefilter"]:
+            # Кадры без движения по векторам кодека не проходят пиксельный анализ
+            self.cap = open_motion_vector_source(source, self.source_config, self.stream_health.emit)
+        self.prefilter = self.cap is not None
+        if self.cap is None:
+            self.cap = open_capture(source, self.source_config, self.stream_health.emit)
+
+        self.recorder = create_recorder(settings_manager.settings, record_source or source,
+                                        self.video_dir, self.RECORDING_TIME, "MotionDetectorWorker")
+        self.recorder.start()
+
+        # Для записи с перекодированием основной поток высокого качества
+        # декодируется отдельно; при перепаковке он не декодируется вовсе
+        self.record_grabber = None
+        if record_source and self.recorder.uses_frames:
+            self.record_grabber = FrameGrabber(
+                VideoSource.from_settings(record_source, self.source_config, self.stream_health.emit))
+            self.record_grabber.start()
 
     def _cleanup_old_videos(self):
         now = time.time()
@@ -84,116 +153,102 @@ class MotionDetectorWorker(QObject):
             if os.path.isfile(fpath) and now - os.path.getmtime(fpath) > self.STORAGE_TIME * 86400:
                 os.remove(fpath)
 
+    def _needs_frames(self):
+        """Кадр нужен и без движения: запись с перекодированием или зрители HTTP API"""
+        return self.recorder.uses_frames or (self.live_hub is not None and self.live_hub.viewers > 0)
+
+    def _on_quiet_frame(self, quiet_frames):
+        """Кадр без движения по векторам: зоны сбрасываются без пиксельного анализа"""
+        if not quiet_frames:
+            energy = self.motion_energy.energy
+            if len(energy) == len(self.detections.records):
+                self.detections.clear(energy)
+                records = self.detections.records
+                # До следующего движения история и индекс клипа продолжают это состояние
+                now = time.time()
+                self.history.add(now, records['activity'], records['detected'])
+                self.recorder.annotate(now, records['activity'], records['detected'])
+                delta = self.detections.commit()
+                if delta is not None:
+                    self._publish_delta(delta)
+        return quiet_frames + 1
+
+    def _publish_delta(self, delta):
+        self.detection_signal.emit(delta)
+        # Сигналы Qt в процессе бота не доставляются (нет цикла событий Qt)
+        if self.live_hub is not None:
+            self.live_hub.publish_delta(delta)
+
+    def _on_alarm(self, ctx):
+        if self.notification_callback:
+            self.notification_callback("motion", self._record_frame.copy())
+        self.recorder.trigger("motion", "обнаружено движение")
+
+    def _annotate_clip(self, ctx):
+        """Плотности зон и миниатюра кадра анализа - в индекс записываемого клипа"""
+        records = self.detections.records
+        self.recorder.annotate(ctx.now, records['activity'], records['detected'], frame=ctx.analysis)
+
     def _run(self):
         print("[MotionDetectorWorker] Классическая детекция запущена")
         self._init_video_capture()
         self._cleanup_old_videos()
-        prev_gray = None
-
-        frame_buffer = collections.deque(maxlen=150)  # ~5 сек при 30 FPS
-        recording = False
-        recording_start = 0
-        video_writer = None
-        video_path = None
-
-        last_process_time = time.time()
-
-        while self.running and self.cap.isOpened():
-            ret, frame = self.cap.read()
+        self._apply_pending_settings()
+        self.mask_sink.cleanup(self.STORAGE_TIME)
+        self.pipeline.reset()
+        self.governor.start()
+
+        quiet_frames = 0
+        while self.running:
+            self._apply_pending_settings()
+            quiet = False
+            if self.prefilter:
+                if not self.cap.grab():
+                    break
+                quiet = self.motion_energy.is_quiet(self.cap.vectors, self.cap.frame_size, self.zones.zones)
+                if quiet and not self._needs_frames():
+                    quiet_frames = self._on_quiet_frame(quiet_frames)
+                    continue
+                ret, frame = self.cap.retrieve()
+            else:
+                ret, frame = self.cap.read()
             if not ret:
                 break
 
             now = time.time()
-            frame_buffer.append(frame.copy())
-
-            if self.is_bot:
-                height, width = frame.shape[:2]
-                self.roi_list = [(0, 0, width, height)]
-
-            if now - last_process_time < self.time_sleep:
-                if recording and video_writer:
-                    video_writer.write(frame)
+            record_frame = frame
+            if self.record_grabber:
+                record_frame = self.record_grabber.latest()
+                if record_frame is None:
+                    record_frame = frame
+            if self.recorder.uses_frames:
+                self.recorder.push(record_frame)
+            if self.live_hub is not None:
+                self.live_hub.publish_frame(frame)
+
+            if quiet:
+                quiet_frames = self._on_quiet_frame(quiet_frames)
                 continue
-            last_process_time = now
-
-            gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
-            if self.use_filter:
-                gray = cv2.GaussianBlur(gray, (21, 21), 0)
-
-            if prev_gray is None:
-                prev_gray = gray
+            if quiet_frames:
+                # Предыдущий кадр пиксельного анализа устарел - начинаем с нового
+                quiet_frames = 0
+                self.buffers.reset()
+                if self.tile_mode:
+                    self.tiles.reset()
+            if not self.governor.due(now):
                 continue
 
-            diff = cv2.absdiff(gray, prev_gray)
-            _, diff_thresh = cv2.threshold(diff, 25, 255, cv2.THRESH_BINARY)
-            if self.use_filter:
-                diff_thresh = cv2.morphologyEx(diff_thresh, cv2.MORPH_OPEN, np.ones((5, 5), np.uint8))
-
-            prev_gray = gray.copy()
-
-            detections = []
-            motion_detected = False
-            for roi in self.roi_list:
-                x, y, w, h = map(int, roi)
-                roi_mask = diff_thresh[y:y + h, x:x + w]
-                if roi_mask.size == 0:
-                    detections.append({'roi': roi, 'detected': False, 'activity': 0.0})
-                    continue
-
-                img_bin = (roi_mask // 255).astype(np.uint8)
-                p = np.sum(img_bin) / img_bin.size
-
-                if p < self.p_dop:
-                    detections.append({'roi': roi, 'detected': False, 'activity': p})
-                    continue
-
-                found = self._scan_for_template(img_bin, self.ostov_template)
-                detections.append({'roi': roi, 'detected': found, 'activity': p})
-
-                if found:
-                    current_time = time.time()
-                    if current_time - self.last_motion_time > self.REPEAT_DETECTION_COOLDOWN:
-                        motion_detected = True
-                        self.last_motion_time = current_time
-                        if self.notification_callback:
-                            self.notification_callback("motion", frame.copy())
-
-            if motion_detected and not recording:
-                recording = True
-                recording_start = time.time()
-                height, width = frame.shape[:2]
-                fourcc = cv2.VideoWriter_fourcc(*'mp4v')
-                timestamp = time.strftime("%Y-%m-%d_%H-%M-%S")
-                filename = f"{timestamp}_motion.mp4"
-                video_path = os.path.join(self.video_dir, filename)
-                video_writer = cv2.VideoWriter(video_path, fourcc, 20.0, (width, height))
-                for f in frame_buffer:
-                    video_writer.write(f)
-                print(f"[MotionDetectorWorker] Начата запись: {video_path}")
-
-            if recording and video_writer:
-                video_writer.write(frame)
-                if time.time() - recording_start > self.RECORDING_TIME:
-                    recording = False
-                    video_writer.release()
-                    video_writer = None
-                    with open("log.txt", "a", encoding="utf-8") as log:
-                        log.write(f"{timestamp} — обнаружено движение — {filename}\n")
-                    print(f"[MotionDetectorWorker] Завершена запись: {video_path}")
-
-            self.detection_signal.emit(detections)
+            self._record_frame = record_frame
+            self.pipeline.process(frame, now)
 
+        self.governor.stop()
+        self.history.pause(time.time())
+        self.mask_sink.close()
+        if self.prefilter:
+            print(f"[MotionDetectorWorker] Предфильтр по векторам движения: {self.motion_energy.stats()}")
         self.cap.release()
-        if video_writer:
-            video_writer.release()
-        print("[MotionDetectorWorker] Остановлен")
-
-    def _scan_for_template(self, area_matrix, template):
-        h, w = template.shape
-        H, W = area_matrix.shape
-        for y in range(H - h + 1):
-            for x in range(W - w + 1):
-                block = area_matrix[y:y + h, x:x + w]
-                if np.array_equal(block, template):
-                    return True
-        return False
+        if self.record_grabber:
+            self.record_grabber.stop()
+        self.recorder.close()
+        self._record_frame = None
+        print(f"[MotionDetectorWorker] Остановлен, этапы конвейера, мс/кадр: {self.pipeline.stats()}")
@@ -0,0 +1,243 @@
+import os
+import json
+import threading
+import collections
+import cv2
+import numpy as np
+
+
+INDEX_SUFFIX = ".index.json"    # Индекс клипа: videos/<клип>.index.json
+THUMBS_SUFFIX = ".thumbs.jpg"   # Полоса миниатюр: videos/<клип>.thumbs.jpg
+THUMB_HEIGHT = 72               # Высота миниатюры (пикс.)
+THUMB_INTERVAL = 1.0            # Не чаще одной миниатюры в секунду
+THUMB_COUNT = 8                 # Миниатюр в полосе
+SEEK_MARGIN = 2.0               # Перемотка к пику начинается раньше на (сек)
+
+
+def index_paths(video_path):
+    """(путь индекса, путь полосы миниатюр) клипа"""
+    base = os.path.splitext(video_path)[0]
+    return base + INDEX_SUFFIX, base + THUMBS_SUFFIX
+
+
+def is_clip_file(fname):
+    """Файл клипа, а не индекс или миниатюры"""
+    return fname.endswith(".mp4")
+
+
+def load_clip_index(video_path):
+    """Индекс клипа (словарь) или None, если его нет"""
+    if not isinstance(video_path, str):
+        return None
+    path = index_paths(video_path)[0]
+    try:
+        with open(path, encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def seek_offset(index, margin=SEEK_MARGIN):
+    """Смещение (сек) для перемотки к пику: ближайший ключевой кадр не позже пика - margin"""
+    peak = index.get('peak') if index else None
+    if not peak:
+        return 0.0
+    target = max(0.0, peak['t'] - margin)
+    keyframes = [t for t in index.get('keyframes', ()) if t <= target]
+    return keyframes[-1] if keyframes else target
+
+
+def format_offset(seconds):
+    return f"{int(seconds) // 60}:{int(seconds) % 60:02d}"
+
+
+def describe_clip_index(index):
+    """Краткая сводка индекса: пик, зоны с тревогой, объекты"""
+    if not index:
+        return ""
+    parts = []
+    peak = index.get('peak')
+    if peak:
+        text = f"пик {format_offset(peak['t'])}"
+        if peak.get('activity') is not None:
+            text += f" (p={peak['activity']:.2f}, зона {peak['zone'] + 1})"
+        parts.append(text)
+    hits = sorted({zone for second in index['seconds'] for zone in second['hits']})
+    if hits:
+        parts.append("зоны " + ", ".join(str(zone + 1) for zone in hits))
+    labels = sorted({label for second in index['seconds'] for label in second['labels']})
+    if labels:
+        parts.append(", ".join(labels))
+    return "; ".join(parts)
+
+
+def make_thumbnail(frame):
+    height, width = frame.shape[:2]
+    size = (max(int(width * THUMB_HEIGHT / height), 1), THUMB_HEIGHT)
+    return cv2.resize(frame, size, interpolation=cv2.INTER_AREA)
+
+
+class ClipIndex:
+    """Индекс одного клипа: посекундная активность зон, объекты, ключевые кадры, миниатюры.
+
+    Отметки приходят во времени детектора (time.time()); рекордер задает
+    соответствие времени и смещения в файле (sync), и при записи индекса
+    отметки переводятся в секунды клипа.
+    """
+
+    def __init__(self, video_path, label):
+        self.video_path = video_path
+        self.label = label
+        self.samples = []           # (время, плотности, тревоги, метки)
+        self.thumbnails = []        # (время, миниатюра)
+        self.keyframes = []         # Смещения ключевых кадров (сек)
+        self._clock = []            # (время, смещение в клипе)
+
+    def sync(self, wall, offset):
+        self._clock.append((wall, offset))
+
+    def keyframe(self, offset):
+        self.keyframes.append(round(offset, 3))
+
+    def add(self, wall, activity=None, detected=None, labels=None, thumbnail=None):
+        if activity is not None or labels:
+            self.samples.append((wall, activity, detected, labels))
+        if thumbnail is not None:
+            self.thumbnails.append((wall, thumbnail))
+
+    def write(self, duration):
+        """Запись индекса и полосы миниатюр рядом с клипом"""
+        index_path, thumbs_path = index_paths(self.video_path)
+        index = self._build(duration)
+        strip = self._thumbnail_strip()
+        if strip is not None:
+            times, image = strip
+            if cv2.imwrite(thumbs_path, image):
+                index['thumbnails'] = {'file': os.path.basename(thumbs_path), 'times': times,
+                                       'width': image.shape[1] // len(times), 'height': image.shape[0]}
+        with open(index_path, "w", encoding="utf-8") as f:
+            json.dump(index, f, ensure_ascii=False, separators=(",", ":"))
+        return index
+
+    def _offsets(self, times):
+        """Время детектора -> смещение в клипе по точкам sync"""
+        if not self._clock:
+            return np.zeros(len(times))
+        wall, offset = np.array(self._clock, np.float64).T
+        if len(wall) == 1:
+            return np.maximum(np.asarray(times) - wall[0] + offset[0], 0.0)
+        return np.interp(times, wall, offset)
+
+    def _build(self, duration):
+        seconds = {}
+        peak = None
+        offsets = self._offsets([sample[0] for sample in self.samples])
+        for offset, (_, activity, detected, labels) in zip(offsets, self.samples):
+            offset = min(float(offset), duration)
+            second = seconds.setdefault(int(offset), {'activity': None, 'hits': set(), 'labels': set()})
+            if activity is not None and len(activity):
+                values = second['activity']
+                if values is None or len(values) != len(activity):
+                    second['activity'] = values = np.zeros(len(activity), np.float32)
+                np.maximum(values, activity, out=values)
+                second['hits'].update(np.flatnonzero(detected).tolist())
+                zone = int(np.argmax(activity))
+                if peak is None or peak.get('activity') is None or activity[zone] > peak['activity']:
+                    peak = {'t': round(offset, 2), 'activity': round(float(activity[zone]), 4), 'zone': zone}
+            if labels:
+                second['labels'].update(labels)
+                if peak is None:
+                    # Без плотностей (YOLO) пик - первое появление объекта
+                    peak = {'t': round(offset, 2), 'activity': None, 'zone': None}
+        return {
+            'version': 1,
+            'clip': os.path.basename(self.video_path),
+            'label': self.label,
+            'duration': round(duration, 2),
+            'seconds': [{'t': t,
+                         'activity': [round(float(v), 4) for v in s['activity']] if s['activity'] is not None else [],
+                         'hits': sorted(s['hits']), 'labels': sorted(s['labels'])}
+                        for t, s in sorted(seconds.items())],
+            'peak': peak,
+            'keyframes': self.keyframes,
+            'thumbnails': None,
+        }
+
+    def _thumbnail_strip(self):
+        """(смещения, изображение) - до THUMB_COUNT миниатюр, равномерно по клипу"""
+        if not self.thumbnails:
+            return None
+        picks = np.unique(np.linspace(0, len(self.thumbnails) - 1, THUMB_COUNT).round().astype(int))
+        chosen = [self.thumbnails[i] for i in picks]
+        size = chosen[0][1].shape[1::-1]
+        images = [image if image.shape[1::-1] == size else cv2.resize(image, size) for _, image in chosen]
+        times = [round(float(t), 2) for t in self._offsets([wall for wall, _ in chosen])]
+        return times, cv2.hconcat(images)
+
+
+class ClipAnnotator:
+    """Отметки детектора для индекса клипов рекордера.
+
+    До срабатывания отметки за последние preroll секунд копятся в буфере
+    (они относятся к предзаписи клипа), после open() - пишутся в индекс
+    текущего клипа. Миниатюры уменьшаются сразу и не чаще THUMB_INTERVAL.
+    Вызывается из потока детектора и потока записи.
+    """
+
+    def __init__(self, preroll=5.0, enabled=True):
+        self.preroll = preroll
+        self.enabled = enabled
+        self.index = None
+        self._pending = collections.deque()
+        self._last_thumbnail = 0.0
+        self._lock = threading.Lock()
+
+    def annotate(self, wall, activity=None, detected=None, labels=None, frame=None):
+        if not self.enabled:
+            return
+        thumbnail = None
+        if frame is not None and wall - self._last_thumbnail >= THUMB_INTERVAL:
+            self._last_thumbnail = wall
+            thumbnail = make_thumbnail(frame)
+        if activity is not None:
+            activity = np.array(activity, np.float32)
+            detected = np.array(detected, np.bool_)
+        with self._lock:
+            if self.index is not None:
+                self.index.add(wall, activity, detected, labels, thumbnail)
+                return
+            self._pending.append((wall, activity, detected, labels, thumbnail))
+            while self._pending and self._pending[0][0] < wall - self.preroll:
+                self._pending.popleft()
+
+    def open(self, video_path, label):
+        """Индекс нового клипа с отметками предзаписи; None, если индекс выключен"""
+        if not self.enabled:
+            return None
+        with self._lock:
+            self.index = ClipIndex(video_path, label)
+            for entry in self._pending:
+                self.index.add(*entry)
+            self._pending.clear()
+            return self.index
+
+    def detach(self):
+        """Отметки больше не идут в индекс текущего клипа; индекс (или None)"""
+        with self._lock:
+            index, self.index = self.index, None
+        return index
+
+    def close(self, duration, log_tag="Recorder"):
+        """Запись индекса завершенного клипа"""
+        return write_clip_index(self.detach(), duration, log_tag)
+
+
+def write_clip_index(index, duration, log_tag="Recorder"):
+    """ClipIndex.write() с сообщением об ошибке вместо исключения"""
+    if index is None:
+        return None
+    try:
+        return index.write(duration)
+    except OSError as e:
+        print(f"[{log_tag}] Не удалось записать индекс клипа: {e}")
+        return None
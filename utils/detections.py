@@ -0,0 +1,130 @@
+import numpy as np
+
+
+DETECTION_DTYPE = np.dtype([
+    ('zone', np.int32),             # Индекс зоны
+    ('roi', np.int32, (4,)),        # Ограничивающий прямоугольник зоны (x, y, w, h) в пикселях
+    ('detected', np.bool_),         # Движение недопустимо
+    ('activity', np.float32),       # Относительная плотность изменений
+    ('time', np.float32),           # Время анализа зоны (сек)
+])
+
+ACTIVITY_STEP = 0.01                # Изменение плотности меньше шага не отправляется
+
+
+class DetectionDelta:
+    """Изменения состояния зон за кадр - то, что передается сигналом detection_signal"""
+
+    __slots__ = ("records", "count", "polygons", "blobs")
+
+    def __init__(self, records, count, polygons=None, blobs=None):
+        self.records = records      # Измененные записи (DETECTION_DTYPE)
+        self.count = count          # Общее число зон
+        self.polygons = polygons    # Вершины многоугольников по зонам (None для прямоугольника) - только при смене зон
+        self.blobs = blobs          # {индекс зоны: связные области} для измененных зон или None
+
+    @property
+    def layout_changed(self):
+        return self.polygons is not None
+
+    def __repr__(self):
+        states = ", ".join(f"{r['zone']}:{'!' if r['detected'] else ''}{r['activity']:.2f}"
+                           for r in self.records)
+        return f"DetectionDelta({len(self.records)}/{self.count}: {states})"
+
+
+class DetectionBuffer:
+    """Записи детекции на стороне детектора.
+
+    Массив записей создается при смене зон и переиспользуется между кадрами;
+    commit() возвращает только зоны, у которых с прошлой отправки изменилось
+    состояние или плотность (не меньше чем на ACTIVITY_STEP).
+    """
+
+    def __init__(self):
+        self.records = np.zeros(0, DETECTION_DTYPE)
+        self.blobs = []
+        self._sent = np.zeros(0, DETECTION_DTYPE)
+        self._zones = None
+        self._layout_changed = True
+
+    def begin(self, zones):
+        """Подготовка к кадру по списку CompiledZone из ZoneSet.prepare()"""
+        if zones is self._zones:
+            return
+        self._zones = zones
+        self.records = np.zeros(len(zones), DETECTION_DTYPE)
+        self.records['zone'] = np.arange(len(zones))
+        for i, zone in enumerate(zones):
+            self.records['roi'][i] = zone.roi
+        self._sent = self.records.copy()
+        self.blobs = [None] * len(zones)
+        self._layout_changed = True
+
+    def reset(self):
+        """Следующий commit() отправит состояние всех зон (новый запуск детектора)"""
+        self._zones = None
+
+    def set(self, index, detected, activity, elapsed=0.0, blobs=None):
+        self.records['detected'][index] = detected
+        self.records['activity'][index] = activity
+        self.records['time'][index] = elapsed
+        self.blobs[index] = blobs
+
+    def clear(self, activity=None):
+        """Движения нет ни в одной зоне (кадр отсеян без пиксельного анализа).
+
+        activity - оценка плотности по зонам (например, по векторам движения кодека).
+        """
+        self.records['detected'] = False
+        self.records['activity'] = 0.0 if activity is None else activity
+        self.records['time'] = 0.0
+        self.blobs = [None] * len(self.records)
+
+    def any_detected(self):
+        return bool(self.records['detected'].any())
+
+    def commit(self):
+        """Изменения с прошлой отправки (DetectionDelta) или None, если их нет"""
+        if self._layout_changed:
+            changed = np.arange(len(self.records))
+        else:
+            changed = np.flatnonzero(
+                (self.records['detected'] != self._sent['detected'])
+                | (np.abs(self.records['activity'] - self._sent['activity']) >= ACTIVITY_STEP))
+            if not changed.size:
+                return None
+
+        records = self.records[changed]
+        self._sent[changed] = records
+        polygons = [zone.points for zone in self._zones] if self._layout_changed else None
+        blobs = {int(i): self.blobs[i] for i in changed if self.blobs[i] is not None}
+        self._layout_changed = False
+        return DetectionDelta(records, len(self.records), polygons, blobs or None)
+
+
+class DetectionState:
+    """Текущее состояние зон на стороне получателя, собираемое из DetectionDelta"""
+
+    def __init__(self):
+        self.records = np.zeros(0, DETECTION_DTYPE)
+        self.polygons = []
+        self.blobs = []
+
+    def apply(self, delta):
+        if delta.layout_changed or delta.count != len(self.records):
+            self.records = np.zeros(delta.count, DETECTION_DTYPE)
+            self.polygons = delta.polygons or [None] * delta.count
+            self.blobs = [None] * delta.count
+        self.records[delta.records['zone']] = delta.records
+        if delta.blobs:
+            for index, blobs in delta.blobs.items():
+                self.blobs[index] = blobs
+
+    def clear(self):
+        self.records = np.zeros(0, DETECTION_DTYPE)
+        self.polygons = []
+        self.blobs = []
+
+    def __len__(self):
+        return len(self.records)
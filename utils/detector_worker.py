@@ -1,50 +1,99 @@
 import time
 import cv2
-import numpy as np
 from PyQt5.QtCore import QObject, pyqtSignal, pyqtSlot
 from models.settings_manager import settings_manager
+from utils.motion_algorithm import MotionBuffers
+from utils.zones import ZoneSet
+from utils.detections import DetectionBuffer
+from utils.pipeline import MotionPipeline, PendingSettings, DisplayMailbox, DisplaySink, DeltaSink, CallbackSink, motion_stages
+from utils.video_source import resolve_sources, source_config
+from utils.frame_bus import open_capture
+from utils.governor import RateGovernor
+from utils.tracing import tracer
+from utils.inference_server import get_inference_client
+from utils.clip_index import load_clip_index, seek_offset, describe_clip_index
+from utils.mask_archive import MaskArchiveSink
 
 
 class MotionDetectorWorker(QObject):
-    frame_processed = pyqtSignal(np.ndarray, np.ndarray)
-    detection_signal = pyqtSignal(list)
+    frame_processed = pyqtSignal()             # Новый кадр в display (DisplayMailbox)
+    detection_signal = pyqtSignal(object)      # DetectionDelta
+    stream_health = pyqtSignal(dict)
+    governor_stats = pyqtSignal(dict)
+    objects_detected = pyqtSignal(list)        # [(label, confidence, box)] от сервера инференса YOLO
     finished = pyqtSignal()
 
     def __init__(self):
         super().__init__()
         self.running = False
         self.cap = None
-        self.roi_list = []
+        self.zones = ZoneSet()
+        self.detections = DetectionBuffer()
+        self.buffers = MotionBuffers()              # Буферы кадра под текущее разрешение
         self.accumulated_diff = None
         self.activity_map = None
         self.current_object_mask = None
+        self.governor = RateGovernor(settings_manager.settings, "gui", self.governor_stats.emit)
+        self.yolo_client = None
+        self._yolo_pending = False                  # Кадр отправлен на сервер, ответа еще нет
+        self.mask_sink = MaskArchiveSink("MotionDetectorWorker")  # Архив масок (mask_archive)
+        self.display = DisplayMailbox(self.frame_processed.emit)  # Последний кадр для интерфейса
+        # Этапы: масштаб -> маска изменений -> зоны -> архив масок, отображение, детекции, YOLO
+        self.pipeline = MotionPipeline("detector", motion_stages(
+            self.zones, self.detections, self.governor, self.buffers) + [
+            self.mask_sink,
+            DisplaySink(self.display),
+            DeltaSink(self.detections, self.detection_signal.emit),
+            CallbackSink("yolo", self._submit_yolo),
+        ], self.governor)
 
         # Инициализация параметров
+        self.pending_settings = PendingSettings()
         self._connect_settings()
         self.apply_current_settings()
+        self._apply_pending_settings()
 
     def _connect_settings(self):
         settings_manager.settings_changed.connect(self._on_settings_changed)
 
     def apply_current_settings(self):
-        """Обновление параметров из менеджера настроек"""
+        """Обновление параметров из менеджера настроек (вызывается из потока интерфейса).
+
+        Источник обновляется сразу, остальное применяет поток анализа
+        между кадрами (_apply_pending_settings).
+        """
         settings = settings_manager.settings
+        self.is_webcam = settings["is_webcam"]
+        self.rtsp_or_path = settings["rtsp_or_path"]
+        self.source_config = source_config(settings)     # Источник и параметры захвата
+        self.pending_settings.put(settings)
+
+    def _apply_pending_settings(self):
+        settings = self.pending_settings.take()
+        if settings is None:
+            return
         self.ostov_size = settings["ostov_size"]        # Размер остова, задает форму активности (паттерн)
         self.p_dop = settings['p_dop']                  # Порог чувствительности
 
         self.time_sleep = settings['time_sleep']
         self.use_filter = settings["use_filter"]
-        self.is_webcam = settings["is_webcam"]
-        self.rtsp_or_path = settings["rtsp_or_path"]
-
-        self.ostov_template = np.ones((self.ostov_size, self.ostov_size), dtype=np.uint8)  # Остов из единиц
+        self.zones.set_zones(settings["zones"])          # Зоны интереса (прямоугольники и многоугольники)
+        self.governor.configure(settings)               # Частота (и разрешение) анализа
+        # Остов, связные области (blob_detection), плитки (tile_mode) - в этапах конвейера
+        self.pipeline.configure(settings)
+        self.clip_seek_peak = settings["clip_seek_peak"]  # Клип с индексом - анализ с пика
+        self.gui_yolo = settings["gui_yolo"]              # Объекты YOLO поверх кадра (через сервер инференса)
+        self.yolo_client = get_inference_client(settings) if self.gui_yolo else None
+        if self.gui_yolo and self.yolo_client is None:
+            print("[MotionDetectorWorker] gui_yolo требует адрес сервера инференса (yolo_server)")
 
 
     @pyqtSlot(dict)
     def _on_settings_changed(self, new_settings):
         """Обработка изменений настроек"""
+        config = self.source_config
         self.apply_current_settings()
-        if self.running and ("is_webcam" in new_settings or "rtsp_or_path" in new_settings):
+        if self.running and config != self.source_config:
             self.restart_detector()
 
     def restart_detector(self):
@@ -56,110 +105,77 @@ class MotionDetectorWorker(QObject):
     def start_detection(self):
         """Запуск процесса детекции"""
         self.running = True
+        self._apply_pending_settings()
         self._init_video_capture()
         self.accumulated_diff = None
         self.activity_map = None
+        self.governor.start()
         self.process_frames()
 
     def _init_video_capture(self):
-        """Инициализация видеопотока"""
-        if self.cap and self.cap.isOpened():
+        """Инициализация видеопотока (при наличии подпотока анализ идет по нему)"""
+        if self.cap:
             self.cap.release()
-        if self.is_webcam:
-            self.cap = cv2.VideoCapture(0)
-        else:
-            self.cap = cv2.VideoCapture(self.rtsp_or_path) if self.rtsp_or_path else cv2.VideoCapture(0)
+        source, _ = resolve_sources(self.source_config)
+        self.cap = open_capture(source, self.source_config, self.stream_health.emit)
+        if self.clip_seek_peak:
+            self._seek_to_peak(source)
+
+    def _seek_to_peak(self, source):
+        """Перемотка записанного клипа к пику активности по его индексу"""
+        index = load_clip_index(source)
+        if index is None or not index.get('peak') or not hasattr(self.cap, "seek"):
+            return
+        offset = seek_offset(index)
+        if self.cap.seek(offset):
+            print(f"[MotionDetectorWorker] Клип с {offset:.1f} сек: {describe_clip_index(index)}")
 
     @pyqtSlot()
     def stop_detection(self):
         """Остановка процесса детекции"""
         self.running = False
-        if self.cap and self.cap.isOpened():
+        self.governor.stop()
+        if self.cap:
             self.cap.release()
         cv2.destroyAllWindows()
         self.finished.emit()
 
     @pyqtSlot(list)
     def set_roi(self, roi_list):
-        """Обновление списка областей интереса"""
-        self.roi_list = [tuple(map(int, roi)) for roi in roi_list if len(roi) == 4]
+        """Обновление списка зон интереса (в относительных координатах кадра)"""
+        self.zones.set_zones(roi_list)
 
     def process_frames(self):
         """Обработка кадров с анализом изменений на основе p_dop и ostov"""
 
-        prev_gray = None
+        self.pipeline.reset()
+        tracer.name_thread("detector")
+        frame_index = 0
 
         while self.running:
+            self._apply_pending_settings()
             ret, frame = self.cap.read()
             if not ret:
                 break
+            frame_index += 1
 
-            gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
-            if self.use_filter:
-                gray = cv2.GaussianBlur(gray, (21, 21), 0)
-
-            if prev_gray is None:
-                prev_gray = gray
-                continue
-
-            # 1. Вычисляем разницу между текущим и предыдущим кадром
-            diff = cv2.absdiff(gray, prev_gray)
-            _, diff_thresh = cv2.threshold(diff, 25, 255, cv2.THRESH_BINARY)
-
-            if self.use_filter:
-                diff_thresh = cv2.morphologyEx(diff_thresh, cv2.MORPH_OPEN, np.ones((5, 5), np.uint8))
-
-            prev_gray = gray.copy()  # Обновляем предыдущий кадр
-
-            detections = []
-            for idx, roi in enumerate(self.roi_list):
-                if len(roi) != 4:
-                    continue
-                time_start = time.time()
-                x, y, w, h = map(int, roi)
-                roi_mask = diff_thresh[y:y + h, x:x + w]
-                if roi_mask.size == 0:
-                    time_end = time.time()
-                    detections.append({'roi': roi, 'detected': False, 'activity': 0.0, 'time': time_end - time_start})
-                    continue
-
-                # 2: Бинаризация
-                img_anobl = (roi_mask // 255).astype(np.uint8)
-                # 3: Кол-во единиц
-                b = np.sum(img_anobl)
-                # 4: Относительная плотность
-                p = b / img_anobl.size
-
-                if p < self.p_dop:
-                    # Если уровень активности меньше порога, то допустимое движение
-                    time_end = time.time()
-                    detections.append({'roi': roi, 'detected': False, 'activity': p, 'time': time_end - time_start})
-                    continue
-
-                # 5: Поиск остова
-                found = self._scan_for_template(img_anobl, self.ostov_template)
-                # if found: движение недопустимо
-                # else: движение допустимо
-                time_end = time.time()
-                detections.append({'roi': roi, 'detected': found, 'activity': p, 'time': time_end - time_start})
-
-            rgb_frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-            bin_frame = cv2.cvtColor(diff_thresh, cv2.COLOR_GRAY2RGB)
-            self.frame_processed.emit(rgb_frame, bin_frame)
-            self.detection_signal.emit(detections)
-
-            time.sleep(self.time_sleep)
+            with tracer.span("detector.frame", "detector", frame=frame_index):
+                self.pipeline.process(frame)
+            time.sleep(self.governor.remaining(time.time()))
 
+        self.mask_sink.close()
+        print(f"[MotionDetectorWorker] Этапы конвейера, мс/кадр: {self.pipeline.stats()}")
         self.stop_detection()
 
-    def _scan_for_template(self, area_matrix, template):
-        """Проверка, есть ли в area_matrix блок, совпадающий с template"""
-        h, w = template.shape
-        H, W = area_matrix.shape
-
-        for y in range(H - h + 1):
-            for x in range(W - w + 1):
-                block = area_matrix[y:y + h, x:x + w]
-                if np.array_equal(block, template):
-                    return True
-        return False
\ No newline at end of file
+    def _submit_yolo(self, ctx):
+        if self.yolo_client is not None and not self._yolo_pending:
+            # Не больше одного кадра в обработке: пока сервер занят, кадры не копятся
+            self._yolo_pending = True
+            if not self.yolo_client.submit(ctx.analysis, self._on_objects):
+                self._yolo_pending = False
+
+    def _on_objects(self, objects):
+        """Ответ сервера инференса (вызывается из потока приема клиента)"""
+        self._yolo_pending = False
+        if objects is not None:
+            self.objects_detected.emit(objects)
@@ -0,0 +1,373 @@
+import io
+import os
+import json
+import time
+import shutil
+import threading
+from utils.recorder import RemuxRecorder, write_log_entry, is_live_url
+from utils.clip_index import write_clip_index
+
+
+SEGMENT_RESERVE = 1 << 20       # Запас слота на буферы муксера (байт)
+RING_INDEX = "ring.json"
+PTS_WRAP = 1 << 33              # Переполнение меток времени MPEG-TS (в единицах потока)
+
+
+class SegmentRing:
+    """Кольцо предвыделенных файлов сегментов с фиксированным бюджетом диска.
+
+    Все слоты создаются заранее одного размера (posix_fallocate, где он
+    есть), и сегменты пишутся в них поверх прежних данных без усечения:
+    файлы не растут и не фрагментируются, объем на диске постоянен.
+    Действительная длина сегмента, время начала и конца и номер поколения
+    слота хранятся в ring.json; данные за длиной - остаток старого сегмента.
+    """
+
+    def __init__(self, directory, budget_bytes, segment_bytes, log_tag="DVR"):
+        self.directory = directory
+        self.segment_bytes = int(segment_bytes)
+        self.log_tag = log_tag
+        os.makedirs(directory, exist_ok=True)
+        slots = max(2, int(budget_bytes // self.segment_bytes))
+        free = shutil.disk_usage(directory).free + self._allocated(slots)
+        if slots * self.segment_bytes > free:
+            slots = max(2, int(free * 0.9 // self.segment_bytes))
+            print(f"[{log_tag}] Бюджет DVR больше свободного места, слотов: {slots}")
+        self.slots = slots
+        self.segments = [None] * slots     # Слот -> {generation, start, end, stream_start, size}
+        self.generation = 0
+        self._lock = threading.Lock()
+        self._preallocate()
+        self._load()
+
+    def path(self, slot):
+        return os.path.join(self.directory, f"segment_{slot:04d}.ts")
+
+    @property
+    def capacity(self):
+        """Допустимый размер сегмента (байт)"""
+        return max(self.segment_bytes - SEGMENT_RESERVE, self.segment_bytes // 2)
+
+    def open_next(self):
+        """(слот, файл) следующего сегмента; прежнее содержимое слота сразу недействительно"""
+        with self._lock:
+            slot = self.generation % self.slots
+            self.generation += 1
+            self.segments[slot] = None
+        return slot, open(self.path(slot), "r+b")
+
+    def commit(self, slot, start, end, stream_start, size):
+        """Сегмент записан: его метаданные - в кольцо и в ring.json"""
+        with self._lock:
+            self.segments[slot] = {'generation': self.generation - 1, 'start': start, 'end': end,
+                                   'stream_start': stream_start, 'size': size}
+            self._save()
+
+    def find(self, start, end):
+        """Записанные сегменты, пересекающие [start, end], по времени: [(слот, метаданные)]"""
+        with self._lock:
+            found = [(slot, dict(meta)) for slot, meta in enumerate(self.segments)
+                     if meta is not None and meta['end'] >= start and meta['start'] <= end]
+        return sorted(found, key=lambda item: item[1]['generation'])
+
+    def read(self, slot, meta):
+        """Данные сегмента или None, если слот уже перезаписан"""
+        with open(self.path(slot), "rb") as f:
+            data = f.read(meta['size'])
+        with self._lock:
+            current = self.segments[slot]
+            if current is None or current['generation'] != meta['generation']:
+                return None
+        return data
+
+    def _allocated(self, slots):
+        total = 0
+        for slot in range(slots):
+            try:
+                total += os.path.getsize(self.path(slot))
+            except OSError:
+                pass
+        return total
+
+    def _preallocate(self):
+        for slot in range(self.slots):
+            path = self.path(slot)
+            if os.path.exists(path) and os.path.getsize(path) == self.segment_bytes:
+                continue
+            with open(path, "ab") as f:
+                f.truncate(0)
+                if hasattr(os, "posix_fallocate"):
+                    os.posix_fallocate(f.fileno(), 0, self.segment_bytes)
+                else:
+                    f.truncate(self.segment_bytes)
+        print(f"[{self.log_tag}] Кольцо DVR: {self.slots} слотов по "
+              f"{self.segment_bytes >> 20} МБ в {self.directory}")
+
+    def _load(self):
+        """Продолжение кольца после перезапуска (если размеры слотов не менялись)"""
+        try:
+            with open(os.path.join(self.directory, RING_INDEX), encoding="utf-8") as f:
+                saved = json.load(f)
+        except (OSError, ValueError):
+            return
+        if saved.get('slots') != self.slots or saved.get('segment_bytes') != self.segment_bytes:
+            return
+        self.segments = saved['segments']
+        self.generation = saved['generation']
+
+    def _save(self):
+        path = os.path.join(self.directory, RING_INDEX)
+        with open(path + ".tmp", "w", encoding="utf-8") as f:
+            json.dump({'slots': self.slots, 'segment_bytes': self.segment_bytes,
+                       'generation': self.generation, 'segments': self.segments}, f)
+        os.replace(path + ".tmp", path)
+
+
+class DvrRecorder(RemuxRecorder):
+    """Непрерывная запись сетевого потока в кольцо сегментов (SegmentRing).
+
+    Пакеты основного потока перепаковываются в сегменты MPEG-TS длиной
+    segment_seconds; сегмент сменяется только на ключевом кадре - раньше
+    срока, если следующая GOP (по наибольшей из замеченных) не поместится в
+    слот. Срабатывание не открывает отдельную запись: событие - ссылка на
+    интервал кольца [событие - preroll, событие + recording_time]. Когда
+    сегмент с концом интервала закрыт, клип вырезается из кольца в videos/
+    перепаковкой пакетов, без декодирования и кодирования. При обрыве
+    потока события ждут записи после переподключения, пока не пройдет их конец.
+    """
+
+    def __init__(self, url, video_dir, recording_time, log_tag="Recorder", preroll=5.0,
+                 transport="tcp", reconnect_max_delay=30.0, annotator=None, dvr_dir="dvr",
+                 budget_mb=4096, segment_seconds=10.0, segment_mb=16):
+        super().__init__(url, video_dir, recording_time, log_tag, preroll, transport,
+                         reconnect_max_delay, annotator)
+        self.ring = SegmentRing(dvr_dir, budget_mb << 20, segment_mb << 20, log_tag)
+        self.segment_seconds = segment_seconds
+        self._segment = None                # (слот, файл, контейнер, поток, начало, время потока)
+        self._segment_end = 0.0
+        self._gop_bytes = 0                 # Размер текущей GOP (байт)
+        self._gop_peak = 0                  # Наибольшая GOP потока (байт)
+        self._skipping = False              # GOP не помещается в слот - пакеты до ключевого кадра пропускаются
+        self._events = []                   # События, ожидающие закрытия сегмента с их концом
+        self._cuts = []
+
+    @property
+    def recording(self):
+        # Новое событие - после окончания интервала текущего
+        return any(event['index_open'] for event in self._events)
+
+    def trigger(self, label, description):
+        with self._lock:
+            now = time.time()
+            self._expire_events(now)
+            if self.recording:
+                return False
+            timestamp = time.strftime("%Y-%m-%d_%H-%M-%S")
+            video_path = os.path.join(self.video_dir, f"{timestamp}_{label}.mp4")
+            self._events.append({
+                'start': now - self.preroll, 'end': now + self.recording_time,
+                'video_path': video_path, 'index_open': True,
+                'index': self.annotator.open(video_path, label),
+                'log_message': f"{timestamp} — {description} — {os.path.basename(video_path)}",
+            })
+        return True
+
+    def close(self):
+        super().close()
+        for thread in self._cuts:
+            thread.join()
+
+    def _expire_events(self, now):
+        """Интервал события закончился - отметки детектора больше не нужны (под _lock)"""
+        for event in self._events:
+            if event['index_open'] and now > event['end']:
+                event['index_open'] = False
+                self.annotator.detach()
+
+    def _on_packet(self, packet, stream):
+        ts = packet.pts if packet.pts is not None else packet.dts
+        packet_time = float(ts * packet.time_base)
+        now = time.time()
+        self._wall_offset = now - packet_time
+        with self._lock:
+            self._expire_events(now)
+
+        # Сегменты меняет только этот поток - запись на диск идет без блокировки
+        if packet.is_keyframe:
+            self._gop_peak = max(self._gop_peak, self._gop_bytes)
+            self._gop_bytes = 0
+            self._skipping = False
+            if self._segment is None or self._segment_full(packet_time):
+                self._close_segment()
+                self._open_segment(stream, packet_time, now)
+        elif self._segment is None or self._skipping:
+            return
+        elif self._segment[1].tell() + packet.size > self.ring.capacity:
+            # Одна GOP больше слота: сегмент не должен выйти за слот и начинаться не с ключевого кадра
+            self._skipping = True
+            print(f"[{self.log_tag}] GOP не помещается в слот DVR, пакеты до ключевого кадра "
+                  f"пропущены (увеличьте dvr_segment_mb)")
+            return
+        self._gop_bytes += packet.size
+        self._segment_end = now
+        packet.stream = self._segment[3]
+        self._segment[2].mux(packet)
+
+    def _segment_full(self, packet_time):
+        """Пора начать новый сегмент (проверяется на ключевом кадре)"""
+        elapsed = packet_time - self._segment[5]
+        if not 0 <= elapsed < self.segment_seconds:
+            # Срок сегмента вышел (или метки времени потока переполнились)
+            return True
+        # Следующая GOP должна поместиться в слот целиком
+        return self._segment[1].tell() + self._gop_peak > self.ring.capacity
+
+    def _open_segment(self, stream, packet_time, now):
+        import av
+        slot, f = self.ring.open_next()
+        container = av.open(f, "w", format="mpegts")
+        self._segment = (slot, f, container, container.add_stream_from_template(stream), now, packet_time)
+
+    def _close_segment(self):
+        if self._segment is None:
+            return
+        slot, f, container, _, start, stream_start = self._segment
+        self._segment = None
+        container.close()
+        size = f.tell()
+        f.close()
+        self.ring.commit(slot, start, self._segment_end, stream_start, size)
+
+        # События, интервал которых целиком в кольце, - в клипы
+        with self._lock:
+            ready = [event for event in self._events if event['end'] <= self._segment_end]
+            self._events = [event for event in self._events if event not in ready]
+        for event in ready:
+            self._start_cut(event)
+
+    def _close_output(self):
+        # Конец потока: сегмент закрывается. При обрыве события, интервал которых
+        # еще не закончился, ждут записи после переподключения; при остановке
+        # (или конце файла) все события вырезаются из того, что записано
+        self._close_segment()
+        final = self._stop_event.is_set() or not is_live_url(self.url)
+        now = time.time()
+        with self._lock:
+            ready = [event for event in self._events if final or event['end'] <= now]
+            self._events = [event for event in self._events if event not in ready]
+            for event in ready:
+                if event['index_open']:
+                    event['index_open'] = False
+                    self.annotator.detach()
+        for event in ready:
+            self._start_cut(event)
+
+    def _start_cut(self, event):
+        thread = threading.Thread(target=self._cut, args=(event,), daemon=True)
+        self._cuts = [cut for cut in self._cuts if cut.is_alive()] + [thread]
+        thread.start()
+
+    def _cut(self, event):
+        try:
+            duration = self.export(event['start'], event['end'], event['video_path'], event['index'])
+        except Exception as e:
+            print(f"[{self.log_tag}] Не удалось вырезать клип {event['video_path']}: {e}")
+            return
+        if duration is None:
+            print(f"[{self.log_tag}] Интервал события уже перезаписан в кольце: {event['video_path']}")
+            return
+        write_clip_index(event['index'], duration, self.log_tag)
+        write_log_entry(event['log_message'])
+        print(f"[{self.log_tag}] Клип из кольца DVR: {event['video_path']}")
+
+    def export(self, start, end, video_path, index=None):
+        """Клип [start, end] (время time.time()) из кольца в mp4 без перекодирования.
+
+        Начало - последний ключевой кадр не позже start. Сегменты читаются
+        по отдельности, и время пакетов отсчитывается от начала своего
+        сегмента: между сегментами метки потока могут начаться заново
+        (переподключение) или переполниться. Длительность клипа (сек) или
+        None, если сегментов интервала в кольце уже нет.
+        """
+        import av
+        sources = []
+        entries = []                # (пакет, время, сегмент, dts, pts) - метки без переполнений
+        try:
+            for slot, meta in self.ring.find(start, end):
+                data = self.ring.read(slot, meta)
+                if data is None:
+                    continue
+                source = av.open(io.BytesIO(data), format="mpegts")
+                sources.append(source)
+                entries.extend(self._segment_packets(source, meta, len(sources) - 1))
+            if not entries:
+                return None
+
+            begin = 0
+            for i, (packet, wall, *_) in enumerate(entries):
+                if wall > start:
+                    break
+                if packet.is_keyframe:
+                    begin = i
+            stop = next((i for i, entry in enumerate(entries) if entry[1] > end), len(entries))
+            entries = entries[begin:stop]
+            if not entries:
+                return None
+
+            stream = sources[entries[0][2]].streams.video[0]
+            time_base = stream.time_base
+            output = av.open(video_path, "w")
+            try:
+                output_stream = output.add_stream_from_template(stream)
+                first_wall = entries[0][1]
+                segment = None
+                shift = 0
+                last_dts = None
+                for packet, wall, number, dts, pts in entries:
+                    if number != segment:
+                        # Начало сегмента в клипе - по его времени, метки сегмента - от его первого пакета
+                        segment = number
+                        shift = round((wall - first_wall) / time_base) - dts
+                        if last_dts is not None:
+                            shift = max(shift, last_dts + 1 - dts)
+                    offset = wall - first_wall
+                    if index is not None:
+                        index.sync(wall, offset)
+                        if packet.is_keyframe:
+                            index.keyframe(offset)
+                    last_dts = dts + shift
+                    packet.dts = last_dts
+                    packet.pts = pts + shift if pts is not None else None
+                    packet.stream = output_stream
+                    output.mux(packet)
+            finally:
+                output.close()
+            return entries[-1][1] - first_wall
+        finally:
+            for source in sources:
+                source.close()
+
+    @staticmethod
+    def _segment_packets(source, meta, number):
+        """Пакеты сегмента: время пакета - начало сегмента (meta['start']) плюс смещение в нем"""
+        stream = source.streams.video[0]
+        time_base = stream.time_base
+        entries = []
+        origin = None
+        wrap = 0
+        previous = None
+        for packet in source.demux(stream):
+            if packet.dts is None:
+                continue
+            if previous is not None and packet.dts + wrap < previous - PTS_WRAP // 2:
+                wrap += PTS_WRAP
+            dts = packet.dts + wrap
+            previous = dts
+            pts = packet.pts + wrap if packet.pts is not None else None
+            if pts is not None and pts < dts - PTS_WRAP // 2:
+                pts += PTS_WRAP
+            ts = pts if pts is not None else dts
+            if origin is None:
+                origin = ts
+            entries.append((packet, meta['start'] + float((ts - origin) * time_base), number, dts, pts))
+        return entries
@@ -0,0 +1,349 @@
+import time
+import zlib
+import threading
+import multiprocessing as mp
+from multiprocessing import shared_memory
+import cv2
+import numpy as np
+from utils.video_source import VideoSource
+from utils.tracing import tracer
+
+
+# Заголовок шины: int64-поля
+H_MAGIC, H_SLOTS, H_HEIGHT, H_WIDTH, H_CHANNELS, H_SEQ, H_HEARTBEAT, H_PID, \
+    H_STATE, H_FPS_X10, H_RECONNECTS, H_FAILURES = range(12)
+HEADER_FIELDS = 16
+BUS_MAGIC = 0x4D4F5431          # 'MOT1'
+
+STATES = ["closed", "connecting", "streaming", "reconnecting", "ended", "stopped"]
+STALE_TIMEOUT = 5.0             # Процесс захвата считается остановленным без пульса (сек)
+POLL_INTERVAL = 0.002           # Период опроса новых кадров читателем (сек)
+
+_buses = {}                     # Процессы захвата, запущенные этим процессом: имя -> [FrameBus, кол-во читателей]
+_buses_lock = threading.Lock()
+
+
+def bus_name(source):
+    """Имя разделяемой памяти для источника (одинаковое во всех процессах)"""
+    return f"motion_bus_{zlib.crc32(str(source).encode()):08x}"
+
+
+def _attach_shm(name, untrack=True):
+    """Подключение к существующей памяти.
+
+    Память чужого процесса снимается с учета resource_tracker, иначе он удалит
+    ее при выходе читателя. Дочерние процессы захвата делят tracker с
+    родителем, поэтому для своих шин снимать с учета не нужно.
+    """
+    if not untrack:
+        return shared_memory.SharedMemory(name=name)
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        shm = shared_memory.SharedMemory(name=name)
+        try:
+            from multiprocessing import resource_tracker
+            resource_tracker.unregister(shm._name, "shared_memory")
+        except Exception:
+            pass
+        return shm
+
+
+def _layout(buf, slots, shape):
+    """Представления заголовка, номеров слотов, меток времени и кадров в памяти"""
+    header = np.ndarray((HEADER_FIELDS,), dtype=np.int64, buffer=buf)
+    offset = header.nbytes
+    slot_seq = np.ndarray((slots,), dtype=np.int64, buffer=buf, offset=offset)
+    offset += slot_seq.nbytes
+    slot_ts = np.ndarray((slots,), dtype=np.float64, buffer=buf, offset=offset)
+    offset += slot_ts.nbytes
+    frames = np.ndarray((slots,) + tuple(shape), dtype=np.uint8, buffer=buf, offset=offset)
+    return header, slot_seq, slot_ts, frames
+
+
+def _bus_size(slots, shape):
+    return HEADER_FIELDS * 8 + slots * 16 + slots * int(np.prod(shape))
+
+
+def _capture_main(source, settings, name, slots, ready, stop_event):
+    """Процесс захвата: декодирование камеры один раз и публикация кадров в кольцо"""
+    cap = VideoSource.from_settings(source, settings)
+    cap.open()
+    ret, frame = cap.read()
+    if not ret:
+        ready.put(None)
+        cap.release()
+        return
+
+    shape = frame.shape
+    try:
+        shm = shared_memory.SharedMemory(name=name, create=True, size=_bus_size(slots, shape))
+    except FileExistsError:
+        # Память осталась от аварийно завершенного процесса захвата
+        stale = _attach_shm(name)
+        stale.close()
+        stale.unlink()
+        shm = shared_memory.SharedMemory(name=name, create=True, size=_bus_size(slots, shape))
+    header, slot_seq, slot_ts, frames = _layout(shm.buf, slots, shape)
+    header[:] = 0
+    slot_seq[:] = -1
+    header[H_SLOTS] = slots
+    header[H_HEIGHT], header[H_WIDTH], header[H_CHANNELS] = shape
+    header[H_PID] = mp.current_process().pid
+    header[H_SEQ] = -1
+    header[H_MAGIC] = BUS_MAGIC
+    ready.put(shape)
+
+    # Пульс и метрики потока обновляются и во время переподключения. Заголовок
+    # передается аргументом: поток освобождает его после завершения, и del
+    # в finally снимает последние ссылки на память перед shm.close()
+    finished = threading.Event()
+
+    def heartbeat(header):
+        while True:
+            header[H_HEARTBEAT] = int(time.time() * 1000)
+            header[H_STATE] = STATES.index(cap.metrics['state'])
+            header[H_FPS_X10] = int(cap.metrics['fps'] * 10)
+            header[H_RECONNECTS] = cap.metrics['reconnects']
+            header[H_FAILURES] = cap.metrics['read_failures']
+            if finished.wait(0.5):
+                break
+
+    heartbeat_thread = threading.Thread(target=heartbeat, args=(header,), daemon=True)
+    heartbeat_thread.start()
+    threading.Thread(target=lambda: stop_event.wait() or cap.stop(), daemon=True).start()
+
+    seq = 0
+    try:
+        while not stop_event.is_set():
+            if frame.shape != shape:
+                frame = cv2.resize(frame, (shape[1], shape[0]))
+            slot = seq % slots
+            slot_seq[slot] = -1             # Слот занят записью
+            np.copyto(frames[slot], frame)
+            slot_ts[slot] = time.time()
+            slot_seq[slot] = seq
+            header[H_SEQ] = seq
+            seq += 1
+
+            ret, frame = cap.read()
+            if not ret:
+                break
+    finally:
+        finished.set()
+        heartbeat_thread.join()
+        header[H_STATE] = STATES.index("stopped")
+        header[H_HEARTBEAT] = 0
+        cap.release()
+        del header, slot_seq, slot_ts, frames
+        shm.close()
+        shm.unlink()
+
+
+class FrameBus:
+    """Процесс захвата одной камеры, публикующий декодированные кадры в разделяемую память"""
+
+    START_TIMEOUT = 30.0
+
+    def __init__(self, source, settings, slots=16):
+        self.source = source
+        self.settings = dict(settings)
+        self.name = bus_name(source)
+        self.slots = slots
+        self.process = None
+        self._stop_event = None
+
+    def start(self):
+        ctx = mp.get_context("spawn")
+        ready = ctx.Queue()
+        self._stop_event = ctx.Event()
+        self.process = ctx.Process(target=_capture_main, daemon=True,
+                                   args=(self.source, self.settings, self.name, self.slots,
+                                         ready, self._stop_event))
+        self.process.start()
+        shape = ready.get(timeout=self.START_TIMEOUT)
+        if shape is None:
+            self.process.join()
+            raise IOError(f"Не удалось открыть источник видео: {self.source}")
+        print(f"[FrameBus] Захват {self.source} запущен: {shape}, слотов: {self.slots}")
+
+    def stop(self):
+        if self.process is not None:
+            self._stop_event.set()
+            self.process.join(timeout=10)
+            if self.process.is_alive():
+                self.process.terminate()
+            self.process = None
+            print(f"[FrameBus] Захват {self.source} остановлен")
+
+
+class FrameBusReader:
+    """Читатель шины кадров с интерфейсом cv2.VideoCapture.
+
+    По умолчанию read() возвращает numpy-представление слота разделяемой
+    памяти без копирования. Слот перезаписывается через slots кадров
+    (frame_bus_slots, при 30 кадр/с - около 0.5 сек), поэтому кадр нужно
+    обработать (или скопировать) за это время. Потребителям с долгой
+    обработкой кадра (YOLO) нужен copy=True: кадр копируется в буфер
+    читателя и действителен до следующего read().
+    """
+
+    HEALTH_INTERVAL = 5.0
+
+    def __init__(self, name, health_callback=None, on_release=None, copy=False):
+        self.name = name
+        self.health_callback = health_callback
+        self.on_release = on_release
+        self.copy = copy
+        self.shm = _attach_shm(name, untrack=on_release is None)
+        header = np.ndarray((HEADER_FIELDS,), dtype=np.int64, buffer=self.shm.buf)
+        if header[H_MAGIC] != BUS_MAGIC:
+            del header
+            self.shm.close()
+            raise IOError(f"Шина кадров {name} не инициализирована")
+        slots = int(header[H_SLOTS])
+        shape = (int(header[H_HEIGHT]), int(header[H_WIDTH]), int(header[H_CHANNELS]))
+        del header
+        self.header, self.slot_seq, self.slot_ts, self.frames = _layout(self.shm.buf, slots, shape)
+        self.slots = slots
+        self._frame = np.empty(shape, np.uint8) if copy else None     # Копия кадра при copy
+        self.last_seq = -1
+        self.last_timestamp = 0.0
+        self.dropped = 0
+        self._stop_event = threading.Event()
+        self._last_health = 0.0
+
+    def publisher_alive(self):
+        heartbeat = self.header[H_HEARTBEAT] / 1000.0
+        return heartbeat > 0 and time.time() - heartbeat < STALE_TIMEOUT
+
+    def read(self):
+        """Ожидание следующего кадра: (True, кадр) или (False, None)"""
+        with tracer.span("bus.read", "capture"):
+            waited_since = time.time()
+            while not self._stop_event.is_set():
+                seq = int(self.header[H_SEQ])
+                if seq > self.last_seq:
+                    slot = seq % self.slots
+                    if self.slot_seq[slot] == seq:
+                        frame = self.frames[slot]
+                        if self.copy:
+                            np.copyto(self._frame, frame)
+                            if self.slot_seq[slot] != seq:
+                                # Запись дошла до слота во время копирования - берем следующий кадр
+                                continue
+                            frame = self._frame
+                        if self.last_seq >= 0:
+                            self.dropped += seq - self.last_seq - 1
+                        self.last_seq = seq
+                        self.last_timestamp = float(self.slot_ts[slot])
+                        self._maybe_report()
+                        return True, frame
+                elif time.time() - waited_since > STALE_TIMEOUT and not self.publisher_alive():
+                    break
+                time.sleep(POLL_INTERVAL)
+            return False, None
+
+    def isOpened(self):
+        return not self._stop_event.is_set() and self.publisher_alive()
+
+    def get(self, prop):
+        if prop == cv2.CAP_PROP_FRAME_WIDTH:
+            return float(self.header[H_WIDTH])
+        if prop == cv2.CAP_PROP_FRAME_HEIGHT:
+            return float(self.header[H_HEIGHT])
+        if prop == cv2.CAP_PROP_FPS:
+            return int(self.header[H_FPS_X10]) / 10.0
+        return 0.0
+
+    def open(self):
+        return self.isOpened()
+
+    def stop(self):
+        self._stop_event.set()
+
+    def release(self):
+        if self.shm is None:
+            return
+        self._stop_event.set()
+        self.header = self.slot_seq = self.slot_ts = self.frames = self._frame = None
+        try:
+            self.shm.close()
+        except BufferError:
+            # Кадры-представления еще используются; память освободится вместе с ними
+            pass
+        self.shm = None
+        if self.on_release:
+            self.on_release()
+
+    def health(self):
+        return {
+            'source': self.name,
+            'state': STATES[int(self.header[H_STATE])] if self.publisher_alive() else "stopped",
+            'fps': int(self.header[H_FPS_X10]) / 10.0,
+            'frames': self.last_seq + 1,
+            'read_failures': int(self.header[H_FAILURES]),
+            'reconnects': int(self.header[H_RECONNECTS]),
+            'dropped': self.dropped,
+            'last_frame_time': self.last_timestamp or None,
+            'last_error': None,
+        }
+
+    def _maybe_report(self):
+        now = time.time()
+        if self.health_callback and now - self._last_health >= self.HEALTH_INTERVAL:
+            self._last_health = now
+            self.health_callback(self.health())
+
+
+def _release_bus(name):
+    with _buses_lock:
+        entry = _buses.get(name)
+        if entry is None:
+            return
+        entry[1] -= 1
+        if entry[1] > 0:
+            return
+        del _buses[name]
+    entry[0].stop()
+
+
+def attach(source, settings, health_callback=None, copy=False):
+    """Читатель шины кадров источника; процесс захвата запускается, если его еще нет.
+
+    Шину, уже запущенную другим процессом (например, ботом), переиспользует
+    любой процесс, открывающий тот же источник. copy - см. FrameBusReader.
+    """
+    name = bus_name(source)
+    with _buses_lock:
+        entry = _buses.get(name)
+        if entry is None:
+            try:
+                reader = FrameBusReader(name, health_callback, copy=copy)
+                if reader.publisher_alive():
+                    print(f"[FrameBus] Подключение к существующему захвату {source}")
+                    return reader
+                reader.release()
+            except (FileNotFoundError, IOError):
+                pass
+            bus = FrameBus(source, settings, settings.get("frame_bus_slots", 16))
+            bus.start()
+            entry = _buses[name] = [bus, 0]
+        entry[1] += 1
+    return FrameBusReader(name, health_callback, on_release=lambda: _release_bus(name), copy=copy)
+
+
+def open_capture(source, settings, health_callback=None, copy=False):
+    """Открытый источник кадров: читатель общей шины (frame_bus) или собственный VideoSource.
+
+    copy - кадр шины копируется при чтении (для долгой обработки кадра);
+    кадры VideoSource и так принадлежат читателю.
+    """
+    if settings.get("frame_bus"):
+        try:
+            return attach(source, settings, health_callback, copy)
+        except Exception as e:
+            print(f"[FrameBus] Шина кадров недоступна ({e}), прямой захват")
+    cap = VideoSource.from_settings(source, settings, health_callback)
+    cap.open()
+    return cap
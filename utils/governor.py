@@ -0,0 +1,192 @@
+import os
+import time
+import threading
+import cv2
+import numpy as np
+
+
+GOVERNOR_SETTINGS = ("time_sleep", "cpu_budget", "target_fps", "min_fps", "max_fps",
+                     "motion_boost", "motion_hold", "adaptive_resolution")
+
+SCALE_STEPS = (1.0, 0.75, 0.5, 0.35, 0.25)     # Допустимые масштабы кадра анализа
+
+_active = set()                 # Работающие регуляторы процесса - бюджет делится между ними
+_active_lock = threading.Lock()
+
+
+def system_load():
+    """Средняя загрузка системы на одно ядро за минуту (None, если недоступна)"""
+    try:
+        return os.getloadavg()[0] / (os.cpu_count() or 1)
+    except (AttributeError, OSError):
+        return None
+
+
+class RateGovernor:
+    """Регулятор частоты анализа кадров одной камеры.
+
+    Измеряет процессорное время обработки кадра (скользящее среднее) и
+    выбирает частоту анализа так, чтобы уложиться в бюджет CPU (доля одного
+    ядра, делится между активными камерами процесса) и/или целевую частоту.
+    При перегрузке системы частота снижается пропорционально загрузке, а при
+    adaptive_resolution, если даже min_fps не укладывается в бюджет,
+    уменьшается разрешение анализа. Пока есть движение (и motion_hold секунд
+    после), частота повышается в motion_boost раз.
+
+    Без cpu_budget и target_fps шаг анализа фиксирован - time_sleep (0 - без
+    паузы), min_fps, max_fps и motion_boost в этом режиме не применяются.
+    """
+
+    COST_SMOOTHING = 0.1            # Коэффициент скользящего среднего стоимости кадра
+    LOAD_INTERVAL = 2.0             # Период опроса загрузки системы (сек)
+    SCALE_INTERVAL = 3.0            # Минимальный период смены разрешения (сек)
+    STATS_INTERVAL = 5.0            # Период отправки метрик (сек)
+
+    def __init__(self, settings, name="", stats_callback=None):
+        self.name = name
+        self.stats_callback = stats_callback
+        self.cost = None            # Процессорное время на кадр (сек)
+        self.scale = 1.0
+        self.rate = 0.0
+        self.load = None
+        self.motion_until = 0.0
+        self._last_frame = 0.0
+        self._last_load = 0.0
+        self._last_scale = 0.0
+        self._last_stats = 0.0
+        self._cpu_started = None
+        self._resized = None          # Буфер кадра в разрешении анализа
+        self.configure(settings)
+
+    def configure(self, settings):
+        self.time_sleep = settings.get("time_sleep", 0.2)
+        self.cpu_budget = settings.get("cpu_budget", 0.0)
+        self.target_fps = settings.get("target_fps", 0.0)
+        self.min_fps = max(settings.get("min_fps", 1.0), 0.1)
+        self.max_fps = max(settings.get("max_fps", 30.0), self.min_fps)
+        self.motion_boost = max(settings.get("motion_boost", 2.0), 1.0)
+        self.motion_hold = settings.get("motion_hold", 3.0)
+        self.adaptive_resolution = settings.get("adaptive_resolution", False)
+        if not self.adaptive_resolution:
+            self.scale = 1.0
+        self.rate = self._choose_rate(time.time())
+
+    @property
+    def adaptive(self):
+        return bool(self.cpu_budget or self.target_fps)
+
+    def start(self):
+        with _active_lock:
+            _active.add(self)
+
+    def stop(self):
+        with _active_lock:
+            _active.discard(self)
+
+    def interval(self):
+        """Текущий шаг анализа (сек)"""
+        return 1.0 / self.rate if self.rate > 0 else 0.0
+
+    def due(self, now):
+        """Пора ли анализировать кадр (для потоков, читающих все кадры)"""
+        return now - self._last_frame >= self.interval()
+
+    def remaining(self, now):
+        """Сколько ждать до следующего анализа (для потоков, спящих между кадрами)"""
+        return max(0.0, self._last_frame + self.interval() - now)
+
+    def begin(self):
+        """Начало обработки кадра"""
+        self._last_frame = time.time()
+        self._cpu_started = time.thread_time()
+
+    def end(self, motion=False):
+        """Окончание обработки кадра: учет стоимости и выбор новой частоты"""
+        now = time.time()
+        if self._cpu_started is not None:
+            cost = time.thread_time() - self._cpu_started
+            self._cpu_started = None
+            if self.cost is None:
+                self.cost = cost
+            else:
+                self.cost += self.COST_SMOOTHING * (cost - self.cost)
+        if motion:
+            self.motion_until = now + self.motion_hold
+
+        if now - self._last_load >= self.LOAD_INTERVAL:
+            self._last_load = now
+            self.load = system_load()
+
+        self.rate = self._choose_rate(now)
+        if self.adaptive_resolution and self.adaptive:
+            self._adjust_scale(now)
+        if self.stats_callback and now - self._last_stats >= self.STATS_INTERVAL:
+            self._last_stats = now
+            self.stats_callback(self.stats())
+
+    def resize(self, frame):
+        """Кадр в разрешении анализа"""
+        if self.scale >= 1.0:
+            return frame
+        height, width = frame.shape[:2]
+        size = (max(int(width * self.scale), 1), max(int(height * self.scale), 1))
+        shape = (size[1], size[0]) + frame.shape[2:]
+        if self._resized is None or self._resized.shape != shape:
+            self._resized = np.empty(shape, frame.dtype)
+        return cv2.resize(frame, size, dst=self._resized, interpolation=cv2.INTER_AREA)
+
+    def stats(self):
+        cost = self.cost or 0.0
+        return {
+            'source': self.name,
+            'mode': "adaptive" if self.adaptive else "fixed",
+            'rate': round(self.rate, 2),
+            'scale': self.scale,
+            'cost_ms': round(cost * 1000, 2),
+            'cpu': round(cost * self.rate, 3),
+            'load': round(self.load, 2) if self.load is not None else None,
+            'boost': self.adaptive and time.time() < self.motion_until,
+        }
+
+    def _budget_rate(self):
+        """Частота, при которой обработка укладывается в долю бюджета этой камеры"""
+        if not self.cpu_budget or not self.cost:
+            return None
+        with _active_lock:
+            cameras = max(len(_active), 1)
+        return self.cpu_budget / cameras / self.cost
+
+    def _choose_rate(self, now):
+        if not self.adaptive:
+            # Фиксированный шаг time_sleep без ограничений и ускорения; 0 - без паузы
+            return 1.0 / self.time_sleep if self.time_sleep > 0 else 0.0
+
+        rate = self.target_fps or self.max_fps
+        budget_rate = self._budget_rate()
+        if budget_rate is not None:
+            rate = min(rate, budget_rate)
+        if self.load is not None and self.load > 1.0:
+            # Система перегружена (YOLO, другие камеры и процессы) - уступаем
+            rate /= self.load
+        if now < self.motion_until:
+            rate *= self.motion_boost
+        return min(max(rate, self.min_fps), self.max_fps)
+
+    def _adjust_scale(self, now):
+        """Снижение разрешения, если бюджет не выдерживает min_fps; возврат при запасе"""
+        budget_rate = self._budget_rate()
+        if budget_rate is None or now - self._last_scale < self.SCALE_INTERVAL:
+            return
+        step = SCALE_STEPS.index(self.scale) if self.scale in SCALE_STEPS else 0
+        wanted = self.target_fps or self.min_fps
+        if budget_rate < wanted and step + 1 < len(SCALE_STEPS):
+            step += 1
+        elif step > 0 and budget_rate > 2.5 * wanted * (SCALE_STEPS[step - 1] / SCALE_STEPS[step]) ** 2:
+            # Стоимость растет примерно с площадью кадра - повышаем только с запасом
+            step -= 1
+        else:
+            return
+        self._last_scale = now
+        self.scale = SCALE_STEPS[step]
+        self.cost = None
+        print(f"[RateGovernor] {self.name}: масштаб анализа {self.scale}")
@@ -0,0 +1,392 @@
+import json
+import asyncio
+import secrets
+import threading
+import cv2
+from aiohttp import web, WSMsgType
+from utils.zones import normalize_zones
+from utils.inference_server import is_local_address
+
+
+BOUNDARY = "frame"
+FRAME_TIMEOUT = 5.0             # Ожидание нового кадра клиентом (сек)
+DETECTION_QUEUE = 100           # Неотправленных сообщений детекций на клиента
+WIDTH_STEP = 80                 # Шаг ширины живого видео: ширины клиентов округляются до него
+LOOPBACK_HOSTS = ("localhost", "127.0.0.1", "::1")
+MUTATING_METHODS = ("POST", "PUT", "PATCH", "DELETE")
+
+INDEX_HTML = """<!doctype html>
+<html><head><meta charset="utf-8"><title>MotionControl</title></head>
+<body style="margin:0;background:#111;color:#eee;font-family:sans-serif">
+<img id="live" style="max-width:100%">
+<pre id="log" style="margin:8px"></pre>
+<script>
+const log = document.getElementById("log");
+// Ключ доступа (?token=...) передается видео и детекциям
+document.getElementById("live").src = `/live.mjpg${location.search}`;
+const ws = new WebSocket(`ws://${location.host}/ws/detections${location.search}`);
+ws.onmessage = (event) => { log.textContent = event.data; };
+</script>
+</body></html>
+"""
+
+
+def delta_to_dict(delta):
+    """DetectionDelta -> JSON-совместимый словарь"""
+    message = {
+        'type': "zones",
+        'count': delta.count,
+        'zones': [{'zone': int(r['zone']), 'roi': r['roi'].tolist(), 'detected': bool(r['detected']),
+                   'activity': round(float(r['activity']), 4)} for r in delta.records],
+    }
+    if delta.polygons is not None:
+        message['polygons'] = delta.polygons
+    if delta.blobs:
+        message['blobs'] = {str(index): blobs for index, blobs in delta.blobs.items()}
+    return message
+
+
+class LiveHub:
+    """Последний кадр и поток детекций для клиентов HTTP API.
+
+    Детекторы публикуют кадры и детекции из своих потоков. Кадр копируется,
+    только когда есть зрители, и кодируется в JPEG не чаще одного раза на
+    кадр и ширину: все клиенты одной ширины получают одни и те же байты.
+    Ширины округляются до WIDTH_STEP, ширина от исходной - исходный кадр;
+    JPEG и блокировки хранятся только для ширин текущих зрителей.
+    Медленный клиент пропускает кадры, а не копит их. Сообщение детекций
+    сериализуется один раз для всех подписчиков.
+    """
+
+    def __init__(self, loop, quality=80):
+        self.loop = loop
+        self.quality = quality
+        self.viewers = 0
+        self.frame = None
+        self.seq = 0
+        self.encoded = 0                # Кол-во кодирований JPEG (для метрик)
+        self._lock = threading.Lock()
+        self._frame_event = asyncio.Event()
+        self._jpegs = {}                # Ширина -> (номер кадра, JPEG)
+        self._encode_locks = {}
+        self._widths = {}               # Ширина зрителей -> кол-во зрителей
+        self._subscribers = set()
+        self._zones = {}                # Последнее состояние зон - снимок для новых подписчиков
+        self._zone_count = 0
+
+    def publish_frame(self, frame):
+        """Новый кадр (из потока детектора)"""
+        if not self.viewers:
+            return
+        with self._lock:
+            self.frame = frame.copy()
+            self.seq += 1
+        self.loop.call_soon_threadsafe(self._notify_frame)
+
+    def publish_detections(self, message):
+        """Сообщение детекций (словарь, из потока детектора)"""
+        if self._subscribers:
+            self.loop.call_soon_threadsafe(self._broadcast, message)
+
+    def publish_delta(self, delta):
+        """Изменения зон классического детектора (DetectionDelta)"""
+        self.loop.call_soon_threadsafe(self._broadcast, delta_to_dict(delta))
+
+    def publish_objects(self, objects):
+        """Объекты YOLO: список (label, confidence, box)"""
+        if self._subscribers:
+            self.publish_detections({
+                'type': "objects",
+                'objects': [{'label': label, 'confidence': round(confidence, 3),
+                             'box': [round(v, 1) for v in box]} for label, confidence, box in objects],
+            })
+
+    async def next_frame(self, last_seq):
+        """Номер кадра новее last_seq (ожидание до FRAME_TIMEOUT) или None"""
+        while self.seq == last_seq:
+            try:
+                await asyncio.wait_for(self._frame_event.wait(), FRAME_TIMEOUT)
+            except asyncio.TimeoutError:
+                return None
+        return self.seq
+
+    def add_viewer(self, width=0):
+        """Новый зритель живого видео; возвращает его ширину после округления"""
+        if width:
+            width = max(WIDTH_STEP, round(width / WIDTH_STEP) * WIDTH_STEP)
+        self._widths[width] = self._widths.get(width, 0) + 1
+        self.viewers += 1
+        return width
+
+    def remove_viewer(self, width):
+        """Зритель отключился: JPEG ширин, которые больше никто не смотрит, освобождаются"""
+        self.viewers -= 1
+        count = self._widths.pop(width) - 1
+        if count:
+            self._widths[width] = count
+        used = {self._cache_width(viewer_width, self.frame) for viewer_width in self._widths}
+        for cache in (self._jpegs, self._encode_locks):
+            for key in [key for key in cache if key not in used]:
+                del cache[key]
+
+    async def jpeg(self, width=0):
+        """JPEG последнего кадра шириной width (0 - исходная); (номер кадра, байты)"""
+        if self.frame is None:
+            return self.seq, None
+        width = self._cache_width(width, self.frame)
+        lock = self._encode_locks.setdefault(width, asyncio.Lock())
+        async with lock:
+            with self._lock:
+                frame, seq = self.frame, self.seq
+            cached = self._jpegs.get(width)
+            if frame is None or (cached and cached[0] == seq):
+                return cached if cached else (seq, None)
+            data = await asyncio.to_thread(self._encode, frame, width)
+            self._jpegs[width] = (seq, data)
+            return seq, data
+
+    @staticmethod
+    def _cache_width(width, frame):
+        """Ширина не меньше исходной - исходный кадр (ключ 0), без повторного кодирования"""
+        if frame is not None and width >= frame.shape[1]:
+            return 0
+        return width
+
+    def subscribe(self):
+        queue = asyncio.Queue(maxsize=DETECTION_QUEUE)
+        if self._zones:
+            queue.put_nowait(json.dumps({'type': "zones", 'count': self._zone_count,
+                                         'zones': list(self._zones.values())}, ensure_ascii=False))
+        self._subscribers.add(queue)
+        return queue
+
+    def unsubscribe(self, queue):
+        self._subscribers.discard(queue)
+
+    def _notify_frame(self):
+        self._frame_event.set()
+        self._frame_event = asyncio.Event()
+
+    def _broadcast(self, message):
+        if message['type'] == "zones":
+            if 'polygons' in message:
+                self._zones = {}
+            self._zone_count = message['count']
+            self._zones.update((zone['zone'], zone) for zone in message['zones'])
+        if not self._subscribers:
+            return
+        text = json.dumps(message, ensure_ascii=False)
+        for queue in self._subscribers:
+            if queue.full():
+                queue.get_nowait()      # Медленный клиент теряет самое старое сообщение
+            queue.put_nowait(text)
+
+    def _encode(self, frame, width):
+        height, frame_width = frame.shape[:2]
+        if 0 < width < frame_width:
+            frame = cv2.resize(frame, (width, max(int(height * width / frame_width), 1)),
+                               interpolation=cv2.INTER_AREA)
+        ok, data = cv2.imencode(".jpg", frame, [cv2.IMWRITE_JPEG_QUALITY, self.quality])
+        self.encoded += 1
+        return data.tobytes() if ok else None
+
+
+def _width(request):
+    try:
+        return max(0, int(request.query.get("width", 0)))
+    except ValueError:
+        raise web.HTTPBadRequest(text="width должен быть целым числом")
+
+
+def _guard(token="", local=True):
+    """Защита API от чужих страниц браузера и сети.
+
+    - Заголовок Origin (его шлют браузеры для WebSocket и запросов fetch)
+      должен совпадать с адресом самого сервера: чужая страница не откроет
+      видео и детекции и не вызовет управление.
+    - Изменяющие запросы - только с Content-Type: application/json (форма
+      или no-cors запрос чужой страницы такой тип задать не может).
+    - На loopback-адресе заголовок Host должен быть локальным (защита от
+      подмены DNS).
+    - При заданном ключе нужен заголовок Authorization: Bearer <ключ> или
+      параметр ?token=<ключ> (для img и WebSocket из браузера).
+    """
+    @web.middleware
+    async def guard(request, handler):
+        if local and request.url.host not in LOOPBACK_HOSTS:
+            raise web.HTTPForbidden(text="Недопустимый Host")
+        origin = request.headers.get("Origin")
+        if origin is not None and origin != f"{request.scheme}://{request.host}":
+            raise web.HTTPForbidden(text="Запрос с чужого источника")
+        if token:
+            auth = request.headers.get("Authorization", "")
+            supplied = auth[7:] if auth.startswith("Bearer ") else request.query.get("token", "")
+            if not secrets.compare_digest(supplied.encode(), token.encode()):
+                raise web.HTTPUnauthorized(text="Нужен ключ доступа (http_token)")
+        if request.method in MUTATING_METHODS and request.content_type != "application/json":
+            raise web.HTTPUnsupportedMediaType(text="Ожидается Content-Type: application/json")
+        return await handler(request)
+    return guard
+
+
+def create_app(detector, hub, token="", local=True):
+    """Приложение aiohttp: живое видео, детекции и управление DetectorManager.
+
+    token - ключ доступа (пусто - без ключа), local - сервер слушает только loopback.
+    """
+    routes = web.RouteTableDef()
+
+    @routes.get("/")
+    async def index(request):
+        return web.Response(text=INDEX_HTML, content_type="text/html")
+
+    @routes.get("/live.mjpg")
+    async def live_mjpeg(request):
+        width = _width(request)
+        response = web.StreamResponse(headers={
+            'Content-Type': f"multipart/x-mixed-replace; boundary={BOUNDARY}",
+            'Cache-Control': "no-cache",
+        })
+        await response.prepare(request)
+        width = hub.add_viewer(width)
+        try:
+            seq = None
+            while not _disconnected(request):
+                # Без кадров запись не идет, и разрыв замечается только по транспорту
+                seq = await hub.next_frame(seq)
+                if seq is None:
+                    continue
+                seq, data = await hub.jpeg(width)
+                if data is None:
+                    continue
+                await response.write(f"--{BOUNDARY}\r\nContent-Type: image/jpeg\r\n"
+                                     f"Content-Length: {len(data)}\r\n\r\n".encode() + data + b"\r\n")
+        except ConnectionResetError:
+            pass
+        finally:
+            hub.remove_viewer(width)
+        return response
+
+    @routes.get("/ws/live")
+    async def live_ws(request):
+        width = _width(request)
+        ws = web.WebSocketResponse()
+        await ws.prepare(request)
+        # Без чтения входящих сообщений закрытие соединения клиентом не обрабатывается
+        reader = asyncio.create_task(_drain(ws))
+        width = hub.add_viewer(width)
+        try:
+            seq = None
+            while not reader.done():
+                seq = await hub.next_frame(seq)
+                if seq is None:
+                    continue
+                seq, data = await hub.jpeg(width)
+                if data is not None and not ws.closed:
+                    await ws.send_bytes(data)
+        except ConnectionResetError:
+            pass
+        finally:
+            hub.remove_viewer(width)
+            reader.cancel()
+        return ws
+
+    @routes.get("/ws/detections")
+    async def detections_ws(request):
+        ws = web.WebSocketResponse()
+        await ws.prepare(request)
+        queue = hub.subscribe()
+        reader = asyncio.create_task(_drain(ws))
+        try:
+            while not ws.closed:
+                getter = asyncio.create_task(queue.get())
+                done, _ = await asyncio.wait({getter, reader}, return_when=asyncio.FIRST_COMPLETED)
+                if getter not in done:
+                    getter.cancel()
+                    break
+                await ws.send_str(getter.result())
+        except ConnectionResetError:
+            pass
+        finally:
+            hub.unsubscribe(queue)
+            reader.cancel()
+        return ws
+
+    @routes.get("/api/status")
+    async def status(request):
+        return web.json_response(dict(detector.status(), viewers=hub.viewers, jpeg_encoded=hub.encoded))
+
+    @routes.post("/api/start")
+    async def start(request):
+        await detector.start_async()
+        return web.json_response(detector.status())
+
+    @routes.post("/api/stop")
+    async def stop(request):
+        await detector.stop_async()
+        return web.json_response(detector.status())
+
+    @routes.post("/api/mode")
+    async def mode(request):
+        body = await _json_body(request)
+        if body.get("mode") not in ("classic", "yolo"):
+            raise web.HTTPBadRequest(text="mode: classic или yolo")
+        await detector.set_model_mode_async(body["mode"])
+        return web.json_response(detector.status())
+
+    @routes.get("/api/zones")
+    async def get_zones(request):
+        return web.json_response({'zones': detector.motion.zones.zones})
+
+    @routes.put("/api/zones")
+    async def put_zones(request):
+        body = await _json_body(request)
+        try:
+            zones = normalize_zones(body.get("zones", []))
+        except (TypeError, ValueError, KeyError, IndexError) as e:
+            raise web.HTTPBadRequest(text=f"Некорректные зоны: {e}")
+        detector.motion.set_roi(zones)
+        return web.json_response({'zones': detector.motion.zones.zones})
+
+    app = web.Application(middlewares=[_guard(token, local)])
+    app.add_routes(routes)
+    return app
+
+
+def _disconnected(request):
+    """Клиент отключился (транспорт закрыт или закрывается)"""
+    transport = request.transport
+    return transport is None or transport.is_closing()
+
+
+async def _drain(ws):
+    async for message in ws:
+        if message.type == WSMsgType.ERROR:
+            break
+
+
+async def _json_body(request):
+    try:
+        body = await request.json()
+    except (json.JSONDecodeError, UnicodeDecodeError):
+        raise web.HTTPBadRequest(text="Ожидается JSON")
+    if not isinstance(body, dict):
+        raise web.HTTPBadRequest(text="Ожидается JSON-объект")
+    return body
+
+
+async def start_http_api(detector, settings):
+    """Запуск HTTP API в текущем цикле событий; возвращает AppRunner для остановки"""
+    hub = LiveHub(asyncio.get_running_loop(), settings.get("http_jpeg_quality", 80))
+    detector.attach_live_hub(hub)
+    host, port = settings.get("http_host", "127.0.0.1"), settings.get("http_port", 8080)
+    token = settings.get("http_token", "")
+    local = is_local_address((host, port))
+    if not local and not token:
+        print(f"[HttpApi] Адрес {host} доступен из сети, а ключ http_token не задан: "
+              f"видео и управление открыты всем в сети")
+    runner = web.AppRunner(create_app(detector, hub, token, local))
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    print(f"[HttpApi] http://{host}:{port}/ - живое видео, /ws/detections - детекции, /api/* - управление")
+    return runner
@@ -0,0 +1,436 @@
+import os
+import time
+import queue
+import socket
+import struct
+import secrets
+import ipaddress
+import itertools
+import threading
+import multiprocessing as mp
+from multiprocessing.connection import Listener, Client, deliver_challenge, answer_challenge
+import cv2
+
+
+KEY_FILE = "yolo_server.key"    # Ключ соединений этой установки (создается при первом запуске)
+KEY_ENV = "MOTION_YOLO_KEY"     # Переменная окружения с ключом (приоритетнее настроек)
+CONNECT_RETRY = 5.0             # Период повторного подключения клиента (сек)
+HANDSHAKE_TIMEOUT = 5.0         # Ожидание ответов клиента при проверке ключа (сек)
+
+_clients = {}                   # Клиенты процесса: адрес -> InferenceClient
+_clients_lock = threading.Lock()
+
+
+def parse_address(address):
+    """'127.0.0.1:6010' -> ('127.0.0.1', 6010); иначе - путь unix-сокета"""
+    host, sep, port = address.rpartition(":")
+    if sep and port.isdigit():
+        return host or "127.0.0.1", int(port)
+    return address
+
+
+def is_local_address(address):
+    """Адрес на этой машине: unix-сокет или loopback"""
+    if isinstance(address, str):
+        return True
+    host = address[0]
+    if host == "localhost":
+        return True
+    try:
+        return ipaddress.ip_address(host).is_loopback
+    except ValueError:
+        return False
+
+
+def install_key(path=KEY_FILE):
+    """Ключ установки: читается из path, при первом запуске создается (права 0600)"""
+    try:
+        with open(path, "rb") as f:
+            return f.read().strip()
+    except FileNotFoundError:
+        pass
+    tmp = f"{path}.{os.getpid()}.tmp"
+    fd = os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(fd, "wb") as f:
+        f.write(secrets.token_hex(32).encode())
+    try:
+        # Ссылка не перезаписывает ключ, созданный параллельно другим процессом
+        os.link(tmp, path)
+    except FileExistsError:
+        pass
+    finally:
+        os.remove(tmp)
+    with open(path, "rb") as f:
+        return f.read().strip()
+
+
+def resolve_authkey(settings, address):
+    """Ключ соединений с сервером: MOTION_YOLO_KEY, yolo_server_key или ключ установки.
+
+    multiprocessing.connection распаковывает (pickle) принятые данные, поэтому
+    ключ - единственная защита от выполнения чужого кода. Нелокальный адрес
+    допускается только с явно заданным ключом (ValueError иначе).
+    """
+    explicit = os.environ.get(KEY_ENV) or settings.get("yolo_server_key", "")
+    if explicit:
+        return explicit.encode()
+    if not is_local_address(parse_address(address)):
+        raise ValueError(f"Нелокальный адрес сервера инференса {address} требует ключа "
+                         f"(yolo_server_key или {KEY_ENV})")
+    return install_key()
+
+
+def _set_recv_timeout(conn, timeout):
+    """Таймаут чтения сокета соединения (0 - без таймаута): по истечении recv() бросает OSError"""
+    if os.name == "nt":
+        value = int(timeout * 1000)
+    else:
+        value = struct.pack("ll", int(timeout), int(timeout % 1 * 1_000_000))
+    sock = socket.socket(fileno=conn.fileno())
+    try:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVTIMEO, value)
+    finally:
+        # Сокет принадлежит соединению - не закрываем
+        sock.detach()
+
+
+def server_options(settings):
+    return {
+        'batch_size': settings.get("yolo_batch_size", 8),
+        'batch_window': settings.get("yolo_batch_window", 0.01),
+    }
+
+
+class _Request:
+    __slots__ = ("conn", "send_lock", "request_id", "frame", "received")
+
+    def __init__(self, conn, send_lock, request_id, frame):
+        self.conn = conn
+        self.send_lock = send_lock
+        self.request_id = request_id
+        self.frame = frame
+        self.received = time.perf_counter()
+
+
+class InferenceServer:
+    """Сервер пакетного инференса YOLO для всех конвейеров (бот, app.py, камеры).
+
+    Кадры от клиентов копятся в общей очереди; поток инференса берет первый
+    запрос, добирает остальные в течение batch_window (не более batch_size)
+    и прогоняет их одним пакетом. Ответы отправляются каждому клиенту по
+    мере готовности. При заполненной очереди запрос сразу отклоняется
+    ответом "busy" - клиент пропускает кадр вместо накопления задержки.
+    """
+
+    STATS_INTERVAL = 30.0
+
+    def __init__(self, model_path, address, authkey, batch_size=8, batch_window=0.01, max_queue=32, imgsz=640):
+        self.model_path = model_path
+        self.address = parse_address(address)
+        self.authkey = authkey
+        self.batch_size = max(1, int(batch_size))
+        self.batch_window = batch_window
+        self.imgsz = imgsz
+        self.queue = queue.Queue(maxsize=max_queue)
+        self.model = None
+        self.stats = {'requests': 0, 'batches': 0, 'rejected': 0, 'infer_time': 0.0}
+        self._last_stats = time.time()
+
+    def serve_forever(self, ready=None):
+        from ultralytics import YOLO
+        from ultralytics.utils import LOGGER
+        LOGGER.setLevel("WARNING")
+        self.model = YOLO(self.model_path)
+        # Ключ проверяется в потоке соединения: клиент, не отвечающий на
+        # рукопожатие, не задерживает прием остальных
+        listener = Listener(self.address)
+        threading.Thread(target=self._batch_loop, name="InferenceBatcher", daemon=True).start()
+        print(f"[InferenceServer] {self.model_path} на {self.address}: пакет до {self.batch_size}, "
+              f"окно {self.batch_window * 1000:.0f} мс")
+        if ready is not None:
+            ready.set()
+        try:
+            while True:
+                try:
+                    conn = listener.accept()
+                except OSError as e:
+                    print(f"[InferenceServer] Ошибка приема подключения: {e}")
+                    continue
+                threading.Thread(target=self._read_loop, args=(conn,), daemon=True).start()
+        finally:
+            listener.close()
+
+    def _authenticate(self, conn):
+        """Проверка ключа (как в Listener с authkey), не дольше HANDSHAKE_TIMEOUT"""
+        try:
+            _set_recv_timeout(conn, HANDSHAKE_TIMEOUT)
+            deliver_challenge(conn, self.authkey)
+            answer_challenge(conn, self.authkey)
+            _set_recv_timeout(conn, 0)
+            return True
+        except (BlockingIOError, TimeoutError):
+            print(f"[InferenceServer] Отклонено подключение: нет ответа за {HANDSHAKE_TIMEOUT:.0f} сек")
+            return False
+        except (OSError, EOFError, mp.AuthenticationError) as e:
+            # Неверный ключ, оборванное или зависшее рукопожатие
+            print(f"[InferenceServer] Отклонено подключение: {e or type(e).__name__}")
+            return False
+
+    def _read_loop(self, conn):
+        send_lock = threading.Lock()
+        try:
+            if not self._authenticate(conn):
+                return
+            while True:
+                request_id, frame = conn.recv()
+                try:
+                    self.queue.put_nowait(_Request(conn, send_lock, request_id, frame))
+                except queue.Full:
+                    self.stats['rejected'] += 1
+                    self._reply(conn, send_lock, request_id, "busy")
+        except (EOFError, OSError):
+            pass
+        finally:
+            conn.close()
+
+    def _batch_loop(self):
+        names = self.model.names
+        while True:
+            batch = [self.queue.get()]
+            deadline = time.perf_counter() + self.batch_window
+            while len(batch) < self.batch_size:
+                timeout = deadline - time.perf_counter()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(self.queue.get(timeout=timeout))
+                except queue.Empty:
+                    break
+
+            started = time.perf_counter()
+            try:
+                results = self.model([request.frame for request in batch], imgsz=self.imgsz, verbose=False)
+            except Exception as e:
+                print(f"[InferenceServer] Ошибка инференса: {e}")
+                for request in batch:
+                    self._reply(request.conn, request.send_lock, request.request_id, "error")
+                continue
+            elapsed = time.perf_counter() - started
+
+            for request, result in zip(batch, results):
+                boxes = result.boxes
+                objects = [(names[int(cls_id)], float(conf), tuple(box))
+                           for cls_id, conf, box in zip(boxes.cls.tolist(), boxes.conf.tolist(),
+                                                        boxes.xyxy.tolist())]
+                info = {'batch': len(batch),
+                        'wait_ms': round((started - request.received) * 1000, 1),
+                        'infer_ms': round(elapsed * 1000, 1)}
+                self._reply(request.conn, request.send_lock, request.request_id, "ok", objects, info)
+
+            self.stats['requests'] += len(batch)
+            self.stats['batches'] += 1
+            self.stats['infer_time'] += elapsed
+            self._report()
+
+    def _reply(self, conn, send_lock, request_id, status, objects=None, info=None):
+        with send_lock:
+            try:
+                conn.send((request_id, status, objects, info))
+            except (OSError, ValueError):
+                pass
+
+    def _report(self):
+        now = time.time()
+        if now - self._last_stats < self.STATS_INTERVAL:
+            return
+        self._last_stats = now
+        stats = self.stats
+        batches = max(stats['batches'], 1)
+        print(f"[InferenceServer] Запросов: {stats['requests']}, средний пакет "
+              f"{stats['requests'] / batches:.1f}, {stats['infer_time'] / batches * 1000:.1f} мс/пакет, "
+              f"отклонено: {stats['rejected']}, в очереди: {self.queue.qsize()}")
+
+
+def _server_main(model_path, address, authkey, options, ready):
+    InferenceServer(model_path, address, authkey, **options).serve_forever(ready)
+
+
+def start_server_process(model_path, address, authkey, options, timeout=120.0):
+    """Сервер в дочернем процессе (завершается вместе с запустившим процессом)"""
+    ctx = mp.get_context("spawn")
+    ready = ctx.Event()
+    process = ctx.Process(target=_server_main, args=(model_path, address, authkey, options, ready),
+                          daemon=True)
+    process.start()
+    deadline = time.time() + timeout
+    while not ready.wait(0.5):
+        if not process.is_alive() or time.time() > deadline:
+            process.terminate()
+            raise IOError(f"Сервер инференса не запустился на {address}")
+    return process
+
+
+class InferenceClient:
+    """Подключение процесса к серверу инференса (одно на процесс, общее для камер).
+
+    submit() отправляет кадр, уменьшенный до размера входа модели, и сразу
+    возвращает управление; callback(objects) вызывается из потока приема
+    со списком (label, confidence, box) в координатах исходного кадра или
+    с None, если кадр пропущен (сервер перегружен, соединение потеряно).
+    Не более max_in_flight запросов процесса ожидают ответа одновременно.
+    """
+
+    def __init__(self, address, authkey, model_path="yolo11n.pt", options=None, autostart=True,
+                 max_in_flight=16):
+        self.address = address
+        self.authkey = authkey
+        self.model_path = model_path
+        self.options = options or {}
+        self.autostart = autostart
+        self.max_in_flight = max_in_flight
+        self.imgsz = self.options.get('imgsz', 640)
+        self.dropped = 0
+        self.process = None
+        self._conn = None
+        self._pending = {}          # Номер запроса -> (callback, масштаб)
+        self._ids = itertools.count()
+        self._lock = threading.Lock()
+        self._send_lock = threading.Lock()
+        self._last_attempt = 0.0
+        self._connecting = False
+
+    def submit(self, frame, callback):
+        """Отправка кадра; False - кадр пропущен (нет сервера или превышено окно запросов)"""
+        conn = self._connection()
+        if conn is None:
+            self.dropped += 1
+            return False
+        height, width = frame.shape[:2]
+        scale = min(1.0, self.imgsz / max(height, width))
+        if scale < 1.0:
+            frame = cv2.resize(frame, (max(int(width * scale), 1), max(int(height * scale), 1)),
+                               interpolation=cv2.INTER_AREA)
+        with self._lock:
+            if len(self._pending) >= self.max_in_flight:
+                self.dropped += 1
+                return False
+            request_id = next(self._ids)
+            self._pending[request_id] = (callback, scale)
+        try:
+            with self._send_lock:
+                conn.send((request_id, frame))
+        except (OSError, ValueError):
+            with self._lock:
+                self._pending.pop(request_id, None)
+            self._disconnect(conn)
+            return False
+        return True
+
+    def infer(self, frame, timeout=10.0):
+        """Синхронный вызов: список объектов или None (кадр пропущен)"""
+        done = threading.Event()
+        result = []
+
+        def on_result(objects):
+            result.append(objects)
+            done.set()
+
+        if not self.submit(frame, on_result) or not done.wait(timeout):
+            return None
+        return result[0]
+
+    def close(self):
+        self._disconnect(self._conn)
+
+    def _connection(self):
+        with self._lock:
+            if self._conn is not None:
+                return self._conn
+            if self._connecting or time.time() - self._last_attempt < CONNECT_RETRY:
+                return None
+            self._connecting = True
+            self._last_attempt = time.time()
+        # Подключение (и запуск сервера) - без блокировки: ответы и другие потоки не ждут
+        try:
+            conn = self._connect()
+        finally:
+            with self._lock:
+                self._connecting = False
+        if conn is None:
+            return None
+        with self._lock:
+            self._conn = conn
+        threading.Thread(target=self._receive_loop, args=(conn,), daemon=True).start()
+        print(f"[InferenceClient] Подключен к серверу инференса {self.address}")
+        return conn
+
+    def _connect(self):
+        address = parse_address(self.address)
+        try:
+            return Client(address, authkey=self.authkey)
+        except (ConnectionRefusedError, FileNotFoundError):
+            if not self.autostart or self.process is not None:
+                return None
+        except (OSError, EOFError, mp.AuthenticationError) as e:
+            print(f"[InferenceClient] Сервер инференса недоступен: {e}")
+            return None
+        print(f"[InferenceClient] Сервер на {self.address} не найден, запуск")
+        try:
+            self.process = start_server_process(self.model_path, self.address, self.authkey, self.options)
+            return Client(address, authkey=self.authkey)
+        except Exception as e:
+            print(f"[InferenceClient] Сервер инференса недоступен: {e}")
+            return None
+
+    def _receive_loop(self, conn):
+        try:
+            while True:
+                request_id, status, objects, _ = conn.recv()
+                with self._lock:
+                    callback, scale = self._pending.pop(request_id, (None, 1.0))
+                if callback is None:
+                    continue
+                if status != "ok":
+                    self.dropped += 1
+                    callback(None)
+                    continue
+                if scale < 1.0:
+                    objects = [(label, confidence, tuple(v / scale for v in box))
+                               for label, confidence, box in objects]
+                callback(objects)
+        except (EOFError, OSError):
+            pass
+        self._disconnect(conn)
+
+    def _disconnect(self, conn):
+        with self._lock:
+            if conn is None or conn is not self._conn:
+                return
+            self._conn = None
+            pending, self._pending = self._pending, {}
+        try:
+            conn.close()
+        except OSError:
+            pass
+        print(f"[InferenceClient] Соединение с сервером инференса {self.address} потеряно")
+        for callback, _ in pending.values():
+            callback(None)
+
+
+def get_inference_client(settings):
+    """Общий клиент сервера инференса процесса или None, если сервер не задан (yolo_server)"""
+    address = settings.get("yolo_server", "")
+    if not address:
+        return None
+    with _clients_lock:
+        client = _clients.get(address)
+        if client is None:
+            try:
+                authkey = resolve_authkey(settings, address)
+            except (ValueError, OSError) as e:
+                print(f"[InferenceClient] {e}")
+                return None
+            client = _clients[address] = InferenceClient(
+                address, authkey, settings.get("yolo_model", "yolo11n.pt"), server_options(settings),
+                autostart=settings.get("yolo_server_autostart", True))
+        return client
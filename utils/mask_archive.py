@@ -0,0 +1,232 @@
+import os
+import time
+import numpy as np
+from utils.pipeline import MotionPipeline, Stage, ZoneStage
+from utils.detections import DetectionBuffer
+from utils.tiles import TileMotion
+from utils.zones import ZoneSet
+
+
+# Запись индекса: время кадра, смещение упакованной маски в файле данных, размер маски
+INDEX_DTYPE = np.dtype([('time', '<f8'), ('offset', '<u8'), ('height', '<u2'), ('width', '<u2')])
+DATA_SUFFIX = ".bin"
+INDEX_SUFFIX = ".idx"
+GROW_BYTES = 16 << 20           # Шаг увеличения файла данных (байт)
+PACK_MAGIC = np.uint64(0x8040201008040201)  # Множитель упаковки 8 байтов 0/1 в байт битов
+ONE = np.uint8(1)
+
+
+def packed_size(height, width):
+    return (height * width + 7) // 8
+
+
+def cleanup_archives(directory, max_age_days):
+    """Удаление архивов масок старше max_age_days"""
+    if not os.path.isdir(directory):
+        return
+    now = time.time()
+    for fname in os.listdir(directory):
+        fpath = os.path.join(directory, fname)
+        if fname.endswith((DATA_SUFFIX, INDEX_SUFFIX)) and now - os.path.getmtime(fpath) > max_age_days * 86400:
+            os.remove(fpath)
+
+
+def archive_paths(path):
+    """(файл данных, файл индекса) по любому из них или по общему имени без расширения"""
+    base = os.path.splitext(path)[0] if path.endswith((DATA_SUFFIX, INDEX_SUFFIX)) else path
+    return base + DATA_SUFFIX, base + INDEX_SUFFIX
+
+
+class MaskArchive:
+    """Архив масок изменений: 1 бит на пиксель вместо байта.
+
+    Маска (0/255) упаковывается по 8 пикселей в байт (порядок битов
+    np.packbits) прямо в файл данных, отображенный в память (np.memmap),
+    через буфер, выделенный один раз под размер маски. Файл растет шагами
+    GROW_BYTES и при закрытии обрезается до записанного. Индекс (INDEX_DTYPE) - отдельный
+    дописываемый файл: запись индекса появляется после данных маски, поэтому
+    читатель видит только целые маски. При достижении file_mb начинается
+    новая пара файлов masks_<время>.
+    """
+
+    def __init__(self, directory="masks", file_mb=256, log_tag="MaskArchive"):
+        self.directory = directory
+        self.file_bytes = int(file_mb) << 20
+        self.log_tag = log_tag
+        self.path = None
+        self.count = 0
+        self.used = 0
+        self._data = None
+        self._index = None
+        self._record = np.zeros(1, INDEX_DTYPE)
+        self._bits = None           # (байт маски, 8) - пиксели маски по 8 на байт
+        self._words = None          # Те же 8 пикселей как одно число '<u8'
+        os.makedirs(directory, exist_ok=True)
+
+    def append(self, now, mask):
+        height, width = mask.shape[:2]
+        size = packed_size(height, width)
+        if self._data is None or self.used + size > self.file_bytes:
+            self._open()
+        if self.used + size > len(self._data):
+            self._grow(self.used + size)
+        self._pack(mask, self._data[self.used:self.used + size])
+        record = self._record[0]
+        record['time'], record['offset'] = now, self.used
+        record['height'], record['width'] = height, width
+        self._index.write(self._record)
+        self._index.flush()
+        self.used += size
+        self.count += 1
+
+    def _pack(self, mask, out):
+        """np.packbits(mask) в out без выделения памяти на кадр"""
+        pixels = mask.size
+        if self._bits is None or self._bits.shape[0] != len(out):
+            self._bits = np.zeros((len(out), 8), np.uint8)
+            self._words = self._bits.view("<u8").reshape(-1)
+        flat = self._bits.reshape(-1)
+        np.bitwise_and(mask.reshape(-1), ONE, out=flat[:pixels])     # 0/255 -> 0/1
+        flat[pixels:] = 0
+        # 8 байтов 0/1 -> 8 битов в старшем байте произведения, первый пиксель - старший бит
+        np.multiply(self._words, PACK_MAGIC, out=self._words)
+        np.right_shift(self._words, 56, out=self._words)
+        np.copyto(out, self._bits[:, 0])
+
+    def close(self):
+        if self._data is None:
+            return
+        self._data.flush()
+        self._data = None
+        with open(self.path + DATA_SUFFIX, "r+b") as f:
+            f.truncate(self.used)
+        self._index.close()
+        self._index = None
+        print(f"[{self.log_tag}] {self.path}: масок {self.count}, {self.used / (1 << 20):.1f} МБ")
+
+    def _open(self):
+        self.close()
+        name = f"masks_{time.strftime('%Y-%m-%d_%H-%M-%S')}"
+        self.path = os.path.join(self.directory, name)
+        suffix = 1
+        while os.path.exists(self.path + DATA_SUFFIX):
+            self.path = os.path.join(self.directory, f"{name}_{suffix}")
+            suffix += 1
+        self.count = 0
+        self.used = 0
+        with open(self.path + DATA_SUFFIX, "wb") as f:
+            f.truncate(GROW_BYTES)
+        self._data = np.memmap(self.path + DATA_SUFFIX, np.uint8, "r+", shape=(GROW_BYTES,))
+        self._index = open(self.path + INDEX_SUFFIX, "ab")
+
+    def _grow(self, needed):
+        capacity = max(len(self._data) + GROW_BYTES, needed)
+        self._data.flush()
+        self._data = None
+        with open(self.path + DATA_SUFFIX, "r+b") as f:
+            f.truncate(capacity)
+        self._data = np.memmap(self.path + DATA_SUFFIX, np.uint8, "r+", shape=(capacity,))
+
+
+class MaskArchiveReader:
+    """Чтение архива масок: маска по номеру, выбор по времени и повторный анализ зон"""
+
+    def __init__(self, path):
+        data_path, index_path = archive_paths(path)
+        self.path = data_path
+        self.index = np.fromfile(index_path, INDEX_DTYPE)
+        self.data = np.memmap(data_path, np.uint8, "r") if os.path.getsize(data_path) else np.zeros(0, np.uint8)
+        # Запись индекса без данных (архив обрезан при сбое) не читается
+        ends = self.index['offset'] + packed_size(self.index['height'].astype(np.int64),
+                                                 self.index['width'].astype(np.int64))
+        self.index = self.index[ends <= len(self.data)]
+
+    def __len__(self):
+        return len(self.index)
+
+    @property
+    def times(self):
+        return self.index['time']
+
+    def select(self, start=None, end=None):
+        """Номера масок в интервале времени [start, end]"""
+        times = self.times
+        first = 0 if start is None else int(np.searchsorted(times, start, "left"))
+        last = len(times) if end is None else int(np.searchsorted(times, end, "right"))
+        return range(first, last)
+
+    def mask(self, i):
+        """Маска i (uint8 0/255) в разрешении анализа"""
+        record = self.index[i]
+        height, width = int(record['height']), int(record['width'])
+        offset = int(record['offset'])
+        bits = np.unpackbits(self.data[offset:offset + packed_size(height, width)], count=height * width)
+        bits *= 255
+        return bits.reshape(height, width)
+
+    def replay(self, zones, settings, start=None, end=None):
+        """Маски интервала через этапы зон (остов, связные области) без видео.
+
+        Генератор (время, записи зон DETECTION_DTYPE); пороги и размер остова -
+        из settings, поэтому один архив можно оценить с разными параметрами.
+        """
+        detections = DetectionBuffer()
+        pipeline = MotionPipeline("replay", [ArchivedMaskStage(),
+                                             ZoneStage(ZoneSet(zones), detections, TileMotion())])
+        # Плитки требуют кадров; по готовой маске зоны оцениваются напрямую
+        pipeline.configure(dict(settings, tile_mode=False))
+        for i in self.select(start, end):
+            now = float(self.index[i]['time'])
+            if pipeline.process(self.mask(i), now) is not None:
+                yield now, detections.records.copy()
+
+
+class ArchivedMaskStage(Stage):
+    """Маска из архива вместо кадра: этапы масштаба и разности не нужны"""
+
+    name = "mask"
+
+    def process(self, ctx):
+        ctx.diff_thresh = ctx.frame
+        return True
+
+
+class MaskArchiveSink(Stage):
+    """Маски изменений анализируемых кадров - в MaskArchive (при mask_archive).
+
+    Настройки меняются из потока интерфейса, поэтому архив открывается и
+    закрывается только в потоке анализа (process, close).
+    """
+
+    name = "archive"
+
+    def __init__(self, log_tag="MaskArchive"):
+        self.log_tag = log_tag
+        self.archive = None
+        self.enabled = False
+        self.directory = "masks"
+        self.file_mb = 256
+
+    def configure(self, settings):
+        self.enabled = settings["mask_archive"]
+        self.directory = settings["mask_archive_dir"]
+        self.file_mb = settings["mask_archive_file_mb"]
+
+    def cleanup(self, max_age_days):
+        if self.enabled:
+            cleanup_archives(self.directory, max_age_days)
+
+    def close(self):
+        if self.archive is not None:
+            self.archive.close()
+            self.archive = None
+
+    def process(self, ctx):
+        if not self.enabled:
+            self.close()
+            return True
+        if self.archive is None or self.archive.directory != self.directory:
+            self.close()
+            self.archive = MaskArchive(self.directory, self.file_mb, self.log_tag)
+        self.archive.append(ctx.now, ctx.diff_thresh)
+        return True
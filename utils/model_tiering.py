@@ -0,0 +1,175 @@
+import os
+import re
+import time
+
+
+MODEL_TIERS = "nsmlx"           # Размеры моделей по возрастанию точности
+# Ориентировочная стоимость моделей YOLO11 (GFLOPs при 640) - порядок замеров
+TIER_GFLOPS = {"n": 6.5, "s": 21.5, "m": 68.0, "l": 86.9, "x": 194.9}
+
+
+def split_model_name(model_path):
+    """'yolo11x.pt' -> ('yolo11', 'x', '.pt') или None, если имя не из семейства"""
+    match = re.fullmatch(r"(.*\d)([nsmlx])(\.\w+)", os.path.basename(model_path))
+    if not match:
+        return None
+    prefix, tier, suffix = match.groups()
+    return os.path.join(os.path.dirname(model_path), prefix), tier, suffix
+
+
+class TierConfig:
+    """Модель и размер входа одной ступени"""
+
+    __slots__ = ("model_path", "tier", "imgsz", "latency")
+
+    def __init__(self, model_path, tier, imgsz):
+        self.model_path = model_path
+        self.tier = tier
+        self.imgsz = imgsz
+        self.latency = None         # Медиана замера (сек) или None, если не замерялась
+
+    @property
+    def cost(self):
+        """Ожидаемая стоимость; внутри семейства она же - порядок точности"""
+        return TIER_GFLOPS[self.tier] * (self.imgsz / 640) ** 2
+
+    def __repr__(self):
+        latency = f"{self.latency * 1000:.1f} мс" if self.latency is not None else "-"
+        return f"{os.path.basename(self.model_path)}@{self.imgsz} ({latency})"
+
+
+class ModelTiering:
+    """Выбор модели YOLO под бюджет задержки кадра.
+
+    Замер ступеней (модель x размер входа) идет по возрастанию ожидаемой
+    стоимости до первой, не укладывающейся в бюджет; выбирается самая дорогая
+    (и, значит, самая точная) из уложившихся. Во время работы скользящее среднее задержки сравнивается
+    с замером текущей ступени (коэффициент нагрузки): при превышении бюджета
+    ступень понижается, при устойчивом запасе - повышается.
+    """
+
+    BENCH_WARMUP = 2                # Прогревочных прогонов на ступень
+    BENCH_RUNS = 5                  # Замеряемых прогонов на ступень
+    SMOOTHING = 0.1                 # Коэффициент скользящего среднего задержки
+    DOWNGRADE_RATIO = 1.1           # Понижение при задержке выше бюджета на 10%
+    UPGRADE_RATIO = 0.7             # Повышение, если ступень выше уложится в 70% бюджета
+    SWITCH_INTERVAL = 30.0          # Минимальный период смены ступени (сек)
+    MIN_OBSERVATIONS = 10           # Кадров на новой ступени до первого решения
+
+    def __init__(self, model_path, budget=0.0, tiers=MODEL_TIERS, input_sizes=(640,)):
+        self.model_path = model_path
+        self.budget = budget
+        self.configs = []
+        self.current = None
+        self.latency = None
+        self.needs_benchmark = False
+        self._observed = 0
+        self._last_switch = 0.0
+
+        family = split_model_name(model_path)
+        if budget > 0 and family is None:
+            print(f"[ModelTiering] {model_path}: не модель семейства YOLO (n/s/m/l/x), подбор выключен")
+        if budget > 0 and family is not None:
+            prefix, _, suffix = family
+            self.configs = sorted((TierConfig(f"{prefix}{tier}{suffix}", tier, int(imgsz))
+                                   for tier in tiers if tier in MODEL_TIERS
+                                   for imgsz in input_sizes),
+                                  key=lambda config: config.cost)
+            self.needs_benchmark = bool(self.configs)
+
+    @property
+    def enabled(self):
+        return bool(self.configs)
+
+    def request_benchmark(self):
+        """Повторный замер при следующем кадре детектора"""
+        if self.enabled:
+            self.needs_benchmark = True
+
+    def benchmark(self, frame, load_model):
+        """Замер ступеней на кадре frame; возвращает (выбранная ступень, ее модель).
+
+        load_model(path) загружает модель; модели, не ставшие текущей, освобождаются.
+        """
+        self.needs_benchmark = False
+        for config in self.configs:
+            config.latency = None
+        models = {}
+        for config in self.configs:
+            if config.model_path not in models:
+                models[config.model_path] = load_model(config.model_path)
+            config.latency = self._measure(models[config.model_path], frame, config.imgsz)
+            print(f"[ModelTiering] Замер {config}")
+            if config.latency > self.budget:
+                # Дальше ступени только дороже
+                break
+
+        fitting = [config for config in self.configs
+                   if config.latency is not None and config.latency <= self.budget]
+        selected = max(fitting, key=lambda config: config.cost) if fitting else self.configs[0]
+        self._switch(selected, time.time())
+        print(f"[ModelTiering] Бюджет {self.budget * 1000:.0f} мс: выбрана {selected}")
+        return selected, models[selected.model_path]
+
+    def observe(self, latency, now):
+        """Учет задержки инференса; возвращает новую ступень или None"""
+        if self.current is None:
+            return None
+        if self.latency is None:
+            self.latency = latency
+        else:
+            self.latency += self.SMOOTHING * (latency - self.latency)
+        self._observed += 1
+        if self._observed < self.MIN_OBSERVATIONS or now - self._last_switch < self.SWITCH_INTERVAL:
+            return None
+
+        load = self.latency / self.current.latency if self.current.latency else 1.0
+        if self.latency > self.budget * self.DOWNGRADE_RATIO:
+            target = self._best_within(self.budget, load) or self.configs[0]
+            if target.cost >= self.current.cost:
+                return None
+        elif self.latency < self.budget * self.UPGRADE_RATIO:
+            target = self._best_within(self.budget * self.UPGRADE_RATIO, load)
+            if target is None or target.cost <= self.current.cost:
+                return None
+        else:
+            return None
+
+        print(f"[ModelTiering] Задержка {self.latency * 1000:.1f} мс (нагрузка x{load:.2f}): "
+              f"{self.current} -> {target}")
+        self._switch(target, now)
+        return target
+
+    def settle(self, now):
+        """Модель новой ступени загружена: задержка отсчитывается заново"""
+        self._switch(self.current, now)
+
+    def stats(self):
+        return {
+            'model': os.path.basename(self.current.model_path) if self.current else None,
+            'imgsz': self.current.imgsz if self.current else None,
+            'budget_ms': round(self.budget * 1000, 1),
+            'latency_ms': round(self.latency * 1000, 1) if self.latency is not None else None,
+        }
+
+    def _measure(self, model, frame, imgsz):
+        for _ in range(self.BENCH_WARMUP):
+            model(frame, imgsz=imgsz, verbose=False)
+        timings = []
+        for _ in range(self.BENCH_RUNS):
+            started = time.perf_counter()
+            model(frame, imgsz=imgsz, verbose=False)
+            timings.append(time.perf_counter() - started)
+        return sorted(timings)[len(timings) // 2]
+
+    def _best_within(self, limit, load):
+        """Самая точная замеренная ступень, укладывающаяся в limit при текущей нагрузке"""
+        fitting = [config for config in self.configs
+                   if config.latency is not None and config.latency * load <= limit]
+        return max(fitting, key=lambda config: config.cost) if fitting else None
+
+    def _switch(self, config, now):
+        self.current = config
+        self.latency = None
+        self._observed = 0
+        self._last_switch = now
@@ -0,0 +1,149 @@
+import cv2
+import numpy as np
+
+
+DIFF_THRESHOLD = 25                                  # Порог бинаризации разностного кадра
+BLUR_KERNEL = (21, 21)                               # Ядро размытия по Гауссу
+MORPH_KERNEL = np.ones((5, 5), np.uint8)             # Ядро морфологического открытия
+
+
+def make_ostov_template(ostov_size):
+    """Остов из единиц заданного размера"""
+    return np.ones((ostov_size, ostov_size), dtype=np.uint8)
+
+
+def preprocess_frame(frame, use_filter):
+    """Перевод кадра в оттенки серого и (опционально) размытие"""
+    gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+    if use_filter:
+        gray = cv2.GaussianBlur(gray, BLUR_KERNEL, 0)
+    return gray
+
+
+def compute_motion_mask(gray, prev_gray, use_filter, diff=None, out=None):
+    """Бинарная маска изменений между текущим и предыдущим кадром (0/255).
+
+    diff и out - необязательные буферы промежуточной разности и результата.
+    """
+    diff = cv2.absdiff(gray, prev_gray, dst=diff)
+    if use_filter:
+        cv2.threshold(diff, DIFF_THRESHOLD, 255, cv2.THRESH_BINARY, dst=diff)
+        return cv2.morphologyEx(diff, cv2.MORPH_OPEN, MORPH_KERNEL, dst=out)
+    _, diff_thresh = cv2.threshold(diff, DIFF_THRESHOLD, 255, cv2.THRESH_BINARY, dst=out)
+    return diff_thresh
+
+
+def zone_density(diff_thresh, roi, mask=None, area=None, out=None):
+    """Изменения внутри зоны: (маска изменений в roi или None, относительная плотность).
+
+    mask - маска многоугольной зоны внутри roi (0/255), area - число ее пикселей,
+    out - буфер размером с mask под пересечение.
+    """
+    x, y, w, h = map(int, roi)
+    roi_mask = diff_thresh[y:y + h, x:x + w]
+    if roi_mask.size == 0:
+        return None, 0.0
+    if mask is None:
+        area = roi_mask.size
+    else:
+        roi_mask = cv2.bitwise_and(roi_mask, mask, dst=out)
+        if area is None:
+            area = cv2.countNonZero(mask)
+    if not area:
+        return None, 0.0
+    return roi_mask, cv2.countNonZero(roi_mask) / area
+
+
+def evaluate_roi(diff_thresh, roi, p_dop, ostov_template, mask=None, area=None, out=None, work=None):
+    """Анализ одной области интереса: (движение недопустимо, относительная плотность).
+
+    out и work - необязательные буферы размером с roi (пересечение с маской и эрозия).
+    """
+    # Относительная плотность изменившихся пикселей
+    roi_mask, p = zone_density(diff_thresh, roi, mask, area, out)
+    if roi_mask is None or p < p_dop:
+        return False, p
+
+    # Поиск остова
+    return scan_for_template(roi_mask, ostov_template, work), p
+
+
+def scan_for_template(area_matrix, template, out=None):
+    """Проверка, есть ли в area_matrix блок ненулевых значений размером с template.
+
+    Эквивалентно попиксельному перебору окон: эрозия с нулевой границей
+    оставляет ненулевые пиксели только там, где окно целиком внутри и
+    заполнено. out - необязательный буфер размером с area_matrix.
+    """
+    h, w = template.shape
+    H, W = area_matrix.shape
+    if h > H or w > W:
+        return False
+    eroded = cv2.erode(area_matrix, template, dst=out,
+                       borderType=cv2.BORDER_CONSTANT, borderValue=0)
+    return cv2.countNonZero(eroded) > 0
+
+
+def find_blobs(diff_thresh, min_area=1):
+    """Связные области маски изменений за один проход по кадру.
+
+    Возвращает список словарей {'box': (x, y, w, h), 'area', 'centroid': (cx, cy)}
+    для областей площадью не меньше min_area пикселей.
+    """
+    count, _, stats, centroids = cv2.connectedComponentsWithStats(diff_thresh, connectivity=8)
+    blobs = []
+    for i in np.flatnonzero(stats[1:, cv2.CC_STAT_AREA] >= min_area) + 1:
+        x, y, w, h, area = (int(v) for v in stats[i])
+        blobs.append({'box': (x, y, w, h), 'area': area,
+                      'centroid': (float(centroids[i][0]), float(centroids[i][1]))})
+    return blobs
+
+
+class MotionBuffers:
+    """Предвыделенные буферы конвейера кадра, пересоздаваемые только при смене разрешения.
+
+    Серые и размытые кадры хранятся парами (текущий/предыдущий) и меняются
+    ролями без копирования.
+    """
+
+    def __init__(self):
+        self._shape = None
+        self._use_filter = None
+
+    def reset(self):
+        """Следующий кадр станет первым (нет предыдущего)"""
+        self._has_prev = False
+
+    def gray(self, frame):
+        """Кадр в оттенках серого в очередном буфере пары"""
+        if frame.shape[:2] != self._shape:
+            self._allocate(frame.shape)
+        index = self._index
+        self._index ^= 1
+        return cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY, dst=self._gray[index])
+
+    def motion_mask(self, frame, use_filter):
+        """Маска изменений относительно предыдущего кадра или None для первого кадра"""
+        if use_filter != self._use_filter:
+            self._use_filter = use_filter
+            self._has_prev = False
+        gray = self.gray(frame)
+        index = self._index ^ 1
+        frames = self._blurred if use_filter else self._gray
+        if use_filter:
+            cv2.GaussianBlur(gray, BLUR_KERNEL, 0, dst=frames[index])
+        if not self._has_prev:
+            self._has_prev = True
+            return None
+        return compute_motion_mask(frames[index], frames[index ^ 1], use_filter,
+                                   diff=self._diff, out=self._mask)
+
+    def _allocate(self, shape):
+        height, width = shape[:2]
+        self._shape = (height, width)
+        self._gray = [np.empty((height, width), np.uint8) for _ in range(2)]
+        self._blurred = [np.empty((height, width), np.uint8) for _ in range(2)]
+        self._diff = np.empty((height, width), np.uint8)
+        self._mask = np.empty((height, width), np.uint8)
+        self._index = 0
+        self._has_prev = False
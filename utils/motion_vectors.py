@@ -0,0 +1,188 @@
+import numpy as np
+import cv2
+from utils.video_source import VideoSource, is_live_url
+from utils.motion_algorithm import zone_density
+from utils.zones import ZoneSet
+
+
+CELL_SIZE = 16                  # Ячейка сетки энергии - макроблок H.264 (пикс.)
+
+
+class _AvCapture:
+    """Декодирование PyAV с экспортом векторов движения кодека (flags2=+export_mvs).
+
+    Интерфейс cv2.VideoCapture: grab() декодирует кадр и сохраняет его
+    векторы, retrieve() преобразует кадр в BGR только по запросу.
+    """
+
+    def __init__(self, source, options, decode_threads=0):
+        import av
+        self._error = av.error.FFmpegError
+        self.container = None
+        self.stream = None
+        self.frame = None
+        self.vectors = None
+        try:
+            self.container = av.open(source, options=options, timeout=5.0)
+            self.stream = self.container.streams.video[0]
+        except (self._error, IndexError) as e:
+            print(f"[MotionVectors] Не удалось открыть {source}: {e}")
+            self.release()
+            return
+        context = self.stream.codec_context
+        context.options = {'flags2': "+export_mvs"}
+        if decode_threads:
+            context.thread_count = int(decode_threads)
+        context.thread_type = "SLICE"   # Кадровая многопоточность задерживает кадры
+        self._frames = self.container.decode(self.stream)
+
+    def isOpened(self):
+        return self.container is not None
+
+    def grab(self):
+        if self.container is None:
+            return False
+        try:
+            self.frame = next(self._frames)
+        except (StopIteration, self._error):
+            self.frame = None
+            return False
+        side_data = self.frame.side_data.get("MOTION_VECTORS")
+        # У опорных (I) кадров векторов нет
+        self.vectors = side_data.to_ndarray() if side_data is not None else None
+        return True
+
+    def retrieve(self):
+        if self.frame is None:
+            return False, None
+        return True, self.frame.to_ndarray(format="bgr24")
+
+    def read(self):
+        if not self.grab():
+            return False, None
+        return self.retrieve()
+
+    def get(self, prop):
+        if self.stream is None:
+            return 0.0
+        if prop == cv2.CAP_PROP_FPS:
+            return float(self.stream.average_rate or 0.0)
+        if prop == cv2.CAP_PROP_FRAME_WIDTH:
+            return float(self.stream.codec_context.width)
+        if prop == cv2.CAP_PROP_FRAME_HEIGHT:
+            return float(self.stream.codec_context.height)
+        return 0.0
+
+    def release(self):
+        if self.container is not None:
+            self.container.close()
+            self.container = None
+
+
+class MotionVectorSource(VideoSource):
+    """VideoSource на PyAV: после grab() доступны векторы движения кадра.
+
+    Для кадров без движения можно не вызывать retrieve() - пропускаются
+    преобразование в BGR и весь пиксельный конвейер. Сам декодер работает
+    на каждом кадре: векторы экспортирует декодер H.264.
+    """
+
+    def open(self):
+        self._close_capture()
+        self._set_state("connecting")
+        # Параметры FFmpeg (как и в VideoSource) - только для сетевых потоков
+        options = dict(item.split(";", 1) for item in self.options.split("|") if item) if self.live else {}
+        self.cap = _AvCapture(self.source, options, self.decode_threads)
+        if self.cap.isOpened():
+            self._set_state("streaming")
+            return True
+        self.metrics['last_error'] = "Не удалось открыть источник видео"
+        return False
+
+    @property
+    def vectors(self):
+        return self.cap.vectors if self.cap is not None else None
+
+    @property
+    def frame_size(self):
+        """(высота, ширина) последнего декодированного кадра"""
+        frame = self.cap.frame if self.cap is not None else None
+        return (frame.height, frame.width) if frame is not None else None
+
+
+def open_motion_vector_source(source, settings, health_callback=None):
+    """MotionVectorSource для сетевого потока или None (локальный источник, нет PyAV)"""
+    if not isinstance(source, str) or not is_live_url(source):
+        print("[MotionVectors] Предфильтр по векторам движения - только для сетевых потоков")
+        return None
+    try:
+        import av  # noqa: F401
+    except ImportError:
+        print("[MotionVectors] PyAV не установлен, предфильтр по векторам движения выключен")
+        return None
+    cap = MotionVectorSource.from_settings(source, settings, health_callback)
+    cap.open()
+    return cap
+
+
+class MotionEnergy:
+    """Энергия движения по зонам из векторов кодека, без обработки пикселей.
+
+    Векторы с модулем от min_magnitude (пикс.) отмечают ячейки сетки
+    CELL_SIZE; энергия зоны - доля ее ячеек с движением. Кадр «тихий», если
+    энергия всех зон ниже threshold - тогда пиксельный конвейер не нужен.
+    """
+
+    def __init__(self, threshold=0.005, min_magnitude=1.0):
+        self.threshold = threshold
+        self.min_magnitude = min_magnitude
+        self.zones = ZoneSet()
+        self.grid = None
+        self.energy = np.zeros(0, np.float32)
+        self.skipped = 0
+        self.passed = 0
+
+    def configure(self, settings):
+        self.threshold = settings.get("mv_energy_threshold", 0.005)
+        self.min_magnitude = settings.get("mv_min_magnitude", 1.0)
+
+    def update(self, vectors, frame_size, zones):
+        """Энергия зон (relative zones как в ZoneSet) или None, если векторов нет"""
+        if vectors is None or frame_size is None:
+            return None
+        height, width = frame_size
+        grid_shape = (-(-height // CELL_SIZE), -(-width // CELL_SIZE))
+        if self.grid is None or self.grid.shape != grid_shape:
+            self.grid = np.zeros(grid_shape, np.uint8)
+        self.zones.set_zones(zones)
+        compiled = self.zones.prepare(grid_shape)
+        if len(self.energy) != len(compiled):
+            self.energy = np.zeros(len(compiled), np.float32)
+
+        grid = self.grid
+        grid.fill(0)
+        scale = np.maximum(vectors['motion_scale'], 1).astype(np.float32)
+        magnitude = np.hypot(vectors['motion_x'], vectors['motion_y']) / scale
+        moving = vectors[magnitude >= self.min_magnitude]
+        if len(moving):
+            rows = np.clip(moving['dst_y'] // CELL_SIZE, 0, grid_shape[0] - 1)
+            cols = np.clip(moving['dst_x'] // CELL_SIZE, 0, grid_shape[1] - 1)
+            grid[rows, cols] = 255
+        for i, zone in enumerate(compiled):
+            self.energy[i] = zone_density(grid, zone.roi, zone.mask, zone.area, zone.scratch)[1]
+        return self.energy
+
+    def is_quiet(self, vectors, frame_size, zones):
+        """True - движения нет ни в одной зоне; кадр без векторов не считается тихим"""
+        energy = self.update(vectors, frame_size, zones)
+        quiet = energy is not None and len(energy) > 0 and float(energy.max()) < self.threshold
+        if quiet:
+            self.skipped += 1
+        else:
+            self.passed += 1
+        return quiet
+
+    def stats(self):
+        total = max(self.skipped + self.passed, 1)
+        return {'skipped': self.skipped, 'passed': self.passed,
+                'skip_ratio': round(self.skipped / total, 3)}
@@ -0,0 +1,555 @@
+import os
+import copy
+import json
+import time
+import cv2
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from models.defaults import DEFAULT_SETTINGS
+from utils.zones import ZoneSet, FULL_FRAME_ZONE, normalize_zones, pixel_rect_to_zone
+from utils.detections import DetectionBuffer
+from utils.pipeline import MotionPipeline, motion_stages
+
+
+VIDEO_EXTENSIONS = (".mp4", ".avi", ".mkv", ".mov", ".m4v", ".ts", ".h264")
+YOLO_TARGET_CLASSES = ["person", "cat"]
+PARQUET_BATCH_SIZE = 10000      # Кол-во записей в одной группе строк parquet
+
+_yolo_models = {}               # Кэш моделей YOLO внутри процесса пула
+
+
+def load_settings(config_file="settings.json"):
+    """Чтение файла настроек без менеджера настроек (для фоновых процессов)"""
+    settings = copy.deepcopy(DEFAULT_SETTINGS)
+    if config_file and os.path.exists(config_file):
+        with open(config_file, "r") as f:
+            settings.update(json.load(f))
+    return settings
+
+
+def collect_video_files(inputs):
+    """Список видеофайлов из путей к файлам и каталогам"""
+    files = []
+    for path in inputs:
+        if os.path.isdir(path):
+            for root, _, names in os.walk(path):
+                files.extend(os.path.join(root, name) for name in sorted(names)
+                             if name.lower().endswith(VIDEO_EXTENSIONS))
+        elif os.path.isfile(path):
+            files.append(path)
+        else:
+            print(f"[OfflineAnalyzer] Пропущен несуществующий путь: {path}")
+    return files
+
+
+def output_names(files):
+    """Имена результатов (без расширения) - пути относительно общего каталога входов.
+
+    cam1/0001.mp4 и cam2/0001.mp4 дают cam1/0001 и cam2/0001. Файлу, имя
+    которого уже занято (повтор пути, 0001.mp4 и 0001.avi в одном каталоге),
+    соответствует None.
+    """
+    paths = [os.path.abspath(path) for path in files]
+    try:
+        root = os.path.commonpath([os.path.dirname(path) for path in paths]) if paths else None
+    except ValueError:
+        # Файлы на разных дисках
+        root = None
+    names = []
+    seen = set()
+    for path in paths:
+        name = os.path.splitext(os.path.relpath(path, root) if root else os.path.basename(path))[0]
+        key = os.path.normcase(name)
+        names.append(None if key in seen else name)
+        seen.add(key)
+    return names
+
+
+def _part_path(out_path, index):
+    """Файл результатов интервала index рядом с итоговым out_path"""
+    directory, base = os.path.split(out_path)
+    stem, ext = os.path.splitext(base)
+    return os.path.join(directory, f".{stem}.part{index:04d}{ext}")
+
+
+class ClassicAnalyzer:
+    """Классический алгоритм на конвейере живых детекторов, без задержек между кадрами"""
+
+    def __init__(self, settings, zones):
+        self.detections = DetectionBuffer()
+        self.pipeline = MotionPipeline("offline", motion_stages(ZoneSet(zones), self.detections))
+        self.pipeline.configure(settings)
+
+    def process(self, frame):
+        """Список (CompiledZone, detected, activity) или None для первого кадра"""
+        ctx = self.pipeline.process(frame)
+        if ctx is None:
+            return None
+        records = self.detections.records
+        return [(zone, bool(record['detected']), float(record['activity']))
+                for zone, record in zip(ctx.zones, records)]
+
+
+class YoloAnalyzer:
+    """Детекция целевых классов моделью YOLO"""
+
+    def __init__(self, model_path, target_classes=YOLO_TARGET_CLASSES):
+        if model_path not in _yolo_models:
+            from ultralytics import YOLO
+            from ultralytics.utils import LOGGER
+            LOGGER.setLevel("WARNING")
+            _yolo_models[model_path] = YOLO(model_path)
+        self.model = _yolo_models[model_path]
+        self.class_names = self.model.names
+        self.target_ids = [cls_id for cls_id, name in self.class_names.items() if name in target_classes]
+
+    def process(self, frame):
+        """Список (label, confidence, box) для найденных объектов"""
+        objects = []
+        for result in self.model(frame, stream=True, verbose=False):
+            for box in result.boxes:
+                cls_id = int(box.cls[0])
+                if cls_id in self.target_ids:
+                    objects.append((self.class_names[cls_id],
+                                    float(box.conf[0]),
+                                    [round(float(v), 1) for v in box.xyxy[0]]))
+        return objects
+
+
+class EventTracker:
+    """Объединение подряд идущих кадров со срабатыванием в события"""
+
+    def __init__(self, pipeline):
+        self.pipeline = pipeline
+        self.events = []
+        self._current = None
+
+    def update(self, frame_idx, t, active, peak=0.0, labels=()):
+        if not active:
+            self._close()
+            return
+        if self._current is None:
+            self._current = {'pipeline': self.pipeline,
+                             'start_frame': frame_idx, 'end_frame': frame_idx,
+                             'start_time': t, 'end_time': t,
+                             'peak_activity': peak, 'labels': set()}
+        self._current['end_frame'] = frame_idx
+        self._current['end_time'] = t
+        self._current['peak_activity'] = max(self._current['peak_activity'], peak)
+        self._current['labels'].update(labels)
+
+    def finish(self):
+        self._close()
+        return self.events
+
+    def _close(self):
+        if self._current is not None:
+            self._current['labels'] = sorted(self._current['labels'])
+            self.events.append(self._current)
+            self._current = None
+
+
+class DetectionWriter:
+    """Запись детекций в JSONL или Parquet"""
+
+    PARQUET_FIELDS = ["file", "frame", "time", "pipeline", "zone", "roi", "detected",
+                      "activity", "label", "confidence", "box"]
+
+    def __init__(self, path, output_format="jsonl"):
+        self.path = path
+        self.output_format = output_format
+        self._rows = []
+        self._parquet_writer = None
+        if output_format == "jsonl":
+            self._file = open(path, "w", encoding="utf-8")
+        elif output_format == "parquet":
+            import pyarrow as pa
+            self._schema = pa.schema([
+                ("file", pa.string()), ("frame", pa.int64()), ("time", pa.float64()),
+                ("pipeline", pa.string()), ("zone", pa.int32()), ("roi", pa.list_(pa.int32())),
+                ("detected", pa.bool_()), ("activity", pa.float64()),
+                ("label", pa.string()), ("confidence", pa.float64()),
+                ("box", pa.list_(pa.float64())),
+            ])
+        else:
+            raise ValueError(f"Неизвестный формат вывода: {output_format}")
+
+    def write(self, record):
+        if self.output_format == "jsonl":
+            self._file.write(json.dumps(record, ensure_ascii=False) + "\n")
+            return
+        self._rows.append({field: record.get(field) for field in self.PARQUET_FIELDS})
+        if len(self._rows) >= PARQUET_BATCH_SIZE:
+            self._flush_parquet()
+
+    def close(self):
+        if self.output_format == "jsonl":
+            self._file.close()
+            return
+        self._flush_parquet(force=True)
+        if self._parquet_writer:
+            self._parquet_writer.close()
+
+    def _flush_parquet(self, force=False):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+        if not self._rows and not (force and self._parquet_writer is None):
+            return
+        table = pa.Table.from_pylist(self._rows, schema=self._schema)
+        if self._parquet_writer is None:
+            self._parquet_writer = pq.ParquetWriter(self.path, self._schema)
+        self._parquet_writer.write_table(table)
+        self._rows = []
+
+
+def probe_video(path):
+    """Параметры видеофайла: fps, кол-во кадров, разрешение и точность поиска по кадрам"""
+    cap = cv2.VideoCapture(path)
+    if not cap.isOpened():
+        return None
+    try:
+        frame_count = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+        return {
+            'fps': cap.get(cv2.CAP_PROP_FPS) or 25.0,
+            'frame_count': frame_count,
+            'width': int(cap.get(cv2.CAP_PROP_FRAME_WIDTH)),
+            'height': int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT)),
+            'seekable': _probe_seek(cap, frame_count // 2),
+        }
+    finally:
+        cap.release()
+
+
+def _probe_seek(cap, frame_idx):
+    """Встает ли поиск CAP_PROP_POS_FRAMES точно на кадр frame_idx"""
+    if frame_idx <= 0:
+        return True
+    cap.set(cv2.CAP_PROP_POS_FRAMES, frame_idx)
+    return int(cap.get(cv2.CAP_PROP_POS_FRAMES)) == frame_idx
+
+
+def plan_chunks(frame_count, fps, step, chunk_duration, seekable=True):
+    """Разбиение файла на интервалы кадров [start, stop), выровненные по шагу анализа.
+
+    Последний интервал открыт (stop=None) и читается до конца файла, так как
+    CAP_PROP_FRAME_COUNT у многих контейнеров приблизителен. Без точного
+    поиска по кадрам (seekable=False) каждый интервал пришлось бы читать с
+    начала файла, поэтому файл читается целиком одним интервалом.
+    """
+    if not chunk_duration or frame_count <= 0 or not seekable:
+        return [(0, None)]
+    chunk_frames = max(step, int(chunk_duration * fps) // step * step)
+    starts = list(range(0, frame_count, chunk_frames))
+    return [(start, starts[i + 1] if i + 1 < len(starts) else None)
+            for i, start in enumerate(starts)]
+
+
+def _seek(cap, frame_idx):
+    """Позиционирование на кадр (план интервалов учитывает точность поиска, см. plan_chunks)"""
+    if frame_idx and not _probe_seek(cap, frame_idx):
+        raise IOError(f"Неточный поиск по кадрам: не удалось встать на кадр {frame_idx}")
+
+
+def analyze_chunk(path, part_path, settings, zones, pipelines, output_format,
+                  yolo_model_path, step, fps, start_frame=0, stop_frame=None):
+    """Анализ интервала кадров [start_frame, stop_frame) одного файла.
+
+    Для корректной разности кадров на границе интервала предыдущий
+    анализируемый кадр (start_frame - step) читается как кадр перекрытия:
+    он задает prev_gray, но в результаты не попадает.
+    """
+    started = time.time()
+    cap = cv2.VideoCapture(path)
+    if not cap.isOpened():
+        raise IOError(f"Не удалось открыть источник видео: {path}")
+
+    classic = ClassicAnalyzer(settings, zones) if "classic" in pipelines else None
+    yolo = YoloAnalyzer(yolo_model_path) if "yolo" in pipelines else None
+    trackers = {name: EventTracker(name) for name in pipelines}
+
+    name = os.path.basename(path)
+    writer = DetectionWriter(part_path, output_format)
+
+    frames_read = 0
+    frames_analyzed = 0
+    first_analyzed = None
+    last_analyzed = None
+    roi_hits = [0] * len(zones)
+    label_hits = {}
+    try:
+        frame_idx = max(0, start_frame - step)
+        _seek(cap, frame_idx)
+        while stop_frame is None or frame_idx < stop_frame:
+            overlap = frame_idx < start_frame
+            if frame_idx % step:
+                # Пропускаемые кадры не декодируются в BGR
+                if not cap.grab():
+                    break
+                frame_idx += 1
+                frames_read += not overlap
+                continue
+
+            ret, frame = cap.read()
+            if not ret:
+                break
+            if overlap:
+                if classic:
+                    classic.process(frame)
+                frame_idx += 1
+                continue
+
+            frames_read += 1
+            frames_analyzed += 1
+            if first_analyzed is None:
+                first_analyzed = frame_idx
+            last_analyzed = frame_idx
+            t = round(frame_idx / fps, 3)
+
+            if classic:
+                results = classic.process(frame)
+                if results is not None:
+                    peak = 0.0
+                    any_detected = False
+                    for i, (zone, found, p) in enumerate(results):
+                        writer.write({'file': name, 'frame': frame_idx, 'time': t, 'pipeline': "classic",
+                                      'zone': i, 'roi': list(zone.roi), 'detected': found, 'activity': p})
+                        if found:
+                            roi_hits[i] += 1
+                            any_detected = True
+                            peak = max(peak, p)
+                    trackers["classic"].update(frame_idx, t, any_detected, peak)
+
+            if yolo:
+                objects = yolo.process(frame)
+                for label, conf, box in objects:
+                    writer.write({'file': name, 'frame': frame_idx, 'time': t, 'pipeline': "yolo",
+                                  'label': label, 'confidence': conf, 'box': box})
+                    label_hits[label] = label_hits.get(label, 0) + 1
+                trackers["yolo"].update(frame_idx, t, bool(objects),
+                                        max((conf for _, conf, _ in objects), default=0.0),
+                                        [label for label, _, _ in objects])
+
+            frame_idx += 1
+    finally:
+        cap.release()
+        writer.close()
+
+    return {
+        'start_frame': start_frame,
+        'part_path': part_path,
+        'frames_read': frames_read,
+        'frames_analyzed': frames_analyzed,
+        'first_analyzed': first_analyzed,
+        'last_analyzed': last_analyzed,
+        'roi_hits': roi_hits,
+        'label_hits': label_hits,
+        'events': [event for tracker in trackers.values() for event in tracker.finish()],
+        'stage_timings': classic.pipeline.timings if classic else {},
+        'started': started,
+        'processing_time': time.time() - started,
+    }
+
+
+def merge_events(chunks):
+    """Объединение событий соседних интервалов, продолжающихся через границу"""
+    merged = {}
+    prev_last = None
+    for chunk in chunks:
+        for event in chunk['events']:
+            events = merged.setdefault(event['pipeline'], [])
+            if (events and prev_last is not None
+                    and events[-1]['end_frame'] == prev_last
+                    and event['start_frame'] == chunk['first_analyzed']):
+                tail = events[-1]
+                tail['end_frame'] = event['end_frame']
+                tail['end_time'] = event['end_time']
+                tail['peak_activity'] = max(tail['peak_activity'], event['peak_activity'])
+                tail['labels'] = sorted(set(tail['labels']) | set(event['labels']))
+            else:
+                events.append(dict(event))
+        if chunk['last_analyzed'] is not None:
+            prev_last = chunk['last_analyzed']
+    return [event for events in merged.values() for event in events]
+
+
+def concat_outputs(part_paths, out_path, output_format):
+    """Склейка результатов интервалов в один файл в порядке следования кадров"""
+    if output_format == "jsonl":
+        with open(out_path, "wb") as out:
+            for part in part_paths:
+                with open(part, "rb") as f:
+                    while True:
+                        data = f.read(1 << 20)
+                        if not data:
+                            break
+                        out.write(data)
+    else:
+        import pyarrow.parquet as pq
+        writer = None
+        for part in part_paths:
+            table = pq.read_table(part)
+            if writer is None:
+                writer = pq.ParquetWriter(out_path, table.schema)
+            writer.write_table(table)
+        if writer:
+            writer.close()
+    for part in part_paths:
+        os.remove(part)
+
+
+def _finalize_file(path, out_path, info, zones, output_format, chunks):
+    """Итог по файлу из результатов его интервалов.
+
+    Время обработки - от начала первого до конца последнего интервала файла
+    (интервалы других файлов пула в него не входят).
+    """
+    chunks = sorted(chunks, key=lambda c: c['start_frame'])
+    elapsed = (max(c['started'] + c['processing_time'] for c in chunks)
+               - min(c['started'] for c in chunks))
+    concat_outputs([c['part_path'] for c in chunks], out_path, output_format)
+
+    frames_read = sum(c['frames_read'] for c in chunks)
+    label_hits = {}
+    for chunk in chunks:
+        for label, hits in chunk['label_hits'].items():
+            label_hits[label] = label_hits.get(label, 0) + hits
+    roi_hits = [sum(hits) for hits in zip(*(c['roi_hits'] for c in chunks))]
+    stage_timings = {}
+    for chunk in chunks:
+        for name, (total, count) in chunk['stage_timings'].items():
+            timing = stage_timings.setdefault(name, [0.0, 0])
+            timing[0] += total
+            timing[1] += count
+    fps = info['fps']
+    return {
+        'file': path,
+        'output': out_path,
+        'fps': fps,
+        'resolution': [info['width'], info['height']],
+        'duration': round(frames_read / fps, 3),
+        'frames_read': frames_read,
+        'frames_analyzed': sum(c['frames_analyzed'] for c in chunks),
+        'chunks': len(chunks),
+        'processing_time': round(elapsed, 3),
+        'cpu_time': round(sum(c['processing_time'] for c in chunks), 3),
+        'processing_fps': round(frames_read / elapsed, 1) if elapsed > 0 else 0.0,
+        # Среднее время этапов классического конвейера (мс на кадр, дошедший до этапа)
+        'stage_ms': {name: round(total / count * 1000, 3) for name, (total, count) in stage_timings.items()
+                     if count},
+        'roi_hits': [{'zone': zone, 'frames': hits} for zone, hits in zip(zones, roi_hits)],
+        'label_hits': label_hits,
+        'events': merge_events(chunks),
+    }
+
+
+def _prepare_file(path, name, output_dir, settings, roi_list, output_format, sample_interval, chunk_duration):
+    """Параметры файла, зоны интереса и план интервалов.
+
+    name - имя результатов в output_dir (output_names). Зоны: прямоугольники
+    roi_list в пикселях, иначе зоны из настроек, иначе весь кадр.
+    """
+    info = probe_video(path)
+    if info is None:
+        return None
+    if roi_list:
+        zones = [pixel_rect_to_zone(roi, info['width'], info['height']) for roi in roi_list]
+    else:
+        zones = normalize_zones(settings.get("zones")) or [FULL_FRAME_ZONE]
+    if sample_interval is None:
+        sample_interval = settings["time_sleep"]
+    step = max(1, int(round(sample_interval * info['fps'])))
+    out_path = os.path.join(output_dir, f"{name}.{output_format}")
+    os.makedirs(os.path.dirname(out_path), exist_ok=True)
+    chunks = plan_chunks(info['frame_count'], info['fps'], step, chunk_duration, info['seekable'])
+    if chunk_duration and not info['seekable']:
+        print(f"[OfflineAnalyzer] {path}: неточный поиск по кадрам, файл анализируется одним интервалом")
+    return info, zones, step, out_path, chunks
+
+
+def analyze_file(path, output_dir, settings, roi_list=None, pipelines=("classic",),
+                 output_format="jsonl", yolo_model_path="yolo11n.pt", sample_interval=None):
+    """Последовательный анализ одного видеофайла без пауз между кадрами.
+
+    sample_interval - шаг анализа во времени видео (сек), по умолчанию time_sleep
+    из настроек; 0 - анализировать каждый кадр.
+    """
+    name = os.path.splitext(os.path.basename(path))[0]
+    prepared = _prepare_file(path, name, output_dir, settings, roi_list, output_format, sample_interval, 0)
+    if prepared is None:
+        return {'file': path, 'error': "Не удалось открыть источник видео"}
+    info, zones, step, out_path, _ = prepared
+    chunk = analyze_chunk(path, _part_path(out_path, 0), settings, zones, pipelines, output_format,
+                          yolo_model_path, step, info['fps'])
+    return _finalize_file(path, out_path, info, zones, output_format, [chunk])
+
+
+def run_batch(files, output_dir, settings, workers=None, roi_list=None, pipelines=("classic",),
+              output_format="jsonl", yolo_model_path="yolo11n.pt", sample_interval=None,
+              chunk_duration=300):
+    """Параллельный анализ набора файлов в пуле процессов, запись summary.json.
+
+    Длинные файлы делятся на интервалы по chunk_duration секунд видео, которые
+    обрабатываются на всех ядрах; результат совпадает с последовательным
+    прогоном. chunk_duration=0 - каждый файл целиком в одном процессе.
+    Результаты файла - <путь относительно общего каталога входов>.<формат>;
+    файлы с уже занятым именем не анализируются.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    started = time.time()
+    summaries = []
+    pending = {}
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = {}
+        for path, name in zip(files, output_names(files)):
+            if name is None:
+                summaries.append({'file': path, 'error': "Имя результатов совпадает с другим файлом"})
+                print(f"[OfflineAnalyzer] Пропущен {path}: имя результатов совпадает с другим файлом")
+                continue
+            prepared = _prepare_file(path, name, output_dir, settings, roi_list, output_format,
+                                     sample_interval, chunk_duration)
+            if prepared is None:
+                summaries.append({'file': path, 'error': "Не удалось открыть источник видео"})
+                continue
+            info, zones, step, out_path, chunks = prepared
+            pending[path] = {'info': info, 'zones': zones, 'out_path': out_path,
+                             'remaining': len(chunks), 'chunks': [], 'error': None}
+            for idx, (start, stop) in enumerate(chunks):
+                future = pool.submit(analyze_chunk, path, _part_path(out_path, idx), settings, zones, pipelines,
+                                     output_format, yolo_model_path, step, info['fps'], start, stop)
+                futures[future] = path
+
+        for future in as_completed(futures):
+            path = futures[future]
+            state = pending[path]
+            state['remaining'] -= 1
+            try:
+                state['chunks'].append(future.result())
+            except Exception as e:
+                state['error'] = str(e)
+            if state['remaining']:
+                continue
+
+            if state['error']:
+                for chunk in state['chunks']:
+                    if os.path.exists(chunk['part_path']):
+                        os.remove(chunk['part_path'])
+                summary = {'file': path, 'error': state['error']}
+                print(f"[OfflineAnalyzer] Ошибка {path}: {summary['error']}")
+            else:
+                summary = _finalize_file(path, state['out_path'], state['info'], state['zones'],
+                                         output_format, state['chunks'])
+                print(f"[OfflineAnalyzer] {path}: {summary['frames_read']} кадров, "
+                      f"интервалов: {summary['chunks']}, событий: {len(summary['events'])}")
+            summaries.append(summary)
+
+    summaries.sort(key=lambda s: s['file'])
+    report = {
+        'settings': settings,
+        'options': {'roi_list': roi_list, 'pipelines': list(pipelines), 'output_format': output_format,
+                    'yolo_model_path': yolo_model_path, 'sample_interval': sample_interval,
+                    'chunk_duration': chunk_duration},
+        'total_time': round(time.time() - started, 3),
+        'files': summaries,
+    }
+    with open(os.path.join(output_dir, "summary.json"), "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=4, ensure_ascii=False)
+    return report
@@ -0,0 +1,231 @@
+import os
+import json
+import time
+import itertools
+import cv2
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from utils.motion_algorithm import MotionBuffers, make_ostov_template, zone_density, scan_for_template
+from utils.zones import ZoneSet, FULL_FRAME_ZONE, normalize_zones
+from utils.offline_analyzer import probe_video
+from utils.governor import RateGovernor
+
+
+def load_labels(path):
+    """Разметка клипов.
+
+    Формат JSON: {"clips": [{"file": "clip.mp4", "alarm": [[начало, конец], ...],
+    "zones": [...]}]} - интервалы ожидаемой тревоги в секундах видео, вне
+    интервалов тревоги быть не должно. Зоны необязательны (относительные
+    координаты, как в настройках). Пути файлов - относительно файла разметки.
+    """
+    with open(path, "r", encoding="utf-8") as f:
+        data = json.load(f)
+    base = os.path.dirname(os.path.abspath(path))
+    clips = []
+    for clip in data.get("clips", []):
+        clips.append({
+            'file': os.path.join(base, clip["file"]),
+            'alarm': [tuple(map(float, interval)) for interval in clip.get("alarm", [])],
+            'zones': normalize_zones(clip.get("zones")),
+        })
+    return clips
+
+
+def clip_statistics(path, zones, use_filter, ostov_sizes, min_p_dop, sample_interval=0, scale=1.0):
+    """Статистика клипа для всех порогов сразу (выполняется в процессе пула).
+
+    Маски изменений считаются один раз. Для каждого анализируемого кадра и
+    зоны сохраняется плотность изменений, а для кадров с плотностью от
+    min_p_dop - наличие остова каждого размера из ostov_sizes. Любая пара
+    (p_dop, ostov_size) из сетки затем оценивается без повторной обработки видео.
+    Кадры уменьшаются до масштаба анализа scale так же, как в RateGovernor.
+    """
+    info = probe_video(path)
+    if info is None:
+        raise IOError(f"Не удалось открыть источник видео: {path}")
+    step = max(1, int(round(sample_interval * info['fps'])))
+    templates = [make_ostov_template(size) for size in ostov_sizes]
+    zone_set = ZoneSet(zones)
+    buffers = MotionBuffers()
+    governor = RateGovernor({})
+    governor.scale = scale
+
+    times, densities, blocks = [], [], []
+    mask_time = density_time = 0.0
+    scan_time = np.zeros(len(ostov_sizes))
+    scan_count = np.zeros(len(ostov_sizes), dtype=np.int64)
+
+    cap = cv2.VideoCapture(path)
+    frame_idx = 0
+    try:
+        while True:
+            if frame_idx % step:
+                if not cap.grab():
+                    break
+                frame_idx += 1
+                continue
+            ret, frame = cap.read()
+            if not ret:
+                break
+
+            started = time.perf_counter()
+            diff_thresh = buffers.motion_mask(governor.resize(frame), use_filter)
+            mask_time += time.perf_counter() - started
+            if diff_thresh is None:
+                frame_idx += 1
+                continue
+
+            frame_p, frame_blocks = [], []
+            for zone in zone_set.prepare(diff_thresh.shape):
+                started = time.perf_counter()
+                roi_mask, p = zone_density(diff_thresh, zone.roi, zone.mask, zone.area, zone.scratch)
+                density_time += time.perf_counter() - started
+                found = [False] * len(templates)
+                if roi_mask is not None and p >= min_p_dop:
+                    # Остовы по возрастанию размера: если нет меньшего, нет и большего
+                    for k, template in enumerate(templates):
+                        started = time.perf_counter()
+                        found[k] = scan_for_template(roi_mask, template, zone.work)
+                        scan_time[k] += time.perf_counter() - started
+                        scan_count[k] += 1
+                        if not found[k]:
+                            break
+                frame_p.append(p)
+                frame_blocks.append(found)
+
+            times.append(frame_idx / info['fps'])
+            densities.append(frame_p)
+            blocks.append(frame_blocks)
+            frame_idx += 1
+    finally:
+        cap.release()
+
+    frames = max(len(times), 1)
+    return {
+        'file': path,
+        'use_filter': use_filter,
+        'duration': frame_idx / info['fps'],
+        'times': np.array(times, dtype=np.float64),
+        'p': np.array(densities, dtype=np.float32).reshape(len(times), len(zones)),
+        'blocks': np.array(blocks, dtype=bool).reshape(len(times), len(zones), len(ostov_sizes)),
+        'mask_ms': mask_time / frames * 1000,
+        'density_ms': density_time / frames * 1000,
+        # Средняя стоимость одного поиска остова каждого размера
+        'scan_ms': [float(t / c * 1000) if c else 0.0 for t, c in zip(scan_time, scan_count)],
+    }
+
+
+def expected_alarm(times, intervals):
+    expected = np.zeros(len(times), dtype=bool)
+    for start, end in intervals:
+        expected |= (times >= start) & (times <= end)
+    return expected
+
+
+def _runs(values):
+    """Кол-во непрерывных участков True"""
+    if not len(values):
+        return 0
+    return int(values[0]) + int(np.count_nonzero(values[1:] & ~values[:-1]))
+
+
+def score_clip(stats, intervals, p_dop, ostov_index):
+    """Покадровые и событийные показатели клипа для одной комбинации параметров"""
+    zone_alarm = (stats['p'] >= p_dop) & stats['blocks'][:, :, ostov_index]
+    alarm = zone_alarm.any(axis=1)
+    expected = expected_alarm(stats['times'], intervals)
+
+    hit = sum(bool(alarm[(stats['times'] >= start) & (stats['times'] <= end)].any())
+              for start, end in intervals)
+    # Сколько раз пришлось бы искать остов: кадры и зоны с плотностью от p_dop
+    scans = float(np.count_nonzero(stats['p'] >= p_dop)) / max(len(alarm), 1)
+    # Для размеров, до которых поиск не доходил, - стоимость ближайшего меньшего
+    scan_ms = next((ms for ms in reversed(stats['scan_ms'][:ostov_index + 1]) if ms), 0.0)
+    cost = stats['mask_ms'] + stats['density_ms'] + scans * scan_ms
+    return {
+        'tp': int(np.count_nonzero(alarm & expected)),
+        'fp': int(np.count_nonzero(alarm & ~expected)),
+        'fn': int(np.count_nonzero(~alarm & expected)),
+        'tn': int(np.count_nonzero(~alarm & ~expected)),
+        'events': len(intervals),
+        'events_hit': hit,
+        'false_alarms': _runs(alarm & ~expected),
+        'cost_ms': cost,
+    }
+
+
+def _ratio(a, b):
+    return round(a / b, 4) if b else None
+
+
+def summarize(params, clip_scores, duration):
+    tp = sum(s['tp'] for s in clip_scores)
+    fp = sum(s['fp'] for s in clip_scores)
+    fn = sum(s['fn'] for s in clip_scores)
+    precision = _ratio(tp, tp + fp)
+    recall = _ratio(tp, tp + fn)
+    f1 = _ratio(2 * precision * recall, precision + recall) if precision and recall else 0.0
+    events = sum(s['events'] for s in clip_scores)
+    false_alarms = sum(s['false_alarms'] for s in clip_scores)
+    return dict(params, **{
+        'precision': precision,
+        'recall': recall,
+        'f1': f1,
+        'event_recall': _ratio(sum(s['events_hit'] for s in clip_scores), events),
+        'false_alarms': false_alarms,
+        'false_alarms_per_hour': round(false_alarms / duration * 3600, 2) if duration else None,
+        'cost_ms_per_frame': round(float(np.mean([s['cost_ms'] for s in clip_scores])), 3),
+    })
+
+
+def run_sweep(clips, p_dop_values, ostov_sizes, filter_values, settings, workers=None,
+              sample_interval=None, scale=1.0):
+    """Перебор сетки (use_filter, p_dop, ostov_size) по размеченным клипам.
+
+    В пуле процессов обрабатывается каждая пара (клип, use_filter) - только
+    она требует повторного чтения видео; пороги оцениваются по сохраненной
+    статистике. Результаты отсортированы по F1, затем по стоимости кадра.
+
+    Как и в живом детекторе, маска - разность кадров с шагом sample_interval
+    (по умолчанию time_sleep из настроек; 0 - соседние кадры) в масштабе
+    анализа scale: от шага зависит плотность, а значит и подходящий p_dop.
+    """
+    if sample_interval is None:
+        sample_interval = settings["time_sleep"]
+    ostov_sizes = sorted(set(ostov_sizes))
+    p_dop_values = sorted(set(p_dop_values))
+    default_zones = normalize_zones(settings.get("zones")) or [FULL_FRAME_ZONE]
+    started = time.time()
+
+    stats = {}
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = {}
+        for i, clip in enumerate(clips):
+            for use_filter in filter_values:
+                future = pool.submit(clip_statistics, clip['file'], clip['zones'] or default_zones,
+                                     use_filter, ostov_sizes, p_dop_values[0], sample_interval, scale)
+                futures[future] = (i, use_filter)
+        for future in as_completed(futures):
+            i, use_filter = futures[future]
+            stats[i, use_filter] = future.result()
+            print(f"[ParamSweep] {clips[i]['file']} (use_filter={use_filter}): "
+                  f"{len(stats[i, use_filter]['times'])} кадров")
+
+    duration = sum(stats[i, filter_values[0]]['duration'] for i in range(len(clips)))
+    results = []
+    for use_filter, p_dop, (k, ostov_size) in itertools.product(filter_values, p_dop_values,
+                                                                 enumerate(ostov_sizes)):
+        scores = [score_clip(stats[i, use_filter], clip['alarm'], p_dop, k)
+                  for i, clip in enumerate(clips)]
+        results.append(summarize({'use_filter': use_filter, 'p_dop': p_dop, 'ostov_size': ostov_size},
+                                 scores, duration))
+    results.sort(key=lambda r: (-(r['f1'] or 0.0), r['cost_ms_per_frame']))
+    return {
+        'clips': [clip['file'] for clip in clips],
+        'grid': {'p_dop': p_dop_values, 'ostov_size': ostov_sizes, 'use_filter': list(filter_values)},
+        'sample_interval': sample_interval,
+        'scale': scale,
+        'total_time': round(time.time() - started, 3),
+        'results': results,
+    }
@@ -0,0 +1,356 @@
+import time
+import threading
+import cv2
+import numpy as np
+from utils.motion_algorithm import make_ostov_template, evaluate_roi, MotionBuffers
+from utils.tiles import TileMotion
+from utils.tracing import tracer
+
+
+class FrameContext:
+    """Кадр, передаваемый между этапами конвейера.
+
+    Буферы (кадр анализа, маска изменений) принадлежат этапам и
+    переиспользуются между кадрами - этапы не копируют их друг для друга.
+    """
+
+    __slots__ = ("frame", "analysis", "diff_thresh", "zones", "motion", "now", "index")
+
+    def __init__(self):
+        self.index = 0
+        self.clear(None, 0.0)
+
+    def clear(self, frame, now):
+        self.frame = frame          # Исходный кадр (BGR)
+        self.analysis = frame       # Кадр в разрешении анализа
+        self.diff_thresh = None     # Маска изменений (0/255)
+        self.zones = None           # CompiledZone под разрешение анализа
+        self.motion = False         # Движение недопустимо хотя бы в одной зоне
+        self.now = now
+
+
+class Stage:
+    """Этап конвейера: process(ctx) возвращает False, чтобы прервать обработку кадра"""
+
+    name = "stage"
+    category = "detector"
+
+    def configure(self, settings):
+        pass
+
+    def reset(self):
+        pass
+
+    def process(self, ctx):
+        return True
+
+
+class ResizeStage(Stage):
+    """Кадр в разрешении анализа (масштаб задает RateGovernor)"""
+
+    name = "resize"
+
+    def __init__(self, governor=None):
+        self.governor = governor
+
+    def process(self, ctx):
+        if self.governor is not None:
+            ctx.analysis = self.governor.resize(ctx.frame)
+        return True
+
+
+class MaskStage(Stage):
+    """Маска изменений относительно предыдущего кадра: весь кадр или только изменившиеся плитки"""
+
+    name = "mask"
+
+    def __init__(self, buffers, tiles):
+        self.buffers = buffers
+        self.tiles = tiles
+        self.use_filter = True
+        self.tile_mode = False
+
+    def configure(self, settings):
+        self.use_filter = settings["use_filter"]
+        self.tile_mode = settings["tile_mode"]
+        self.tiles.configure(settings["tile_size"], self.use_filter)
+
+    def reset(self):
+        self.buffers.reset()
+        self.tiles.reset()
+
+    def process(self, ctx):
+        if self.tile_mode:
+            # Разница только в плитках, изменившихся на грубом кадре
+            ctx.diff_thresh = self.tiles.update(self.buffers.gray(ctx.analysis))
+        else:
+            # Текущий и предыдущий кадры - пара буферов, меняющихся ролями
+            ctx.diff_thresh = self.buffers.motion_mask(ctx.analysis, self.use_filter)
+        return ctx.diff_thresh is not None
+
+
+class ZoneStage(Stage):
+    """Оценка зон по маске: остов, связные области или счетчики плиток -> DetectionBuffer"""
+
+    name = "zones"
+
+    def __init__(self, zones, detections, tiles):
+        self.zones = zones
+        self.detections = detections
+        self.tiles = tiles
+
+    def configure(self, settings):
+        self.p_dop = settings["p_dop"]
+        self.ostov_template = make_ostov_template(settings["ostov_size"])
+        self.blob_detection = settings["blob_detection"]
+        self.blob_min_area = settings["blob_min_area"]
+        self.tile_mode = settings["tile_mode"]
+
+    def reset(self):
+        self.detections.reset()
+
+    def process(self, ctx):
+        detections = self.detections
+        ctx.zones = zones = self.zones.prepare(ctx.diff_thresh.shape)
+        detections.begin(zones)
+        if self.blob_detection:
+            # Один проход connectedComponentsWithStats по кадру для всех зон
+            time_start = time.time()
+            results = self.zones.evaluate_blobs(ctx.diff_thresh, self.p_dop, self.blob_min_area)
+            elapsed = (time.time() - time_start) / max(len(results), 1)
+            for i, (zone, found, p, blobs) in enumerate(results):
+                detections.set(i, found, p, elapsed, blobs)
+        elif self.tile_mode:
+            # Плотность зон собирается из счетчиков плиток
+            time_start = time.time()
+            results = self.tiles.evaluate(zones, self.p_dop, self.ostov_template)
+            elapsed = (time.time() - time_start) / max(len(results), 1)
+            for i, (zone, found, p) in enumerate(results):
+                detections.set(i, found, p, elapsed)
+        else:
+            for i, zone in enumerate(zones):
+                time_start = time.time()
+                # Плотность изменений внутри маски зоны и поиск остова
+                found, p = evaluate_roi(ctx.diff_thresh, zone.roi, self.p_dop, self.ostov_template,
+                                        zone.mask, zone.area, zone.scratch, zone.work)
+                detections.set(i, found, p, time.time() - time_start)
+        ctx.motion = detections.any_detected()
+        return True
+
+
+class DisplaySink(Stage):
+    """Кадр и маска для отображения - в DisplayMailbox"""
+
+    name = "display"
+
+    def __init__(self, mailbox):
+        self.mailbox = mailbox
+
+    def process(self, ctx):
+        self.mailbox.publish(ctx.analysis, ctx.diff_thresh)
+        return True
+
+
+class DeltaSink(Stage):
+    """Изменившиеся зоны (DetectionDelta) - всем получателям callbacks"""
+
+    name = "emit"
+
+    def __init__(self, detections, *callbacks):
+        self.detections = detections
+        self.callbacks = list(callbacks)
+
+    def process(self, ctx):
+        delta = self.detections.commit()
+        if delta is not None:
+            for callback in self.callbacks:
+                callback(delta)
+        return True
+
+
+class HistorySink(Stage):
+    """Плотность и тревоги зон кадра - в ActivityHistory"""
+
+    name = "history"
+
+    def __init__(self, detections, history):
+        self.detections = detections
+        self.history = history
+
+    def process(self, ctx):
+        records = self.detections.records
+        self.history.add(ctx.now, records['activity'], records['detected'])
+        return True
+
+
+class AlarmSink(Stage):
+    """Тревога по движению (уведомление, запись) не чаще раза в cooldown секунд: callback(ctx)"""
+
+    name = "notify"
+    category = "notify"
+
+    def __init__(self, callback, cooldown=5.0):
+        self.callback = callback
+        self.cooldown = cooldown
+        self.last_alarm = 0.0
+
+    def process(self, ctx):
+        if ctx.motion and ctx.now - self.last_alarm > self.cooldown:
+            self.last_alarm = ctx.now
+            self.callback(ctx)
+        return True
+
+
+class CallbackSink(Stage):
+    """Произвольный получатель кадра: callback(ctx)"""
+
+    def __init__(self, name, callback, category="detector"):
+        self.name = name
+        self.category = category
+        self.callback = callback
+
+    def process(self, ctx):
+        self.callback(ctx)
+        return True
+
+
+class MotionPipeline:
+    """Конвейер анализа кадра из этапов: resize -> mask -> zones -> получатели.
+
+    Этапы выполняются по порядку над общим FrameContext; этап, вернувший
+    False (например, первый кадр без предыдущего), прерывает кадр. Время
+    каждого этапа накапливается (stats()) и попадает в трассировку как
+    участок «<name>.<этап>». RateGovernor, если задан, учитывает стоимость
+    кадра и движение.
+    """
+
+    def __init__(self, name, stages, governor=None):
+        self.name = name
+        self.stages = list(stages)
+        self.governor = governor
+        self.ctx = FrameContext()
+        self._spans = [f"{name}.{stage.name}" for stage in self.stages]
+        self.timings = {stage.name: [0.0, 0] for stage in self.stages}     # Этап -> [сек, кадров]
+
+    def configure(self, settings):
+        for stage in self.stages:
+            stage.configure(settings)
+
+    def reset(self):
+        """Новый запуск: следующий кадр станет первым"""
+        for stage in self.stages:
+            stage.reset()
+
+    def process(self, frame, now=None):
+        """Анализ кадра; FrameContext или None, если кадр прерван (нет маски)"""
+        ctx = self.ctx
+        ctx.clear(frame, time.time() if now is None else now)
+        ctx.index += 1
+        if self.governor is not None:
+            self.governor.begin()
+        completed = True
+        timings = self.timings
+        for stage, span in zip(self.stages, self._spans):
+            started = time.perf_counter()
+            with tracer.span(span, stage.category):
+                result = stage.process(ctx)
+            timing = timings[stage.name]
+            timing[0] += time.perf_counter() - started
+            timing[1] += 1
+            if result is False:
+                completed = False
+                break
+        if self.governor is not None:
+            self.governor.end(motion=ctx.motion)
+        return ctx if completed else None
+
+    def stats(self):
+        """Среднее время этапов (мс на кадр, дошедший до этапа)"""
+        return {name: round(total / count * 1000, 3) if count else None
+                for name, (total, count) in self.timings.items()}
+
+
+class PendingSettings:
+    """Настройки для потока анализа: put() - из любого потока, take() - между кадрами.
+
+    Этапы конвейера (плитки, буферы), регулятор и клиенты не меняются
+    посреди кадра: поток анализа забирает последние настройки сам.
+    """
+
+    def __init__(self):
+        self._settings = None
+        self._lock = threading.Lock()
+
+    def put(self, settings):
+        with self._lock:
+            self._settings = dict(settings)
+
+    def take(self):
+        """Последние неприменённые настройки или None"""
+        if self._settings is None:
+            return None
+        with self._lock:
+            settings, self._settings = self._settings, None
+        return settings
+
+
+class DisplayMailbox:
+    """Последний кадр для отображения: publish() - поток анализа, take()/release() - поток интерфейса.
+
+    RGB-кадр и маска пишутся в один из SLOTS предвыделенных слотов. Слот,
+    ожидающий отрисовки, и слот, который рисует интерфейс (от take() до
+    release()), не перезаписываются; неотрисованный кадр заменяется новым.
+    notify() вызывается, только если интерфейс забрал предыдущее уведомление,
+    поэтому очередь сигналов Qt не растет, когда интерфейс отстает.
+    """
+
+    SLOTS = 3                       # Пишется, ожидает отрисовки, рисуется
+
+    def __init__(self, notify):
+        self.notify = notify
+        self._lock = threading.Lock()
+        self._shape = None
+        self._slots = []
+        self._pending = None        # Слот с неотрисованным кадром
+        self._held = None           # Слот, который рисует интерфейс
+        self._notified = False
+
+    def publish(self, frame, mask):
+        with self._lock:
+            if frame.shape[:2] != self._shape:
+                # Слоты прежнего размера, выданные интерфейсу, остаются за ним
+                height, width = self._shape = frame.shape[:2]
+                self._slots = [(np.empty((height, width, 3), np.uint8), np.empty((height, width, 3), np.uint8))
+                               for _ in range(self.SLOTS)]
+                self._pending = self._held = None
+            slot = next(i for i in range(self.SLOTS) if i != self._pending and i != self._held)
+        rgb, bin_rgb = self._slots[slot]
+        cv2.cvtColor(frame, cv2.COLOR_BGR2RGB, dst=rgb)
+        cv2.cvtColor(mask, cv2.COLOR_GRAY2RGB, dst=bin_rgb)
+        with self._lock:
+            self._pending = slot
+            notify = not self._notified
+            self._notified = True
+        if notify:
+            self.notify()
+
+    def take(self):
+        """(RGB-кадр, RGB-маска) последнего кадра или None; до release() слот не перезаписывается"""
+        with self._lock:
+            self._notified = False
+            if self._pending is None:
+                return None
+            self._held, self._pending = self._pending, None
+            return self._slots[self._held]
+
+    def release(self):
+        """Кадр, выданный take(), отрисован"""
+        with self._lock:
+            self._held = None
+
+
+def motion_stages(zones, detections, governor=None, buffers=None, tiles=None):
+    """Общие этапы классического алгоритма (буферы MotionBuffers/TileMotion - общие с получателями)"""
+    buffers = buffers if buffers is not None else MotionBuffers()
+    tiles = tiles if tiles is not None else TileMotion()
+    return [ResizeStage(governor), MaskStage(buffers, tiles), ZoneStage(zones, detections, tiles)]
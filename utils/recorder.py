@@ -0,0 +1,384 @@
+import os
+import time
+import threading
+import itertools
+import collections
+import cv2
+import numpy as np
+from utils.video_source import is_live_url
+from utils.clip_index import ClipAnnotator
+
+
+def write_log_entry(message):
+    with open("log.txt", "a", encoding="utf-8") as log:
+        log.write(message + "\n")
+
+
+class FrameRing:
+    """Кольцевой буфер кадров предзаписи в одном предвыделенном массиве.
+
+    Кадры копируются в слоты массива (np.copyto), поэтому в установившемся
+    режиме буфер не выделяет память; массив пересоздается при смене размера кадра.
+    Рядом хранится время поступления каждого кадра.
+    """
+
+    def __init__(self, size):
+        self.size = size
+        self.frames = None
+        self.times = np.zeros(size, np.float64)
+        self.start = 0
+        self.count = 0
+
+    def append(self, frame, timestamp=0.0):
+        if self.frames is None or self.frames.shape[1:] != frame.shape:
+            self.frames = np.empty((self.size,) + frame.shape, dtype=frame.dtype)
+            self.clear()
+        slot = (self.start + self.count) % self.size
+        np.copyto(self.frames[slot], frame)
+        self.times[slot] = timestamp
+        if self.count < self.size:
+            self.count += 1
+        else:
+            self.start = (self.start + 1) % self.size
+
+    def clear(self):
+        self.start = 0
+        self.count = 0
+
+    def latest(self):
+        return self.frames[(self.start + self.count - 1) % self.size] if self.count else None
+
+    def __iter__(self):
+        for i in range(self.count):
+            yield self.frames[(self.start + i) % self.size]
+
+    def items(self):
+        """(время поступления, кадр) от старых к новым"""
+        for i in range(self.count):
+            slot = (self.start + i) % self.size
+            yield self.times[slot], self.frames[slot]
+
+    def __len__(self):
+        return self.count
+
+
+class ClipRecorder:
+    """Запись клипов с перекодированием кадров (cv2.VideoWriter, mp4v).
+
+    Кадры подаются через push(): до срабатывания они копятся в буфере
+    предзаписи, после trigger() пишутся в файл RECORDING_TIME секунд.
+    Смещение кадра в файле - номер кадра / fps: по нему отметки детектора
+    (annotate) переводятся во время клипа для индекса.
+    """
+
+    uses_frames = True
+
+    def __init__(self, video_dir, recording_time, log_tag="Recorder", buffer_size=150, fps=20.0,
+                 annotator=None):
+        self.video_dir = video_dir
+        self.recording_time = recording_time
+        self.log_tag = log_tag
+        self.fps = fps
+        self.frame_buffer = FrameRing(buffer_size)  # ~5 сек при 30 FPS
+        self.annotator = annotator or ClipAnnotator()
+        self.video_writer = None
+        self.video_path = None
+        self.recording_start = 0
+        self.log_message = None
+        self._index = None
+        self._written = 0
+
+    @property
+    def recording(self):
+        return self.video_writer is not None
+
+    def start(self):
+        pass
+
+    def push(self, frame):
+        now = time.time()
+        if self.video_writer is None:
+            self.frame_buffer.append(frame, now)
+            return
+        self._write(frame, now)
+        if now - self.recording_start > self.recording_time:
+            self._finish()
+
+    def annotate(self, wall, activity=None, detected=None, labels=None, frame=None):
+        """Отметка детектора для индекса клипа (плотности зон, тревоги, объекты, кадр-миниатюра)"""
+        self.annotator.annotate(wall, activity, detected, labels, frame)
+
+    def trigger(self, label, description):
+        """Начало записи клипа; False, если запись уже идет"""
+        if self.recording or not self.frame_buffer:
+            return False
+        self.recording_start = time.time()
+        height, width = self.frame_buffer.latest().shape[:2]
+        fourcc = cv2.VideoWriter_fourcc(*'mp4v')
+        timestamp = time.strftime("%Y-%m-%d_%H-%M-%S")
+        filename = f"{timestamp}_{label}.mp4"
+        self.video_path = os.path.join(self.video_dir, filename)
+        self.log_message = f"{timestamp} — {description} — {filename}"
+        self.video_writer = cv2.VideoWriter(self.video_path, fourcc, self.fps, (width, height))
+        self._index = self.annotator.open(self.video_path, label)
+        self._written = 0
+        for timestamp, f in self.frame_buffer.items():
+            self._write(f, timestamp)
+        self.frame_buffer.clear()
+        print(f"[{self.log_tag}] Начата запись: {self.video_path}")
+        return True
+
+    def close(self):
+        if self.video_writer is not None:
+            self._finish()
+
+    def _write(self, frame, timestamp):
+        self.video_writer.write(frame)
+        if self._index is not None:
+            self._index.sync(timestamp, self._written / self.fps)
+        self._written += 1
+
+    def _finish(self):
+        self.video_writer.release()
+        self.video_writer = None
+        self._index = None
+        self.annotator.close(self._written / self.fps, self.log_tag)
+        write_log_entry(self.log_message)
+        print(f"[{self.log_tag}] Завершена запись: {self.video_path}")
+
+
+class RemuxRecorder:
+    """Запись клипов перепаковкой сжатого потока камеры без декодирования и кодирования.
+
+    Фоновый поток читает пакеты основного потока через PyAV и держит кольцевой
+    буфер сжатых пакетов за последние preroll секунд (целыми GOP). По trigger()
+    клип пишется начиная с последнего ключевого кадра перед событием.
+    Смещения ключевых кадров и время пакетов попадают в индекс клипа.
+    """
+
+    uses_frames = False
+
+    RECONNECT_MIN_DELAY = 0.5
+
+    def __init__(self, url, video_dir, recording_time, log_tag="Recorder", preroll=5.0,
+                 transport="tcp", reconnect_max_delay=30.0, annotator=None):
+        self.url = url
+        self.video_dir = video_dir
+        self.recording_time = recording_time
+        self.log_tag = log_tag
+        self.preroll = preroll
+        self.options = {"rtsp_transport": transport} if transport else {}
+        self.reconnect_max_delay = reconnect_max_delay
+        self.annotator = annotator or ClipAnnotator(preroll)
+
+        self.thread = None
+        self._stop_event = threading.Event()
+        self._lock = threading.Lock()
+        self._ring = collections.deque()    # (packet, pts, dts, keyframe, время пакета)
+        self._keyframes = collections.deque()   # (номер пакета, время) ключевых кадров буфера
+        self._ring_start = 0                # Номер первого пакета буфера (сквозной счет)
+        self._packets = 0                   # Пакетов добавлено в буфер (сквозной счет)
+        self._pending = None                # (label, description) ожидающего срабатывания
+        self._output = None
+        self._output_stream = None
+        self._base_ts = 0
+        self._base_time = 0.0
+        self._last_time = 0.0
+        self._wall_offset = 0.0             # Время детектора - время потока
+        self._index = None
+        self._clip_start = 0.0
+        self.video_path = None
+        self.log_message = None
+
+    @property
+    def recording(self):
+        return self._output is not None or self._pending is not None
+
+    def start(self):
+        self._stop_event.clear()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def push(self, frame):
+        pass
+
+    def annotate(self, wall, activity=None, detected=None, labels=None, frame=None):
+        """Отметка детектора для индекса клипа (плотности зон, тревоги, объекты, кадр-миниатюра)"""
+        self.annotator.annotate(wall, activity, detected, labels, frame)
+
+    def trigger(self, label, description):
+        with self._lock:
+            if self.recording:
+                return False
+            self._pending = (label, description)
+        return True
+
+    def close(self):
+        self._stop_event.set()
+        if self.thread:
+            self.thread.join()
+
+    def _run(self):
+        import av
+        delay = self.RECONNECT_MIN_DELAY
+        while not self._stop_event.is_set():
+            try:
+                container = av.open(self.url, options=self.options, timeout=5.0)
+            except Exception as e:
+                print(f"[{self.log_tag}] Не удалось открыть поток для записи: {e}")
+                if self._stop_event.wait(delay):
+                    break
+                delay = min(delay * 2, self.reconnect_max_delay)
+                continue
+
+            delay = self.RECONNECT_MIN_DELAY
+            try:
+                stream = container.streams.video[0]
+                for packet in container.demux(stream):
+                    if self._stop_event.is_set():
+                        break
+                    if packet.dts is None:
+                        continue
+                    self._on_packet(packet, stream)
+            except Exception as e:
+                print(f"[{self.log_tag}] Обрыв потока записи: {e}")
+            finally:
+                self._close_output()
+                self._clear_ring()
+                container.close()
+
+            if not is_live_url(self.url):
+                break
+
+    def _on_packet(self, packet, stream):
+        ts = packet.pts if packet.pts is not None else packet.dts
+        packet_time = float(ts * packet.time_base)
+        self._wall_offset = time.time() - packet_time
+        # Буфер и файл клипа меняет только этот поток; блокировка - только для
+        # состояния, которое проверяет trigger(): запись на диск идет без нее
+        self._ring.append((packet, packet.pts, packet.dts, packet.is_keyframe, packet_time))
+        if packet.is_keyframe:
+            self._keyframes.append((self._packets, packet_time))
+        self._packets += 1
+        self._trim_ring(packet_time)
+
+        with self._lock:
+            opening = self._pending is not None and self._output is None
+        if opening:
+            self._open_output(stream, packet_time)
+        elif self._output is not None:
+            self._mux(packet, packet.pts, packet.dts, packet.is_keyframe, packet_time)
+            if time.time() - self._clip_start > self.recording_time:
+                self._close_output()
+
+    def _trim_ring(self, newest_time):
+        """Удаление старых GOP: буфер начинается с последнего ключевого кадра не позже начала предзаписи"""
+        keyframes = self._keyframes
+        while len(keyframes) > 1 and keyframes[1][1] <= newest_time - self.preroll:
+            keyframes.popleft()
+        if keyframes:
+            # Каждый пакет удаляется один раз - в среднем O(1) на пакет
+            for _ in range(keyframes[0][0] - self._ring_start):
+                self._ring.popleft()
+            self._ring_start = keyframes[0][0]
+
+    def _clear_ring(self):
+        self._ring.clear()
+        self._keyframes.clear()
+        self._ring_start = self._packets
+
+    def _open_output(self, stream, event_time):
+        import av
+        # Пока _pending задан, trigger() не принимает новых событий - он не меняется
+        label, description = self._pending
+
+        # Последний ключевой кадр не позже начала предзаписи
+        if not self._keyframes:
+            # Ключевого кадра еще не было - ждем его
+            return
+        start = self._keyframes[0][0]
+        for number, keyframe_time in self._keyframes:
+            if keyframe_time <= event_time - self.preroll:
+                start = number
+        start -= self._ring_start
+
+        timestamp = time.strftime("%Y-%m-%d_%H-%M-%S")
+        filename = f"{timestamp}_{label}.mp4"
+        self.video_path = os.path.join(self.video_dir, filename)
+        self.log_message = f"{timestamp} — {description} — {filename}"
+        self._output = av.open(self.video_path, "w")
+        self._output_stream = self._output.add_stream_from_template(stream)
+        first = self._ring[start]
+        self._base_ts = first[2] if first[2] is not None else first[1]
+        self._base_time = first[4]
+        self._index = self.annotator.open(self.video_path, label)
+        self._clip_start = time.time()
+        print(f"[{self.log_tag}] Начата запись (без перекодирования): {self.video_path}")
+
+        for packet, pts, dts, keyframe, packet_time in itertools.islice(self._ring, start, None):
+            self._mux(packet, pts, dts, keyframe, packet_time)
+        with self._lock:
+            self._pending = None
+
+    def _mux(self, packet, pts, dts, keyframe, packet_time):
+        self._last_time = packet_time
+        if self._index is not None:
+            offset = packet_time - self._base_time
+            self._index.sync(packet_time + self._wall_offset, offset)
+            if keyframe:
+                self._index.keyframe(offset)
+        # Пакеты буфера могут попасть в несколько клипов - метки берутся из исходных значений
+        packet.pts = pts - self._base_ts if pts is not None else None
+        packet.dts = dts - self._base_ts if dts is not None else None
+        packet.stream = self._output_stream
+        self._output.mux(packet)
+
+    def _close_output(self):
+        if self._output is None:
+            return
+        self._output.close()
+        self._output_stream = None
+        self._index = None
+        self.annotator.close(max(self._last_time - self._base_time, 0.0), self.log_tag)
+        write_log_entry(self.log_message)
+        with self._lock:
+            # Клип на диске - trigger() снова принимает события
+            self._output = None
+        print(f"[{self.log_tag}] Завершена запись: {self.video_path}")
+
+
+def create_recorder(settings, source, video_dir, recording_time, log_tag):
+    """Перепаковка потока для сетевых источников при recording_mode auto/remux, иначе перекодирование.
+
+    При dvr сетевой поток пишется непрерывно в кольцо сегментов, клипы событий вырезаются из него.
+    """
+    mode = settings.get("recording_mode", "auto")
+    preroll = settings.get("recording_preroll", 5.0)
+    annotator = ClipAnnotator(preroll, settings.get("clip_index", True))
+    live = isinstance(source, str) and is_live_url(source)
+    if settings.get("dvr") and not live:
+        print(f"[{log_tag}] Непрерывная запись (dvr) - только для сетевых потоков")
+    if (mode != "reencode" or settings.get("dvr")) and live:
+        try:
+            import av  # noqa: F401
+        except ImportError:
+            if mode == "remux" or settings.get("dvr"):
+                print(f"[{log_tag}] PyAV не установлен, запись с перекодированием")
+        else:
+            if settings.get("dvr"):
+                from utils.dvr import DvrRecorder
+                return DvrRecorder(source, video_dir, recording_time, log_tag,
+                                   preroll=preroll,
+                                   transport=settings.get("rtsp_transport", "tcp"),
+                                   reconnect_max_delay=settings.get("reconnect_max_delay", 30.0),
+                                   annotator=annotator,
+                                   dvr_dir=settings.get("dvr_dir", "dvr"),
+                                   budget_mb=settings.get("dvr_budget_mb", 4096),
+                                   segment_seconds=settings.get("dvr_segment_seconds", 10.0),
+                                   segment_mb=settings.get("dvr_segment_mb", 16))
+            return RemuxRecorder(source, video_dir, recording_time, log_tag,
+                                 preroll=preroll,
+                                 transport=settings.get("rtsp_transport", "tcp"),
+                                 reconnect_max_delay=settings.get("reconnect_max_delay", 30.0),
+                                 annotator=annotator)
+    return ClipRecorder(video_dir, recording_time, log_tag, annotator=annotator)
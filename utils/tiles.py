@@ -0,0 +1,185 @@
+import cv2
+import numpy as np
+from utils.motion_algorithm import (BLUR_KERNEL, DIFF_THRESHOLD, compute_motion_mask,
+                                    zone_density, scan_for_template)
+
+
+COARSE_SCALE = 8                        # Грубый кадр в 8 раз меньше по каждой стороне
+COARSE_THRESHOLD = DIFF_THRESHOLD // 4  # Порог изменения усредненного пикселя грубого кадра
+# Поле вокруг плитки: радиус размытия 21x21 (10) + открытие 5x5 (эрозия и дилатация по 2)
+HALO = BLUR_KERNEL[0] // 2 + 4
+
+
+class ZoneTiles:
+    """Покрытие зоны плитками: полностью внутри зоны и частично (с маской пересечения)"""
+
+    __slots__ = ("full", "partial")
+
+    def __init__(self, full, partial):
+        self.full = full            # Плоские индексы плиток целиком внутри зоны
+        self.partial = partial      # [(строка, столбец, срез y, срез x, маска зоны или None)]
+
+
+class TileMotion:
+    """Поиск изменений только в изменившихся плитках кадра.
+
+    Грубая разница уменьшенных кадров отмечает «грязные» плитки; размытие,
+    разность, порог и открытие в полном разрешении считаются только для них
+    (с полем HALO, поэтому внутри плитки результат совпадает с обработкой
+    всего кадра). Маска изменений и число изменившихся пикселей по плиткам
+    хранятся между кадрами, плотность зоны собирается из счетчиков плиток.
+
+    Изменения, не заметные на грубом кадре (мелкие объекты без размытия),
+    в этом режиме пропускаются.
+    """
+
+    def __init__(self, tile_size=64, use_filter=True):
+        self.tile_size = 0
+        self.use_filter = None
+        self.configure(tile_size, use_filter)
+
+    def configure(self, tile_size, use_filter):
+        tile_size = max(COARSE_SCALE, int(tile_size) // COARSE_SCALE * COARSE_SCALE)
+        if (tile_size, use_filter) != (self.tile_size, self.use_filter):
+            self.tile_size = tile_size
+            self.use_filter = use_filter
+            self.reset()
+
+    def reset(self):
+        self._shape = None
+        self._zones = None
+        self._plans = []
+        self.prev = None
+        self.prev_coarse = None
+        self.mask = None
+        self.dirty = None
+        self.counts = None
+
+    def update(self, gray):
+        """Маска изменений (0/255) по кадру в оттенках серого или None для первого кадра"""
+        if gray.shape != self._shape:
+            self._allocate(gray.shape)
+            self.prev = gray
+            self.prev_coarse = cv2.resize(gray, self._coarse_size, interpolation=cv2.INTER_AREA)
+            return None
+
+        coarse = cv2.resize(gray, self._coarse_size, interpolation=cv2.INTER_AREA)
+        changed = self._changed
+        changed[:coarse.shape[0], :coarse.shape[1]] = cv2.absdiff(coarse, self.prev_coarse) > COARSE_THRESHOLD
+        if self.use_filter:
+            # Размытие разносит изменение на HALO пикселей в соседние плитки
+            changed = cv2.dilate(changed, self._halo_kernel)
+        cells = self.tile_size // COARSE_SCALE
+        rows, cols = self.dirty.shape
+        dirty = changed.reshape(rows, cells, cols, cells).max(axis=(1, 3)) > 0
+
+        for row, col in np.argwhere(self.dirty & ~dirty):
+            self.mask[self._tile_slices(row, col)] = 0
+            self.counts[row, col] = 0
+        for row in np.flatnonzero(dirty.any(axis=1)):
+            # Соседние грязные плитки строки обрабатываются одним участком:
+            # на мелких участках фиксированные затраты размытия 21x21 велики
+            cols_dirty = np.flatnonzero(dirty[row])
+            breaks = np.flatnonzero(np.diff(cols_dirty) > 1) + 1
+            for run in np.split(cols_dirty, breaks):
+                self._process_run(gray, row, run[0], run[-1] + 1)
+
+        self.dirty = dirty
+        self.prev = gray
+        self.prev_coarse = coarse
+        return self.mask
+
+    def evaluate(self, zones, p_dop, ostov_template):
+        """Список (CompiledZone, движение недопустимо, плотность) по счетчикам плиток"""
+        if zones is not self._zones:
+            self._zones = zones
+            self._plans = [self._plan_zone(zone) for zone in zones]
+        results = []
+        for zone, plan in zip(zones, self._plans):
+            count = int(self.counts.flat[plan.full].sum()) if len(plan.full) else 0
+            for row, col, ys, xs, zone_mask in plan.partial:
+                if self.dirty[row, col]:
+                    tile = self.mask[ys, xs]
+                    if zone_mask is not None:
+                        tile = cv2.bitwise_and(tile, zone_mask)
+                    count += cv2.countNonZero(tile)
+            p = count / zone.area if zone.area else 0.0
+            if p < p_dop:
+                results.append((zone, False, p))
+                continue
+            roi_mask, _ = zone_density(self.mask, zone.roi, zone.mask, zone.area, zone.scratch)
+            found = scan_for_template(roi_mask, ostov_template, zone.work)
+            results.append((zone, found, p))
+        return results
+
+    def dirty_fraction(self):
+        return float(self.dirty.mean()) if self.dirty is not None else 0.0
+
+    def _allocate(self, shape):
+        height, width = shape[:2]
+        rows = -(-height // self.tile_size)
+        cols = -(-width // self.tile_size)
+        cells = self.tile_size // COARSE_SCALE
+        self._shape = shape
+        self._zones = None
+        self._coarse_size = (max(width // COARSE_SCALE, 1), max(height // COARSE_SCALE, 1))
+        self._changed = np.zeros((rows * cells, cols * cells), dtype=np.uint8)
+        self._halo_kernel = np.ones((2 * (-(-HALO // COARSE_SCALE)) + 1,) * 2, np.uint8)
+        self.mask = np.zeros((height, width), dtype=np.uint8)
+        self.dirty = np.zeros((rows, cols), dtype=bool)
+        self.counts = np.zeros((rows, cols), dtype=np.int64)
+
+    def _tile_slices(self, row, col):
+        size = self.tile_size
+        return slice(row * size, (row + 1) * size), slice(col * size, (col + 1) * size)
+
+    def _process_run(self, gray, row, col_start, col_stop):
+        """Маска изменений для плиток строки row со столбцами [col_start, col_stop)"""
+        size = self.tile_size
+        ys = slice(row * size, (row + 1) * size)
+        xs = slice(col_start * size, col_stop * size)
+        if not self.use_filter:
+            region = compute_motion_mask(gray[ys, xs], self.prev[ys, xs], False)
+        else:
+            height, width = gray.shape[:2]
+            y0, x0 = max(ys.start - HALO, 0), max(xs.start - HALO, 0)
+            y1, x1 = min(ys.stop + HALO, height), min(xs.stop + HALO, width)
+            current = cv2.GaussianBlur(gray[y0:y1, x0:x1], BLUR_KERNEL, 0)
+            previous = cv2.GaussianBlur(self.prev[y0:y1, x0:x1], BLUR_KERNEL, 0)
+            region = compute_motion_mask(current, previous, True)
+            top, left = ys.start - y0, xs.start - x0
+            region = region[top:top + size, left:left + (col_stop - col_start) * size]
+        self.mask[ys, xs] = region
+        for col in range(col_start, col_stop):
+            offset = (col - col_start) * size
+            self.counts[row, col] = cv2.countNonZero(region[:, offset:offset + size])
+
+    def _plan_zone(self, zone):
+        """Разбиение зоны по плиткам (пересчитывается при смене зон или разрешения)"""
+        x, y, w, h = zone.roi
+        rows, cols = self.dirty.shape
+        size = self.tile_size
+        full, partial = [], []
+        for row in range(y // size, min(-(-(y + h) // size), rows)):
+            for col in range(x // size, min(-(-(x + w) // size), cols)):
+                ys, xs = self._tile_slices(row, col)
+                ty0, tx0 = max(ys.start, y), max(xs.start, x)
+                ty1 = min(ys.stop, y + h, self._shape[0])
+                tx1 = min(xs.stop, x + w, self._shape[1])
+                if ty1 <= ty0 or tx1 <= tx0:
+                    continue
+                zone_mask = None
+                if zone.mask is not None:
+                    zone_mask = zone.mask[ty0 - y:ty1 - y, tx0 - x:tx1 - x]
+                    covered = cv2.countNonZero(zone_mask)
+                    if covered == 0:
+                        continue
+                    if covered == zone_mask.size:
+                        zone_mask = None
+                tile_h = min(ys.stop, self._shape[0]) - ys.start
+                tile_w = min(xs.stop, self._shape[1]) - xs.start
+                if zone_mask is None and (ty1 - ty0, tx1 - tx0) == (tile_h, tile_w):
+                    full.append(row * cols + col)
+                else:
+                    partial.append((row, col, slice(ty0, ty1), slice(tx0, tx1), zone_mask))
+        return ZoneTiles(np.array(full, dtype=np.intp), partial)
@@ -0,0 +1,222 @@
+import os
+import sys
+import json
+import time
+import atexit
+import itertools
+import threading
+from collections import Counter, deque
+
+
+TRACE_ENV = "MOTION_TRACE"                  # Путь файла трассировки (включает трассировку)
+TRACE_SAMPLE_ENV = "MOTION_TRACE_SAMPLE"    # Период выборки стеков потоков (сек)
+
+
+class _NullSpan:
+    """Участок-заглушка при выключенной трассировке"""
+
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NULL_SPAN = _NullSpan()
+
+
+class _Span:
+    __slots__ = ("tracer", "name", "cat", "args", "started")
+
+    def __init__(self, tracer, name, cat, args):
+        self.tracer = tracer
+        self.name = name
+        self.cat = cat
+        self.args = args
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        now = time.perf_counter()
+        self.tracer._record("X", self.name, self.cat, self.started, now - self.started, self.args)
+        return False
+
+
+class _AsyncSpan:
+    """Участок корутины: на одном потоке цикла событий такие участки пересекаются"""
+
+    __slots__ = ("tracer", "name", "cat", "args", "id")
+
+    def __init__(self, tracer, name, cat, args):
+        self.tracer = tracer
+        self.name = name
+        self.cat = cat
+        self.args = args
+        self.id = next(tracer._ids)
+
+    def __enter__(self):
+        self.tracer._record("b", self.name, self.cat, time.perf_counter(), None, self.args, self.id)
+        return self
+
+    def __exit__(self, *exc):
+        self.tracer._record("e", self.name, self.cat, time.perf_counter(), None, None, self.id)
+        return False
+
+
+class StackSampler:
+    """Выборочный профилировщик: периодически снимает стеки всех потоков процесса.
+
+    Результат - счетчики свернутых стеков («поток;функция;...» и число
+    попаданий), формат flamegraph.pl / speedscope.
+    """
+
+    def __init__(self, interval, thread_names=None):
+        self.interval = interval
+        # Имена потоков, заданные трассировщиком (словарь обновляется на ходу)
+        self.thread_names = thread_names if thread_names is not None else {}
+        self.stacks = Counter()
+        self.samples = 0
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="StackSampler", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop_event.set()
+        if self._thread:
+            self._thread.join()
+
+    def save(self, path):
+        with open(path, "w", encoding="utf-8") as f:
+            for stack, count in self.stacks.most_common():
+                f.write(f"{stack} {count}\n")
+
+    def _run(self):
+        own = threading.get_ident()
+        while not self._stop_event.wait(self.interval):
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            names.update(self.thread_names)
+            for ident, frame in sys._current_frames().items():
+                if ident == own:
+                    continue
+                calls = []
+                while frame is not None:
+                    code = frame.f_code
+                    calls.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                    frame = frame.f_back
+                calls.append(names.get(ident, str(ident)))
+                self.stacks[";".join(reversed(calls))] += 1
+            self.samples += 1
+
+
+class Tracer:
+    """Трассировка этапов обработки кадров в формате Chrome Trace Event.
+
+    Включается переменной окружения MOTION_TRACE (путь файла) или настройкой
+    trace_path; файл открывается в chrome://tracing или ui.perfetto.dev.
+    При выключенной трассировке span() возвращает общую заглушку - в рабочих
+    циклах остается один вызов и проверка флага. События копятся в памяти
+    (не более MAX_EVENTS последних) и записываются при остановке процесса.
+    """
+
+    MAX_EVENTS = 1000000
+
+    def __init__(self):
+        self.enabled = False
+        self.path = None
+        self.sampler = None
+        self._events = deque(maxlen=self.MAX_EVENTS)
+        self._threads = {}              # Идентификатор потока -> имя в трассировке
+        self._ids = itertools.count(1)
+        self._origin = time.perf_counter()
+        self._lock = threading.Lock()
+
+    def configure(self, settings):
+        """Включение по настройкам; переменные окружения имеют приоритет"""
+        path = os.environ.get(TRACE_ENV) or settings.get("trace_path", "")
+        interval = float(os.environ.get(TRACE_SAMPLE_ENV) or settings.get("trace_sample_interval", 0.0))
+        if not path or self.enabled:
+            return
+        self.path = path
+        self._origin = time.perf_counter()
+        self.enabled = True
+        if interval > 0:
+            self.sampler = StackSampler(interval, self._threads)
+            self.sampler.start()
+        atexit.register(self.stop)
+        print(f"[Tracer] Трассировка кадров включена: {path}")
+
+    def span(self, name, cat="pipeline", **args):
+        if not self.enabled:
+            return _NULL_SPAN
+        return _Span(self, name, cat, args or None)
+
+    def async_span(self, name, cat="pipeline", **args):
+        if not self.enabled:
+            return _NULL_SPAN
+        return _AsyncSpan(self, name, cat, args or None)
+
+    def instant(self, name, cat="pipeline", **args):
+        if self.enabled:
+            self._record("i", name, cat, time.perf_counter(), None, args or None)
+
+    def name_thread(self, name):
+        """Имя текущего потока в трассировке (потоки Qt не видны модулю threading)"""
+        if self.enabled:
+            self._threads[threading.get_ident()] = name
+
+    def _record(self, ph, name, cat, started, duration, args, event_id=None):
+        tid = threading.get_ident()
+        if tid not in self._threads:
+            self._threads[tid] = threading.current_thread().name
+        self._events.append((ph, name, cat, started, duration, tid, args, event_id))
+
+    def events(self):
+        """События в формате Chrome Trace Event"""
+        pid = os.getpid()
+        result = [{'ph': "M", 'name': "process_name", 'pid': pid, 'tid': 0,
+                   'args': {'name': "MotionControl"}}]
+        for tid, name in list(self._threads.items()):
+            result.append({'ph': "M", 'name': "thread_name", 'pid': pid, 'tid': tid, 'args': {'name': name}})
+        for ph, name, cat, started, duration, tid, args, event_id in list(self._events):
+            event = {'ph': ph, 'name': name, 'cat': cat, 'pid': pid, 'tid': tid,
+                     'ts': round((started - self._origin) * 1e6, 1)}
+            if duration is not None:
+                event['dur'] = round(duration * 1e6, 1)
+            if event_id is not None:
+                event['id'] = event_id
+            if ph == "i":
+                event['s'] = "t"
+            if args:
+                event['args'] = args
+            result.append(event)
+        return result
+
+    def save(self, path=None):
+        path = path or self.path
+        if not path:
+            return
+        with self._lock:
+            events = self.events()
+            with open(path, "w", encoding="utf-8") as f:
+                json.dump({'traceEvents': events, 'displayTimeUnit': "ms"}, f, default=str)
+            if self.sampler is not None:
+                self.sampler.save(path + ".stacks.txt")
+        print(f"[Tracer] Сохранено событий: {len(events)} -> {path}")
+
+    def stop(self):
+        if not self.enabled:
+            return
+        self.enabled = False
+        if self.sampler is not None:
+            self.sampler.stop()
+        self.save()
+
+
+tracer = Tracer()
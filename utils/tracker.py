@@ -0,0 +1,119 @@
+import itertools
+import cv2
+import numpy as np
+
+
+def iou(a, b):
+    """Пересечение над объединением для боксов (x1, y1, x2, y2)"""
+    x1, y1 = max(a[0], b[0]), max(a[1], b[1])
+    x2, y2 = min(a[2], b[2]), min(a[3], b[3])
+    inter = max(0.0, x2 - x1) * max(0.0, y2 - y1)
+    union = (a[2] - a[0]) * (a[3] - a[1]) + (b[2] - b[0]) * (b[3] - b[1]) - inter
+    return inter / union if union > 0 else 0.0
+
+
+class Track:
+    __slots__ = ("track_id", "label", "box", "confidence", "hits", "missed", "alerted", "last_seen")
+
+    def __init__(self, track_id, label, box, confidence, now):
+        self.track_id = track_id
+        self.label = label
+        self.box = box              # (x1, y1, x2, y2) в пикселях кадра
+        self.confidence = confidence
+        self.hits = 1               # Кол-во подтверждений детектором
+        self.missed = 0             # Кол-во запусков детектора подряд без подтверждения
+        self.alerted = False
+        self.last_seen = now
+
+
+class BoxTracker:
+    """Сопровождение объектов между запусками детектора.
+
+    На кадрах с детекцией боксы сопоставляются с треками по IoU, между ними
+    смещаются по оптическому потоку (Лукас-Канаде) точек внутри бокса.
+    """
+
+    IOU_THRESHOLD = 0.3
+    MAX_MISSED = 3                  # Запусков детектора без подтверждения до удаления трека
+    MIN_HITS = 2                    # Подтверждений до уведомления о треке
+    MAX_POINTS = 30                 # Точек оптического потока на трек
+
+    def __init__(self, min_hits=MIN_HITS, max_missed=MAX_MISSED):
+        self.min_hits = min_hits
+        self.max_missed = max_missed
+        self.tracks = []
+        self._ids = itertools.count(1)
+        self._prev_gray = None
+
+    def update(self, detections, gray, now):
+        """Сопоставление детекций [(label, confidence, box)]; возвращает новые подтвержденные треки"""
+        pairs = []
+        for t_idx, track in enumerate(self.tracks):
+            for d_idx, (label, _, box) in enumerate(detections):
+                if label == track.label:
+                    overlap = iou(track.box, box)
+                    if overlap >= self.IOU_THRESHOLD:
+                        pairs.append((overlap, t_idx, d_idx))
+
+        matched_tracks, matched_dets = set(), set()
+        for _, t_idx, d_idx in sorted(pairs, reverse=True):
+            if t_idx in matched_tracks or d_idx in matched_dets:
+                continue
+            matched_tracks.add(t_idx)
+            matched_dets.add(d_idx)
+            track = self.tracks[t_idx]
+            _, track.confidence, track.box = detections[d_idx]
+            track.hits += 1
+            track.missed = 0
+            track.last_seen = now
+
+        for t_idx, track in enumerate(self.tracks):
+            if t_idx not in matched_tracks:
+                track.missed += 1
+        self.tracks = [track for track in self.tracks if track.missed <= self.max_missed]
+
+        for d_idx, (label, confidence, box) in enumerate(detections):
+            if d_idx not in matched_dets:
+                self.tracks.append(Track(next(self._ids), label, box, confidence, now))
+
+        self._prev_gray = gray
+        confirmed = []
+        for track in self.tracks:
+            if not track.alerted and track.hits >= self.min_hits:
+                track.alerted = True
+                confirmed.append(track)
+        return confirmed
+
+    def propagate(self, gray):
+        """Смещение боксов по оптическому потоку без запуска детектора"""
+        prev = self._prev_gray
+        self._prev_gray = gray
+        if prev is None or prev.shape != gray.shape:
+            return
+        height, width = gray.shape[:2]
+        for track in self.tracks:
+            x1, y1, x2, y2 = (int(v) for v in track.box)
+            x1, y1 = max(x1, 0), max(y1, 0)
+            x2, y2 = min(x2, width), min(y2, height)
+            if x2 - x1 < 4 or y2 - y1 < 4:
+                continue
+            mask = np.zeros_like(prev)
+            mask[y1:y2, x1:x2] = 255
+            points = cv2.goodFeaturesToTrack(prev, self.MAX_POINTS, 0.01, 5, mask=mask)
+            if points is None:
+                continue
+            moved, status, _ = cv2.calcOpticalFlowPyrLK(prev, gray, points, None)
+            good = status.reshape(-1) == 1
+            if not np.any(good):
+                continue
+            dx, dy = (float(v) for v in np.median((moved - points).reshape(-1, 2)[good], axis=0))
+            bx1, by1, bx2, by2 = track.box
+            track.box = (bx1 + dx, by1 + dy, bx2 + dx, by2 + dy)
+
+    def boxes_mask(self, shape, scale=1.0):
+        """Маска (0/255) боксов текущих треков в масштабе scale"""
+        mask = np.zeros(shape[:2], dtype=np.uint8)
+        for track in self.tracks:
+            x1, y1, x2, y2 = (int(v * scale) for v in track.box)
+            cv2.rectangle(mask, (x1, y1), (x2, y2), 255, -1)
+        return mask
@@ -0,0 +1,269 @@
+import os
+import time
+import threading
+import cv2
+from utils.tracing import tracer
+
+
+LIVE_SCHEMES = ("rtsp://", "rtsps://", "rtmp://", "http://", "https://", "udp://", "tcp://")
+SOURCE_SETTINGS = ("is_webcam", "rtsp_or_path", "rtsp_substream", "rtsp_transport",
+                   "rtsp_buffer_size", "decode_threads", "low_delay", "reconnect_max_delay",
+                   "frame_bus", "frame_bus_slots", "mv_prefilter")
+
+_ffmpeg_env_lock = threading.Lock()     # OPENCV_FFMPEG_CAPTURE_OPTIONS - общая переменная процесса
+
+
+def is_live_url(source):
+    return isinstance(source, int) or str(source).lower().startswith(LIVE_SCHEMES)
+
+
+def source_config(settings):
+    """Параметры настроек, изменение которых требует переоткрыть источник"""
+    return {key: settings.get(key) for key in SOURCE_SETTINGS}
+
+
+def resolve_sources(settings):
+    """(источник анализа, источник записи или None) по настройкам.
+
+    Если задан низкокачественный подпоток, анализ идет по нему, а основной
+    поток используется только для записи.
+    """
+    if settings["is_webcam"] or not settings["rtsp_or_path"]:
+        return 0, None
+    main = settings["rtsp_or_path"]
+    sub = settings.get("rtsp_substream")
+    if sub:
+        return sub, main
+    return main, None
+
+
+def ffmpeg_options(transport="tcp", buffer_size=0, decode_threads=0, low_delay=True):
+    """Параметры FFmpeg в формате OPENCV_FFMPEG_CAPTURE_OPTIONS"""
+    options = {}
+    if transport:
+        options["rtsp_transport"] = transport
+    if buffer_size:
+        options["buffer_size"] = str(buffer_size)
+    if decode_threads:
+        options["threads"] = str(decode_threads)
+    if low_delay:
+        options["fflags"] = "nobuffer"
+        options["flags"] = "low_delay"
+        options["max_delay"] = "0"
+        options["reorder_queue_size"] = "0"
+    return "|".join(f"{key};{value}" for key, value in options.items())
+
+
+class VideoSource:
+    """Источник видео с параметрами бэкенда, переподключением и метриками потока.
+
+    Интерфейс совместим с cv2.VideoCapture (read/isOpened/release/get). Для
+    живых источников (камера, RTSP) неудачное чтение не завершает поток, а
+    запускает переподключение с экспоненциальной задержкой; read() возвращает
+    False только после stop() или в конце файла.
+    """
+
+    RECONNECT_MIN_DELAY = 0.5       # Начальная задержка переподключения (сек)
+    HEALTH_INTERVAL = 5.0           # Период отправки метрик потока (сек)
+
+    def __init__(self, source, transport="tcp", buffer_size=0, decode_threads=0, low_delay=True,
+                 open_timeout=5.0, read_timeout=5.0, reconnect_max_delay=30.0, health_callback=None):
+        self.source = source
+        self.live = is_live_url(source)
+        self.options = ffmpeg_options(transport, buffer_size, decode_threads, low_delay)
+        self.decode_threads = decode_threads
+        self.open_timeout = open_timeout
+        self.read_timeout = read_timeout
+        self.reconnect_max_delay = reconnect_max_delay
+        self.health_callback = health_callback
+
+        self.cap = None
+        self._stop_event = threading.Event()
+        self._last_health = 0.0
+        self._fps_started = time.time()
+        self._fps_frames = 0
+        self.metrics = {
+            'source': str(source),
+            'state': "closed",
+            'fps': 0.0,
+            'frames': 0,
+            'read_failures': 0,
+            'reconnects': 0,
+            'last_frame_time': None,
+            'last_error': None,
+        }
+
+    @classmethod
+    def from_settings(cls, source, settings, health_callback=None):
+        return cls(source,
+                   transport=settings.get("rtsp_transport", "tcp"),
+                   buffer_size=settings.get("rtsp_buffer_size", 0),
+                   decode_threads=settings.get("decode_threads", 0),
+                   low_delay=settings.get("low_delay", True),
+                   reconnect_max_delay=settings.get("reconnect_max_delay", 30.0),
+                   health_callback=health_callback)
+
+    def open(self):
+        self._close_capture()
+        self._set_state("connecting")
+        if isinstance(self.source, int) or not self.live:
+            self.cap = cv2.VideoCapture(self.source)
+        else:
+            params = [cv2.CAP_PROP_OPEN_TIMEOUT_MSEC, int(self.open_timeout * 1000),
+                      cv2.CAP_PROP_READ_TIMEOUT_MSEC, int(self.read_timeout * 1000)]
+            if self.decode_threads and hasattr(cv2, "CAP_PROP_N_THREADS"):
+                params += [cv2.CAP_PROP_N_THREADS, int(self.decode_threads)]
+            with _ffmpeg_env_lock:
+                previous = os.environ.get("OPENCV_FFMPEG_CAPTURE_OPTIONS")
+                os.environ["OPENCV_FFMPEG_CAPTURE_OPTIONS"] = self.options
+                try:
+                    self.cap = cv2.VideoCapture(self.source, cv2.CAP_FFMPEG, params)
+                finally:
+                    if previous is None:
+                        os.environ.pop("OPENCV_FFMPEG_CAPTURE_OPTIONS", None)
+                    else:
+                        os.environ["OPENCV_FFMPEG_CAPTURE_OPTIONS"] = previous
+
+        if self.cap.isOpened():
+            if self.live:
+                # Минимальная очередь кадров в бэкенде - всегда свежий кадр
+                self.cap.set(cv2.CAP_PROP_BUFFERSIZE, 1)
+            self._set_state("streaming")
+            return True
+        self.metrics['last_error'] = "Не удалось открыть источник видео"
+        return False
+
+    def read(self):
+        return self._next_frame(retrieve=True)
+
+    def grab(self):
+        """Следующий кадр без преобразования в изображение (получение - retrieve())"""
+        return self._next_frame(retrieve=False)[0]
+
+    def retrieve(self):
+        return self.cap.retrieve() if self.cap is not None else (False, None)
+
+    def _next_frame(self, retrieve):
+        while not self._stop_event.is_set():
+            if self.cap is not None and self.cap.isOpened():
+                with tracer.span("capture.read", "capture"):
+                    if retrieve:
+                        ret, frame = self.cap.read()
+                    else:
+                        ret, frame = self.cap.grab(), None
+                if ret:
+                    self._on_frame()
+                    return True, frame
+
+            if not self.live and self.cap is not None:
+                self._set_state("ended")
+                return False, None
+            self.metrics['read_failures'] += 1
+            self.metrics['last_error'] = "Ошибка чтения кадра"
+            if not self._reconnect():
+                break
+        return False, None
+
+    def seek(self, seconds):
+        """Перемотка файла к смещению (сек); для живых источников - False"""
+        if self.live or self.cap is None:
+            return False
+        return self.cap.set(cv2.CAP_PROP_POS_MSEC, seconds * 1000)
+
+    def isOpened(self):
+        return not self._stop_event.is_set() and self.cap is not None and self.cap.isOpened()
+
+    def get(self, prop):
+        return self.cap.get(prop) if self.cap is not None else 0.0
+
+    def stop(self):
+        """Прерывание чтения и ожидания переподключения из другого потока"""
+        self._stop_event.set()
+
+    def release(self):
+        self._stop_event.set()
+        self._close_capture()
+        self._set_state("stopped")
+
+    def health(self):
+        metrics = dict(self.metrics)
+        if metrics['last_frame_time']:
+            metrics['last_frame_age'] = round(time.time() - metrics['last_frame_time'], 3)
+        return metrics
+
+    def _reconnect(self):
+        """Переподключение с экспоненциальной задержкой до успеха или stop()"""
+        self._set_state("reconnecting")
+        delay = self.RECONNECT_MIN_DELAY
+        while not self._stop_event.is_set():
+            print(f"[VideoSource] Переподключение к {self.source} через {delay:.1f} с")
+            if self._stop_event.wait(delay):
+                break
+            self.metrics['reconnects'] += 1
+            if self.open():
+                return True
+            self._set_state("reconnecting")
+            delay = min(delay * 2, self.reconnect_max_delay)
+        return False
+
+    def _on_frame(self):
+        now = time.time()
+        self.metrics['frames'] += 1
+        self.metrics['last_frame_time'] = now
+        self._fps_frames += 1
+        if now - self._fps_started >= 1.0:
+            self.metrics['fps'] = round(self._fps_frames / (now - self._fps_started), 1)
+            self._fps_started = now
+            self._fps_frames = 0
+        if now - self._last_health >= self.HEALTH_INTERVAL:
+            self._report()
+
+    def _set_state(self, state):
+        if self.metrics['state'] != state:
+            self.metrics['state'] = state
+            self._report()
+
+    def _report(self):
+        self._last_health = time.time()
+        if self.health_callback:
+            self.health_callback(self.health())
+
+    def _close_capture(self):
+        if self.cap is not None:
+            self.cap.release()
+
+
+class FrameGrabber:
+    """Фоновое чтение потока с хранением только последнего кадра.
+
+    Используется для основного потока записи при анализе по подпотоку.
+    """
+
+    def __init__(self, source):
+        self.source = source
+        self.thread = None
+        self._frame = None
+        self._lock = threading.Lock()
+
+    def start(self):
+        self.source.open()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.source.stop()
+        if self.thread:
+            self.thread.join()
+        self.source.release()
+
+    def latest(self):
+        with self._lock:
+            return self._frame
+
+    def _run(self):
+        while True:
+            ret, frame = self.source.read()
+            if not ret:
+                break
+            with self._lock:
+                self._frame = frame
@@ -2,52 +2,77 @@ import os
 import cv2
 import threading
 import time
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
 from PyQt5.QtCore import QObject, pyqtSignal
 from ultralytics import YOLO
 from ultralytics.utils import LOGGER
-import collections
+from models.settings_manager import settings_manager
+from utils.frame_bus import open_capture
+from utils.recorder import create_recorder
+from utils.tracker import BoxTracker
+from utils.motion_algorithm import compute_motion_mask, find_blobs
+from utils.tracing import tracer
+from utils.inference_server import get_inference_client
 
 class YoloDetector(QObject):
 
     detect_signal = pyqtSignal(str)
+    stream_health = pyqtSignal(dict)
 
     RECORDING_TIME = 5              # Время записи (сек)
     STORAGE_TIME = 7                # Время хранения записей (дни)
     REPEAT_DETECTION_COOLDOWN = 5   # Задержка между повторными уведомлениями о том же объекте (сек)
+    MOTION_SCALE = 0.25             # Масштаб кадра для проверки движения в режиме сопровождения
+    MOTION_TRIGGER_AREA = 0.002     # Мин. площадь области движения вне треков (доля кадра) для внеочередной детекции
 
-    def __init__(self, model_path="yolo11n.pt", source=0):
+    def __init__(self, model_path="yolo11n.pt", source=0, tiering=None):
         super().__init__()
         LOGGER.setLevel("WARNING")
-        self.model = YOLO(model_path)
+        # При заданном yolo_server инференс идет на общем сервере пакетами, своя модель не загружается
+        self.client = get_inference_client(settings_manager.settings)
+        self.model = YOLO(model_path) if self.client is None else None
+        self.predict_args = {}
+        self.tiering = tiering          # Подбор модели под бюджет задержки (ModelTiering)
+        self.model_path = model_path
+        self._tier_loader = None        # Фоновая загрузка модели новой ступени
+        self._tier_load = None          # (ступень, Future загрузки)
         self.source = source
         self.running = False
         self.thread = None
+        self.cap = None
 
         self.video_dir = "videos"
         os.makedirs(self.video_dir, exist_ok=True)
 
         self.target_classes = ["person", "cat"]
-        self.class_names = self.model.names
+        self.class_names = self.model.names if self.model is not None else {}
         self.target_ids = [cls_id for cls_id, name in self.class_names.items() if name in self.target_classes]
 
         self.last_seen = {label: 0 for label in self.target_classes}
         self.active_flags = {label: False for label in self.target_classes}
         self.notification_callback = None
+        self.live_hub = None            # LiveHub HTTP API (кадры и объекты)
 
 
     def set_notification_callback(self, callback):
         self.notification_callback = callback
 
+    def set_live_hub(self, hub):
+        self.live_hub = hub
+
 
     def start(self):
         if not self.running:
             self.running = True
-            self.thread = threading.Thread(target=self._run, daemon=True)
+            self.thread = threading.Thread(target=self._run, name="YoloDetector", daemon=True)
             self.thread.start()
 
 
     def stop(self):
         self.running = False
+        if self.cap:
+            self.cap.stop()
         if self.thread:
             self.thread.join()
         cv2.destroyAllWindows()
@@ -64,82 +89,193 @@ class YoloDetector(QObject):
 
     def _run(self):
         self._cleanup_old_videos()
-        cap = cv2.VideoCapture(self.source)
+        # Инференс дольше, чем слот шины кадров хранит кадр, - кадр копируется при чтении
+        cap = open_capture(self.source, settings_manager.settings, self.stream_health.emit, copy=True)
+        self.cap = cap
         if not cap.isOpened():
-            print(f"[ERROR] Не удалось открыть источник видео: {self.source}")
-            self.running = False
-            return
+            print(f"[ERROR] Не удалось открыть источник видео: {self.source}, переподключение")
 
         print("[INFO] YOLO-детектор запущен.")
 
-        frame_buffer = collections.deque(maxlen=150)  # ~5 секунд при 30 FPS
-        recording = False
-        recording_start = 0
-        video_writer = None
-        video_path = None
+        recorder = create_recorder(settings_manager.settings, self.source, self.video_dir,
+                                   self.RECORDING_TIME, "INFO")
+        recorder.start()
+
+        # Режим сопровождения: полный инференс раз в detect_interval кадров
+        # (или при движении вне известных объектов), между ними - трекер
+        settings = settings_manager.settings
+        self.tracker = BoxTracker() if settings.get("yolo_tracking") else None
+        self.detect_interval = max(1, int(settings.get("yolo_detect_interval", 5)))
+        self.motion_trigger = settings.get("yolo_motion_trigger", True)
+        self._frames_since_detect = self.detect_interval
+        self._prev_small = None
 
-        while self.running and cap.isOpened():
+        while self.running:
             ret, frame = cap.read()
             if not ret:
                 break
 
             current_time = time.time()
-            detected_labels = set()
-            frame_buffer.append(frame.copy())
-
-            results = self.model(frame, stream=True)
-            for result in results:
-                for box in result.boxes:
-                    cls_id = int(box.cls[0])
-                    if cls_id in self.target_ids:
-                        label = self.class_names[cls_id]
-                        detected_labels.add(label)
-
-                        if current_time - self.last_seen[label] > self.REPEAT_DETECTION_COOLDOWN:
-                            if not self.active_flags[label]:
-
-                                # Запуск записи видео
-                                if not recording:
-                                    recording = True
-                                    recording_start = time.time()
-
-                                    fourcc = cv2.VideoWriter_fourcc(*'mp4v')
-                                    height, width = frame.shape[:2]
-
-                                    timestamp = time.strftime("%Y-%m-%d_%H-%M-%S")
-                                    filename = f"{timestamp}_{label}.mp4"
-                                    video_path = os.path.join(self.video_dir, filename)
-
-                                    video_writer = cv2.VideoWriter(video_path, fourcc, 20.0, (width, height))
-
-                                    # Сохраняем буфер до срабатывания
-                                    for buffered_frame in frame_buffer:
-                                        video_writer.write(buffered_frame)
-
-                                if self.notification_callback:
-                                    self.notification_callback(label, frame.copy())
-
-                                self.active_flags[label] = True
-                        self.last_seen[label] = current_time
-
-
-            if recording and video_writer:
-                video_writer.write(frame)
-                if time.time() - recording_start > self.RECORDING_TIME:
-                    recording = False
-                    video_writer.release()
-                    video_writer = None
-                    with open("log.txt", "a", encoding="utf-8") as log:
-                        log.write(f"{timestamp} — обнаружен {label} — {filename}\n")
-                    print(f"[INFO] Видео записано: {video_path}")
-
-            for label in self.target_classes:
-                if label not in detected_labels and self.active_flags[label]:
-                    if current_time - self.last_seen[label] > self.REPEAT_DETECTION_COOLDOWN:
-                        self.active_flags[label] = False
+            if recorder.uses_frames:
+                recorder.push(frame)
+            # Миниатюры индекса клипа (кадр уменьшается не чаще раза в секунду)
+            recorder.annotate(current_time, frame=frame)
+            if self.live_hub is not None:
+                self.live_hub.publish_frame(frame)
+
+            if self.model is not None and self.tiering is not None and self.tiering.needs_benchmark:
+                with tracer.span("yolo.benchmark", "yolo"):
+                    self._benchmark_models(frame)
+
+            with tracer.span("yolo.frame", "yolo"):
+                if self.tracker is not None:
+                    self._process_tracking(frame, current_time, recorder)
+                else:
+                    self._process_cooldown(frame, current_time, recorder)
 
         cap.release()
-        if video_writer:
-            video_writer.release()
+        recorder.close()
         self.running = False
         print("[INFO] YOLO-детектор остановлен.")
+
+    def _process_cooldown(self, frame, current_time, recorder):
+        """Детекция на каждом кадре с подавлением повторов по классу"""
+        objects = self._detect(frame)
+        if objects is None:
+            return
+        if self.live_hub is not None:
+            self.live_hub.publish_objects(objects)
+        if objects:
+            recorder.annotate(current_time, labels=sorted({label for label, _, _ in objects}))
+        detected_labels = set()
+        for label, _, _ in objects:
+            detected_labels.add(label)
+
+            if current_time - self.last_seen[label] > self.REPEAT_DETECTION_COOLDOWN:
+                if not self.active_flags[label]:
+
+                    # Запуск записи видео (с буфером до срабатывания)
+                    recorder.trigger(label, f"обнаружен {label}")
+
+                    if self.notification_callback:
+                        self.notification_callback(label, frame.copy())
+
+                    self.active_flags[label] = True
+            self.last_seen[label] = current_time
+
+        for label in self.target_classes:
+            if label not in detected_labels and self.active_flags[label]:
+                if current_time - self.last_seen[label] > self.REPEAT_DETECTION_COOLDOWN:
+                    self.active_flags[label] = False
+
+    def _set_model(self, model, imgsz=None, model_path=None):
+        self.model = model
+        self.model_path = model_path or self.model_path
+        self.predict_args = {'imgsz': imgsz} if imgsz else {}
+
+    def _benchmark_models(self, frame):
+        """Замер ступеней моделей на текущем кадре и переход на выбранную"""
+        try:
+            config, model = self.tiering.benchmark(frame, YOLO)
+        except Exception as e:
+            print(f"[ERROR] Замер моделей не выполнен: {e}")
+            return
+        self._tier_load = None
+        self._set_model(model, config.imgsz, config.model_path)
+
+    def _infer(self, frame):
+        """Результаты текущей модели; задержка учитывается при подборе ступени"""
+        started = time.perf_counter()
+        results = list(self.model(frame, stream=True, **self.predict_args))
+        if self.tiering is not None and self.tiering.enabled:
+            if self._tier_load is not None:
+                self._finish_tier_load()
+            else:
+                target = self.tiering.observe(time.perf_counter() - started, time.time())
+                if target is not None:
+                    self._switch_tier(target)
+        return results
+
+    def _switch_tier(self, target):
+        """Переход на ступень: другая модель загружается в фоне, до готовности работает текущая"""
+        if target.model_path == self.model_path:
+            self._set_model(self.model, target.imgsz)
+            return
+        if self._tier_loader is None:
+            self._tier_loader = ThreadPoolExecutor(max_workers=1, thread_name_prefix="YoloTierLoader")
+        self._tier_load = (target, self._tier_loader.submit(self._load_tier_model, target))
+
+    @staticmethod
+    def _load_tier_model(target):
+        """Загрузка и прогрев модели ступени (в фоновом потоке): первый прогон не задержит кадр"""
+        model = YOLO(target.model_path)
+        model(np.zeros((target.imgsz, target.imgsz, 3), np.uint8), imgsz=target.imgsz, verbose=False)
+        return model
+
+    def _finish_tier_load(self):
+        target, future = self._tier_load
+        if not future.done():
+            return
+        self._tier_load = None
+        try:
+            model = future.result()
+        except Exception as e:
+            print(f"[ERROR] Не удалось загрузить модель {target.model_path}: {e}")
+            return
+        self._set_model(model, target.imgsz, target.model_path)
+        # Задержка, замеренная во время загрузки, относилась к прежней модели
+        self.tiering.settle(time.time())
+        print(f"[INFO] Модель YOLO: {target}")
+
+    def _detect(self, frame):
+        """Список (label, confidence, box) объектов целевых классов или None, если кадр пропущен"""
+        if self.client is not None:
+            objects = self.client.infer(frame)
+            if objects is None:
+                return None
+            return [obj for obj in objects if obj[0] in self.target_classes]
+
+        objects = []
+        for result in self._infer(frame):
+            for box in result.boxes:
+                cls_id = int(box.cls[0])
+                if cls_id in self.target_ids:
+                    objects.append((self.class_names[cls_id], float(box.conf[0]),
+                                    tuple(float(v) for v in box.xyxy[0])))
+        return objects
+
+    def _process_tracking(self, frame, current_time, recorder):
+        """Детекция раз в N кадров с сопровождением и уведомлением по каждому треку"""
+        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+        small = cv2.resize(gray, None, fx=self.MOTION_SCALE, fy=self.MOTION_SCALE,
+                           interpolation=cv2.INTER_AREA)
+
+        self._frames_since_detect += 1
+        run_detector = self._frames_since_detect >= self.detect_interval
+        if not run_detector and self.motion_trigger and self._prev_small is not None:
+            # Связная область движения вне боксов известных объектов - возможно, появился новый
+            motion = compute_motion_mask(small, self._prev_small, use_filter=False)
+            motion[self.tracker.boxes_mask(small.shape, self.MOTION_SCALE) > 0] = 0
+            run_detector = bool(find_blobs(motion, max(1, int(self.MOTION_TRIGGER_AREA * motion.size))))
+        self._prev_small = small
+
+        if not run_detector:
+            with tracer.span("yolo.propagate", "yolo", tracks=len(self.tracker.tracks)):
+                self.tracker.propagate(gray)
+            return
+
+        with tracer.span("yolo.detect", "yolo"):
+            objects = self._detect(frame)
+        if objects is None:
+            # Сервер инференса перегружен или недоступен - повтор на следующем кадре
+            self.tracker.propagate(gray)
+            return
+        self._frames_since_detect = 0
+        if self.live_hub is not None:
+            self.live_hub.publish_objects(objects)
+        if objects:
+            recorder.annotate(current_time, labels=sorted({label for label, _, _ in objects}))
+        for track in self.tracker.update(objects, gray, current_time):
+            recorder.trigger(track.label, f"обнаружен {track.label} (трек {track.track_id})")
+            if self.notification_callback:
+                self.notification_callback(f"{track.label} #{track.track_id}", frame.copy())
@@ -0,0 +1,128 @@
+import cv2
+import numpy as np
+from utils.motion_algorithm import evaluate_roi, zone_density, find_blobs
+
+
+FULL_FRAME_ZONE = (0.0, 0.0, 1.0, 1.0)
+
+
+def is_polygon(zone):
+    """Зона-многоугольник задается списком точек, прямоугольник - (x, y, w, h)"""
+    return len(zone) > 0 and isinstance(zone[0], (list, tuple))
+
+
+def normalize_zones(zones):
+    """Приведение зон к кортежам в относительных координатах кадра (0..1)"""
+    result = []
+    for zone in zones or []:
+        if zone is None:
+            continue
+        if is_polygon(zone):
+            points = tuple((float(x), float(y)) for x, y in zone)
+            if len(points) >= 3:
+                result.append(points)
+        elif len(zone) == 4:
+            result.append(tuple(float(v) for v in zone))
+    return result
+
+
+def pixel_rect_to_zone(rect, width, height):
+    """Прямоугольник в пикселях кадра -> зона в относительных координатах"""
+    x, y, w, h = rect
+    return (x / width, y / height, w / width, h / height)
+
+
+class CompiledZone:
+    """Зона, растеризованная под разрешение анализа"""
+
+    __slots__ = ("zone", "roi", "mask", "area", "points", "scratch", "work")
+
+    def __init__(self, zone, roi, mask, area, points):
+        self.zone = zone        # Исходная зона (относительные координаты)
+        self.roi = roi          # Ограничивающий прямоугольник (x, y, w, h) в пикселях
+        self.mask = mask        # Маска многоугольника внутри roi (0/255) или None для прямоугольника
+        self.area = area        # Кол-во пикселей зоны
+        self.points = points    # Вершины многоугольника в пикселях или None
+        # Буфер пересечения маски изменений с маской многоугольника
+        self.scratch = np.empty_like(mask) if mask is not None else None
+        # Буфер эрозии при поиске остова
+        self.work = np.empty((roi[3], roi[2]), dtype=np.uint8)
+
+    def contains(self, px, py):
+        """Попадает ли точка кадра (в пикселях) в зону"""
+        x, y, w, h = self.roi
+        cx, cy = int(px) - x, int(py) - y
+        if not (0 <= cx < w and 0 <= cy < h):
+            return False
+        return self.mask is None or self.mask[cy, cx] > 0
+
+
+def compile_zone(zone, width, height):
+    if is_polygon(zone):
+        pts = np.array([[round(x * width), round(y * height)] for x, y in zone], dtype=np.int32)
+        pts[:, 0] = np.clip(pts[:, 0], 0, width - 1)
+        pts[:, 1] = np.clip(pts[:, 1], 0, height - 1)
+        x, y, w, h = cv2.boundingRect(pts)
+        mask = np.zeros((h, w), dtype=np.uint8)
+        cv2.fillPoly(mask, [pts - (x, y)], 255)
+        return CompiledZone(zone, (x, y, w, h), mask, cv2.countNonZero(mask),
+                            [tuple(map(int, p)) for p in pts])
+
+    x0 = min(max(round(zone[0] * width), 0), width)
+    y0 = min(max(round(zone[1] * height), 0), height)
+    x1 = min(max(round((zone[0] + zone[2]) * width), 0), width)
+    y1 = min(max(round((zone[1] + zone[3]) * height), 0), height)
+    w, h = max(x1 - x0, 0), max(y1 - y0, 0)
+    return CompiledZone(zone, (x0, y0, w, h), None, w * h, None)
+
+
+class ZoneSet:
+    """Набор зон интереса с масками, пересчитываемыми только при смене зон или разрешения"""
+
+    def __init__(self, zones=()):
+        self.zones = normalize_zones(zones)
+        self.compiled = []
+        self._shape = None
+
+    def set_zones(self, zones):
+        zones = normalize_zones(zones)
+        if zones != self.zones:
+            self.zones = zones
+            self._shape = None
+
+    def prepare(self, shape):
+        """Растеризация зон под разрешение кадра (h, w)"""
+        shape = tuple(shape[:2])
+        if shape != self._shape:
+            height, width = shape
+            self.compiled = [compile_zone(zone, width, height) for zone in self.zones]
+            self._shape = shape
+        return self.compiled
+
+    def evaluate(self, diff_thresh, p_dop, ostov_template):
+        """Список (CompiledZone, движение недопустимо, плотность) по всем зонам"""
+        results = []
+        for zone in self.prepare(diff_thresh.shape):
+            found, p = evaluate_roi(diff_thresh, zone.roi, p_dop, ostov_template,
+                                    zone.mask, zone.area, zone.scratch, zone.work)
+            results.append((zone, found, p))
+        return results
+
+    def evaluate_blobs(self, diff_thresh, p_dop, min_area):
+        """Список (CompiledZone, движение недопустимо, плотность, области) по всем зонам.
+
+        Вместо поиска остова движение недопустимо, если плотность не ниже p_dop
+        и в зоне есть связная область площадью от min_area (доля кадра).
+        Область относится к зоне, в которую попадает ее центр.
+        """
+        height, width = diff_thresh.shape[:2]
+        blobs = find_blobs(diff_thresh, max(1, int(min_area * width * height)))
+        results = []
+        for zone in self.prepare(diff_thresh.shape):
+            _, p = zone_density(diff_thresh, zone.roi, zone.mask, zone.area, zone.scratch)
+            zone_blobs = [blob for blob in blobs if zone.contains(*blob['centroid'])]
+            results.append((zone, p >= p_dop and bool(zone_blobs), p, zone_blobs))
+        return results
+
+    def __len__(self):
+        return len(self.zones)
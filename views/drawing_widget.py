@@ -1,6 +1,6 @@
 from PyQt5.QtCore import QRect, QPoint, Qt, pyqtSignal
 from PyQt5.QtWidgets import QWidget
-from PyQt5.QtGui import QPainter, QPen
+from PyQt5.QtGui import QPainter, QPen, QPolygon
 
 
 class DrawingWidget(QWidget):
@@ -16,20 +16,59 @@ class DrawingWidget(QWidget):
         self.rectangles = []
         self.current_rect = None
 
+        # Режим многоугольников: ЛКМ - вершина, двойной щелчок - замкнуть,
+        # ПКМ во время рисования - отменить текущий многоугольник
+        self.polygon_mode = False
+        self.polygons = []
+        self.current_polygon = []
+
+    def set_polygon_mode(self, enabled):
+        self.polygon_mode = enabled
+        self.drawing = False
+        self.current_polygon = []
+        self.update()
+
+    def set_shapes(self, shapes):
+        """Установка зон (QRect и QPolygon) без повторной отправки сигнала"""
+        self.rectangles = [shape for shape in shapes if isinstance(shape, QRect)]
+        self.polygons = [shape for shape in shapes if isinstance(shape, QPolygon)]
+        self.update()
+
+    def shapes(self):
+        return self.rectangles + self.polygons
+
     def mousePressEvent(self, event):
         if event.button() == Qt.LeftButton:
+            if self.polygon_mode:
+                self.current_polygon.append(event.pos())
+                self.end_point = event.pos()
+                self.update()
+                return
             self.drawing = True
             self.start_point = event.pos()
             self.end_point = event.pos()
             self.update()
         elif event.button() == Qt.RightButton:
+            if self.current_polygon:
+                self.current_polygon = []
+                self.update()
+                return
             self.rectangles.clear()
+            self.polygons.clear()
             self.current_rect = None
             self.clear_rectangles.emit([])
             self.update()
 
+    def mouseDoubleClickEvent(self, event):
+        if self.polygon_mode and event.button() == Qt.LeftButton:
+            if len(self.current_polygon) >= 3:
+                self.polygons.append(QPolygon(self.current_polygon))
+                self.rectangle_drawn.emit(self.shapes())
+            self.current_polygon = []
+            self.update()
+
     def mouseMoveEvent(self, event):
-        if self.drawing:
+        if self.drawing or self.current_polygon:
             self.end_point = event.pos()
             self.update()
 
@@ -39,7 +78,7 @@ class DrawingWidget(QWidget):
             rect = QRect(self.start_point, self.end_point).normalized()
             if rect.isValid():
                 self.rectangles.append(rect)
-                self.rectangle_drawn.emit(self.rectangles)
+                self.rectangle_drawn.emit(self.shapes())
             self.current_rect = None
             self.update()
 
@@ -50,6 +89,12 @@ class DrawingWidget(QWidget):
         for rect in self.rectangles:
             painter.drawRect(rect)
 
+        for polygon in self.polygons:
+            painter.drawPolygon(polygon)
+
         if self.drawing:
             rect = QRect(self.start_point, self.end_point).normalized()
-            painter.drawRect(rect)
\ No newline at end of file
+            painter.drawRect(rect)
+
+        if self.current_polygon:
+            painter.drawPolyline(QPolygon(self.current_polygon + [self.end_point]))
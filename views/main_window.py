@@ -1,18 +1,45 @@
+import time
 import numpy as np
-from PyQt5.QtGui import QImage, QPixmap, QPainter, QFont, QPen, QFontMetrics
-from PyQt5.QtWidgets import QMainWindow
+from PyQt5.QtGui import QImage, QPixmap, QPainter, QFont, QPen, QFontMetrics, QPolygon
+from PyQt5.QtWidgets import QMainWindow, QLabel
 from PyQt5.QtCore import pyqtSignal, pyqtSlot, Qt, QEvent, QRect, QPoint
 
 from views.ui.main import Ui_MainWindow
 from views.settings_dialog import SettingsDialog
 from models.settings_manager import settings_manager
 from views.drawing_widget import DrawingWidget
+from utils.zones import normalize_zones, is_polygon
+from utils.detections import DetectionState
+from utils.activity_history import ActivityHistory
+from utils.clip_index import load_clip_index, describe_clip_index, index_paths
+from utils.tracing import tracer
+
+
+class OverlayLayout:
+    """Раскладка подписей зоны в координатах метки кадра"""
+
+    __slots__ = ("key", "roi_rect", "polygon", "status_font", "status_pos", "status_rect",
+                 "time_pos", "time_rect")
+
+    def __init__(self, key, roi_rect, polygon, status_font, status_pos, status_rect, time_pos, time_rect):
+        self.key = key                      # (ROI, масштаб, статус, длины текстов) - условие пересчета
+        self.roi_rect = roi_rect
+        self.polygon = polygon              # QPolygon в координатах метки или None
+        self.status_font = status_font
+        self.status_pos = status_pos
+        self.status_rect = status_rect
+        self.time_pos = time_pos
+        self.time_rect = time_rect
 
 
 class MainWindow(QMainWindow):
     signal_run = pyqtSignal(bool)
     signal_send_rect = pyqtSignal(list)
 
+    OBJECTS_TTL = 1.0               # Объекты YOLO без обновления дольше (сек) не рисуются
+    HISTORY_SECONDS = 60            # Длина графика активности зоны (сек)
+    HISTORY_HEIGHT = 0.2            # Высота графика - доля высоты зоны
+
     def __init__(self):
         super().__init__()
         self.ui = Ui_MainWindow()
@@ -20,7 +47,14 @@ class MainWindow(QMainWindow):
         self.drawing_widget = None
         self.current_scaled_rect = None
         self.scale_factors = (1.0, 1.0)
-        self.detect = []
+        self.detect = DetectionState()
+        self.history = ActivityHistory()    # Плотность и тревоги зон по секундам/минутам/часам
+        self._sparklines = {}       # Индекс зоны -> (ключ, QPolygon, отметки тревог)
+        self._overlays = {}         # Индекс зоны -> OverlayLayout
+        self._fonts = {}            # Размер шрифта -> (QFont, QFontMetrics)
+        self.objects = []           # Объекты YOLO последнего ответа сервера инференса
+        self.objects_time = 0.0
+        self.zones_restored = False
 
         self.init_ui()
         self.init_signals()
@@ -30,6 +64,8 @@ class MainWindow(QMainWindow):
     def init_ui(self):
         self.ui.setupUi(self)
         self.setup_frame_labels()
+        self.lbl_governor = QLabel()
+        self.statusBar().addPermanentWidget(self.lbl_governor)
         self._update_ui_settings(settings_manager.settings)
 
     def setup_frame_labels(self):
@@ -45,6 +81,7 @@ class MainWindow(QMainWindow):
                                         )
         self.drawing_widget.rectangle_drawn.connect(self.handle_rectangle)
         self.drawing_widget.clear_rectangles.connect(self.handle_rectangle)
+        self.ui.cb_polygon.toggled.connect(self.drawing_widget.set_polygon_mode)
         self.drawing_widget.hide()
         self.ui.lbl_frame.installEventFilter(self)
 
@@ -60,15 +97,21 @@ class MainWindow(QMainWindow):
     # region Video Processing
     @pyqtSlot(np.ndarray, np.ndarray)
     def put_frame(self, rgb_frame, bin_frame):
-        self.process_rgb_frame(rgb_frame)
-        self.process_bin_frame(bin_frame)
-        self.update_scaling_factors(rgb_frame.shape)
-        self.drawing_widget.show()
+        with tracer.span("gui.put_frame", "gui"):
+            self.process_rgb_frame(rgb_frame)
+            self.process_bin_frame(bin_frame)
+            self.update_scaling_factors(rgb_frame.shape)
+            if not self.zones_restored:
+                self.restore_zones()
+            self.drawing_widget.show()
 
     def process_rgb_frame(self, frame):
         pixmap = self.create_pixmap(frame, self.ui.lbl_frame.size())
         if len(self.detect) > 0:
+            self.add_activity_history(pixmap, self.detect)
             self.add_detection_text(pixmap, self.detect)
+        if self.objects and time.time() - self.objects_time < self.OBJECTS_TTL:
+            self.add_objects(pixmap, self.objects)
         self.ui.lbl_frame.setPixmap(pixmap)
 
     def process_bin_frame(self, frame):
@@ -90,23 +133,87 @@ class MainWindow(QMainWindow):
         try:
             painter.setRenderHint(QPainter.Antialiasing)
 
-            for detection in filter(lambda d: d['activity'] > 0, detections):
-                self._draw_single_detection(painter, detection)
+            for i in np.flatnonzero(detections.records['activity'] > 0):
+                self._draw_single_detection(painter, detections.records[i],
+                                            detections.polygons[i], detections.blobs[i])
+
+        finally:
+            painter.end()
+
+    def add_activity_history(self, pixmap, detections):
+        """График плотности зон за HISTORY_SECONDS у нижнего края каждой зоны"""
+        now = time.time()
+        _, activity, detected = self.history.series("second", self.HISTORY_SECONDS, now)
+        if activity.shape[1] != len(detections):
+            return
+        painter = QPainter(pixmap)
+        try:
+            for i, detection in enumerate(detections.records):
+                polygon, ticks = self._get_sparkline(i, detection, activity[:, i], detected[:, i])
+                painter.setPen(QPen(Qt.red, 1))
+                for x, top, bottom in ticks:
+                    painter.drawLine(x, top, x, bottom)
+                painter.setPen(QPen(Qt.green, 1))
+                painter.drawPolyline(polygon)
+        finally:
+            painter.end()
 
+    def _get_sparkline(self, index, detection, activity, detected):
+        """Линия графика зоны из кэша: пересчет раз в секунду или при смене ROI и масштаба"""
+        key = (self.history.version("second"), tuple(detection['roi']), self.scale_factors)
+        cached = self._sparklines.get(index)
+        if cached is not None and cached[0] == key:
+            return cached[1], cached[2]
+
+        rect = self._get_scaled_roi_rect(detection)
+        height = max(int(rect.height() * self.HISTORY_HEIGHT), 4)
+        bottom = rect.bottom() - 1
+        step = rect.width() / max(len(activity) - 1, 1)
+        # Нет данных - нулевая плотность; масштаб по пику окна
+        values = np.nan_to_num(activity, nan=0.0)
+        top = max(float(values.max()), 1e-6)
+        points = [QPoint(rect.left() + int(j * step), bottom - int(value / top * height))
+                  for j, value in enumerate(values)]
+        ticks = [(rect.left() + int(j * step), bottom - height, bottom) for j in np.flatnonzero(detected)]
+        polygon = QPolygon(points)
+        self._sparklines[index] = (key, polygon, ticks)
+        return polygon, ticks
+
+    def add_objects(self, pixmap, objects):
+        """Рамки и подписи объектов YOLO"""
+        painter = QPainter(pixmap)
+        try:
+            font, metrics = self._time_font()
+            painter.setFont(font)
+            for label, confidence, (x1, y1, x2, y2) in objects:
+                rect = QRect(int(x1 / self.scale_factors[0]), int(y1 / self.scale_factors[1]),
+                             int((x2 - x1) / self.scale_factors[0]), int((y2 - y1) / self.scale_factors[1]))
+                painter.setPen(QPen(Qt.cyan, 2))
+                painter.setBrush(Qt.NoBrush)
+                painter.drawRect(rect)
+                text = f"{label} {confidence:.2f}"
+                position = QPoint(rect.x(), max(rect.y() - metrics.descent(), metrics.ascent()))
+                painter.setPen(Qt.cyan)
+                painter.drawText(position, text)
         finally:
             painter.end()
 
-    def _draw_single_detection(self, painter, detection):
+    def _draw_single_detection(self, painter, detection, polygon=None, blobs=None):
         """Отрисовка одного обнаружения с текстом и рамкой"""
         # Подготовка данных
         status_text = self._generate_status_text(detection)
-        roi_rect = self._get_scaled_roi_rect(detection)
         time_text = self._get_time(detection)
+        layout = self._get_overlay_layout(detection, polygon, status_text, time_text)
 
         # Отрисовка элементов
-        self._draw_bounding_box(painter, roi_rect)
-        self._draw_status_text(painter, status_text, roi_rect)
-        self._draw_time_text(painter, time_text, roi_rect)
+        if layout.polygon is not None:
+            self._draw_polygon(painter, layout.polygon)
+        else:
+            self._draw_bounding_box(painter, layout.roi_rect)
+        for blob in blobs or ():
+            self._draw_blob(painter, blob)
+        self._draw_status_text(painter, status_text, layout)
+        self._draw_time_text(painter, time_text, layout)
 
     def _generate_status_text(self, detection):
         """Генерация текста статуса"""
@@ -115,7 +222,37 @@ class MainWindow(QMainWindow):
 
     def _get_time(self, detection):
         """Получение времени для каждого участка"""
-        return f"t={np.round(detection['time'], 4)}"
+        return f"t={float(detection['time']):.4f}"
+
+    def _get_overlay_layout(self, detection, polygon, status_text, time_text):
+        """Геометрия подписей зоны из кэша.
+
+        Раскладка пересчитывается только при смене ROI, масштаба метки или
+        класса ширины текста (статус и число символов); смена зон очищает кэш.
+        """
+        key = (tuple(detection['roi']), self.scale_factors, bool(detection['detected']),
+               len(status_text), len(time_text))
+        index = int(detection['zone'])
+        layout = self._overlays.get(index)
+        if layout is None or layout.key != key:
+            layout = self._build_overlay_layout(key, detection, polygon, status_text, time_text)
+            self._overlays[index] = layout
+        return layout
+
+    def _build_overlay_layout(self, key, detection, polygon, status_text, time_text):
+        roi_rect = self._get_scaled_roi_rect(detection)
+        scaled_polygon = None
+        if polygon:
+            scaled_polygon = QPolygon([
+                QPoint(int(x / self.scale_factors[0]), int(y / self.scale_factors[1]))
+                for x, y in polygon
+            ])
+
+        font, metrics = self._configure_font(status_text, roi_rect)
+        status_pos, status_rect = self._calculate_text_position(metrics, status_text, roi_rect)
+        time_pos, time_rect = self._calculate_time_position(time_text, roi_rect)
+        return OverlayLayout(key, roi_rect, scaled_polygon, font, status_pos, status_rect,
+                             time_pos, time_rect)
 
     def _get_scaled_roi_rect(self, detection):
         """Получение координат ROI с учетом масштабирования"""
@@ -135,84 +272,80 @@ class MainWindow(QMainWindow):
         finally:
             painter.restore()
 
-    def _draw_status_text(self, painter, text, roi_rect):
-        """Отрисовка текста статуса с фоном"""
+    def _draw_polygon(self, painter, polygon):
+        """Отрисовка красного контура многоугольной зоны"""
         painter.save()
         try:
-            # Настройка шрифта
-            font = self._configure_font(painter, text, roi_rect)
-            metrics = QFontMetrics(font)
-
-            # Расчет позиций и размеров
-            text_pos, bg_rect = self._calculate_text_position(
-                metrics, text, roi_rect)
+            painter.setPen(QPen(Qt.red, 2))
+            painter.setBrush(Qt.NoBrush)
+            painter.drawPolygon(polygon)
+        finally:
+            painter.restore()
 
-            # Отрисовка фона и текста
-            self._draw_text_background(painter, bg_rect)
-            self._draw_text(painter, text, text_pos)
+    def _draw_blob(self, painter, blob):
+        """Отрисовка рамки связной области движения и ее центра"""
+        x, y, w, h = blob['box']
+        cx, cy = blob['centroid']
+        painter.save()
+        try:
+            painter.setPen(QPen(Qt.yellow, 1))
+            painter.setBrush(Qt.NoBrush)
+            painter.drawRect(QRect(int(x / self.scale_factors[0]), int(y / self.scale_factors[1]),
+                                   int(w / self.scale_factors[0]), int(h / self.scale_factors[1])))
+            painter.drawEllipse(QPoint(int(cx / self.scale_factors[0]), int(cy / self.scale_factors[1])), 2, 2)
+        finally:
+            painter.restore()
 
+    def _draw_status_text(self, painter, text, layout):
+        """Отрисовка текста статуса с фоном"""
+        painter.save()
+        try:
+            painter.setFont(layout.status_font)
+            self._draw_text_background(painter, layout.status_rect)
+            self._draw_text(painter, text, layout.status_pos)
         finally:
             painter.restore()
 
-    def _draw_time_text(self, painter, text, roi_rect):
+    def _draw_time_text(self, painter, text, layout):
         """Отрисовка времени работы"""
         painter.save()
         try:
-            # Настройка шрифта (можно использовать меньший размер)
-            font = QFont()
-            font.setPointSize(8)
-            painter.setFont(font)
-            metrics = QFontMetrics(font)
-
-            # Позиция текста (нижний левый угол с отступом)
-            padding = 5
-            text_width = metrics.horizontalAdvance(text)
-            text_height = metrics.height()
-
-            text_x = roi_rect.x() + padding
-            text_y = roi_rect.y() + roi_rect.height() - padding
-
-            # Прямоугольник фона
-            margin = 2
-            bg_rect = QRect(
-                text_x - margin,
-                text_y - text_height - margin,
-                text_width + 2 * margin,
-                text_height + 2 * margin
-            )
-
-            # Отрисовка фона и текста
-            painter.setBrush(Qt.white)
-            painter.setPen(Qt.NoPen)
-            painter.drawRoundedRect(bg_rect, 3, 3)
-
-            painter.setPen(Qt.black)
-            painter.drawText(text_x, text_y, text)
-
+            painter.setFont(self._time_font()[0])
+            self._draw_text_background(painter, layout.time_rect)
+            self._draw_text(painter, text, layout.time_pos)
         finally:
             painter.restore()
 
-    def _configure_font(self, painter, text, roi_rect):
-        """Настройка оптимального размера шрифта"""
-        font = QFont()
-        font.setBold(True)
+    def _status_font(self, font_size):
+        """Жирный шрифт статуса и его метрики (создаются один раз на размер)"""
+        if font_size not in self._fonts:
+            font = QFont()
+            font.setBold(True)
+            font.setPointSize(font_size)
+            self._fonts[font_size] = (font, QFontMetrics(font))
+        return self._fonts[font_size]
+
+    def _time_font(self):
+        """Шрифт времени работы (меньший размер) и его метрики"""
+        if 'time' not in self._fonts:
+            font = QFont()
+            font.setPointSize(8)
+            self._fonts['time'] = (font, QFontMetrics(font))
+        return self._fonts['time']
 
+    def _configure_font(self, text, roi_rect):
+        """Подбор оптимального размера шрифта: (шрифт, метрики)"""
         padding = 5
-        margin = 2
         max_width = roi_rect.width() - 2 * padding
         max_height = roi_rect.height() // 3
 
         for font_size in range(12, 7, -1):  # От 12 до 8
-            font.setPointSize(font_size)
-            metrics = QFontMetrics(font)
+            font, metrics = self._status_font(font_size)
             if (metrics.horizontalAdvance(text) <= max_width and
                     metrics.height() <= max_height):
-                painter.setFont(font)
-                return font
+                return font, metrics
 
-        font.setPointSize(8)
-        painter.setFont(font)
-        return font
+        return self._status_font(8)
 
     def _calculate_text_position(self, metrics, text, roi_rect):
         """Вычисление позиции текста и фона"""
@@ -232,6 +365,26 @@ class MainWindow(QMainWindow):
         return (QPoint(text_x, text_y),
                 QRect(bg_x, bg_y, bg_width, bg_height))
 
+    def _calculate_time_position(self, text, roi_rect):
+        """Позиция времени работы (нижний левый угол с отступом) и его фона"""
+        metrics = self._time_font()[1]
+        padding = 5
+        margin = 2
+        text_width = metrics.horizontalAdvance(text)
+        text_height = metrics.height()
+
+        text_x = roi_rect.x() + padding
+        text_y = roi_rect.y() + roi_rect.height() - padding
+
+        # Прямоугольник фона
+        bg_rect = QRect(
+            text_x - margin,
+            text_y - text_height - margin,
+            text_width + 2 * margin,
+            text_height + 2 * margin
+        )
+        return QPoint(text_x, text_y), bg_rect
+
     def _draw_text_background(self, painter, rect):
         """Отрисовка фона для текста"""
         painter.setBrush(Qt.white)
@@ -247,9 +400,17 @@ class MainWindow(QMainWindow):
 
     # region ROI Handling
     @pyqtSlot(list)
-    def handle_rectangle(self, rectangles):
-        valid_rects = [self.convert_rect(rect) for rect in rectangles]
-        self.signal_send_rect.emit(valid_rects)
+    def handle_rectangle(self, shapes):
+        zones = [self.convert_shape(shape) for shape in shapes]
+        zones = [zone for zone in zones if zone is not None]
+        settings_manager.update_settings({"zones": zones})
+        self.signal_send_rect.emit(zones)
+
+    def convert_shape(self, shape):
+        """Зона виджета -> относительные координаты кадра (0..1)"""
+        if isinstance(shape, QPolygon):
+            return self.convert_polygon(shape)
+        return self.convert_rect(shape)
 
     def convert_rect(self, rect):
         if not self.current_scaled_rect:
@@ -259,24 +420,55 @@ class MainWindow(QMainWindow):
         if not intersected.isValid():
             return None
 
-        x = (intersected.x() - self.current_scaled_rect.x()) * self.scale_factors[0]
-        y = (intersected.y() - self.current_scaled_rect.y()) * self.scale_factors[1]
-        width = intersected.width() * self.scale_factors[0]
-        height = intersected.height() * self.scale_factors[1]
-
+        scaled = self.current_scaled_rect
         return [
-            int(round(x)),
-            int(round(y)),
-            int(round(width)),
-            int(round(height))
+            round((intersected.x() - scaled.x()) / scaled.width(), 5),
+            round((intersected.y() - scaled.y()) / scaled.height(), 5),
+            round(intersected.width() / scaled.width(), 5),
+            round(intersected.height() / scaled.height(), 5)
         ]
 
+    def convert_polygon(self, polygon):
+        if not self.current_scaled_rect:
+            return None
+
+        scaled = self.current_scaled_rect
+        points = []
+        for i in range(polygon.count()):
+            point = polygon.point(i)
+            x = min(max(point.x() - scaled.x(), 0), scaled.width())
+            y = min(max(point.y() - scaled.y(), 0), scaled.height())
+            points.append([round(x / scaled.width(), 5), round(y / scaled.height(), 5)])
+        return points
+
+    def restore_zones(self):
+        """Отображение сохраненных зон в координатах виджета"""
+        if not self.current_scaled_rect:
+            return
+        scaled = self.current_scaled_rect
+        shapes = []
+        for zone in normalize_zones(settings_manager.settings["zones"]):
+            if is_polygon(zone):
+                shapes.append(QPolygon([
+                    QPoint(scaled.x() + int(x * scaled.width()), scaled.y() + int(y * scaled.height()))
+                    for x, y in zone
+                ]))
+            else:
+                x, y, w, h = zone
+                shapes.append(QRect(scaled.x() + int(x * scaled.width()),
+                                    scaled.y() + int(y * scaled.height()),
+                                    int(w * scaled.width()),
+                                    int(h * scaled.height())))
+        self.drawing_widget.set_shapes(shapes)
+        self.zones_restored = True
+
     def eventFilter(self, source, event):
         if source == self.ui.lbl_frame and event.type() == QEvent.Resize:
             self.drawing_widget.setGeometry(0, 0,
                                             source.width(),
                                             source.height()
                                             )
+            self.zones_restored = False
         return super().eventFilter(source, event)
 
     # endregion
@@ -296,6 +488,19 @@ class MainWindow(QMainWindow):
         settings_manager.update_settings({
             "rtsp_or_path": self.ui.lbl_path.text()
         })
+        self.show_clip_preview(self.ui.lbl_path.text())
+
+    def show_clip_preview(self, path):
+        """Полоса миниатюр и сводка записанного клипа по его индексу (до запуска анализа)"""
+        index = load_clip_index(path)
+        if index is None:
+            return
+        self.statusBar().showMessage(f"Клип: {describe_clip_index(index)}")
+        thumbs = index_paths(path)[1]
+        if index.get('thumbnails') and not self.ui.btn_start.isChecked():
+            pixmap = QPixmap(thumbs)
+            if not pixmap.isNull():
+                self.ui.lbl_frame.setPixmap(pixmap.scaledToWidth(self.ui.lbl_frame.width()))
 
     # endregion
 
@@ -304,10 +509,41 @@ class MainWindow(QMainWindow):
     def run(self):
         self.signal_run.emit(self.ui.btn_start.isChecked())
 
+    @pyqtSlot(object)
+    def put_detect_status(self, delta):
+        """Применение изменений состояния зон (DetectionDelta)"""
+        if delta.layout_changed:
+            self._overlays.clear()
+            self._sparklines.clear()
+            self.history.reset(delta.count)
+        self.detect.apply(delta)
+        records = self.detect.records
+        self.history.add(time.time(), records['activity'], records['detected'])
+        print(f'Detection status: {delta}')
+
     @pyqtSlot(list)
-    def put_detect_status(self, detect):
-        self.detect = detect
-        print(f'Detection status: {detect}')
+    def put_objects(self, objects):
+        """Объекты YOLO от сервера инференса [(label, confidence, box)]"""
+        self.objects = objects
+        self.objects_time = time.time()
+
+    @pyqtSlot(dict)
+    def put_stream_health(self, health):
+        """Состояние видеопотока в строке статуса"""
+        text = f"{health['state']} | {health['fps']} fps | переподключений: {health['reconnects']}"
+        if health['state'] != "streaming" and health.get('last_error'):
+            text += f" | {health['last_error']}"
+        self.statusBar().showMessage(text)
+
+    @pyqtSlot(dict)
+    def put_governor_stats(self, stats):
+        """Выбранная регулятором частота и разрешение анализа"""
+        text = f"анализ: {stats['rate']} кадр/с" if stats['rate'] else "анализ: без паузы"
+        if stats['scale'] < 1.0:
+            text += f" × {stats['scale']}"
+        if stats['boost']:
+            text += " (движение)"
+        self.lbl_governor.setText(text)
 
     # endregion
 
@@ -338,6 +574,11 @@ class MainWindow(QMainWindow):
         )
 
     def clear_holst(self):
+        self.history.pause(time.time())
+        self.detect.clear()
+        self._overlays.clear()
+        self._sparklines.clear()
+        self.objects = []
         self.ui.lbl_frame.clear()
         self.ui.lbl_bin.clear()
     # endregion
\ No newline at end of file
@@ -91,6 +91,9 @@ class Ui_MainWindow(object):
         self.btn_settings.setCheckable(False)
         self.btn_settings.setObjectName("btn_settings")
         self.horizontalLayout_3.addWidget(self.btn_settings)
+        self.cb_polygon = QtWidgets.QCheckBox(self.frame_4)
+        self.cb_polygon.setObjectName("cb_polygon")
+        self.horizontalLayout_3.addWidget(self.cb_polygon)
         self.verticalLayout_2.addWidget(self.frame_4)
         self.verticalLayout.addWidget(self.frame_2, 0, QtCore.Qt.AlignBottom)
         MainWindow.setCentralWidget(self.centralwidget)
@@ -107,3 +110,4 @@ class Ui_MainWindow(object):
         self.cb_webcam.setText(_translate("MainWindow", "Use a webcam"))
         self.btn_start.setText(_translate("MainWindow", "Start"))
         self.btn_settings.setText(_translate("MainWindow", "Settings"))
+        self.cb_polygon.setText(_translate("MainWindow", "Polygon zones"))
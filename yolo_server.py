@@ -0,0 +1,44 @@
+import sys
+import argparse
+from utils.offline_analyzer import load_settings
+from utils.inference_server import InferenceServer, server_options, resolve_authkey
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Сервер пакетного инференса YOLO для бота, app.py и всех камер")
+    parser.add_argument("--settings", default="settings.json", help="Файл настроек")
+    parser.add_argument("--address", default=None, help="Адрес host:port (по умолчанию yolo_server из настроек)")
+    parser.add_argument("--model", default=None, help="Модель (по умолчанию yolo_model из настроек)")
+    parser.add_argument("--batch-size", type=int, default=None, help="Максимальный размер пакета")
+    parser.add_argument("--batch-window", type=float, default=None, help="Окно набора пакета, сек")
+    parser.add_argument("--queue", type=int, default=32, help="Очередь запросов, сверх нее кадры отклоняются")
+    parser.add_argument("--imgsz", type=int, default=640, help="Размер входа модели")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    settings = load_settings(args.settings)
+    address = args.address or settings.get("yolo_server") or "127.0.0.1:6010"
+    try:
+        authkey = resolve_authkey(settings, address)
+    except (ValueError, OSError) as e:
+        print(f"[InferenceServer] {e}")
+        return 2
+    options = server_options(settings)
+    if args.batch_size is not None:
+        options['batch_size'] = args.batch_size
+    if args.batch_window is not None:
+        options['batch_window'] = args.batch_window
+    server = InferenceServer(args.model or settings.get("yolo_model", "yolo11n.pt"), address, authkey,
+                             max_queue=args.queue, imgsz=args.imgsz, **options)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())